@@ -11,19 +11,61 @@ Mục tiêu:
 - Phân tích toàn diện văn bản trong một lần gọi API duy nhất.
 - ƯU TIÊN: Spell & Term Normalization (Surface Quality) chạy trước,
   sau đó mới phân tích các vấn đề logic / khái niệm.
+- Khi LOCAL_SPELLING_ENABLED (mặc định), spelling chạy local (spell_checker.py)
+  → prompt + response_schema bỏ hẳn subtask spelling_errors.
+- Pre-detectors rule-based (pre_detectors.py) chạy trước Gemini: gợi ý được chèn
+  vào prompt; ở mode "fast", subtask đủ chắc được thay bằng kết quả local, và
+  nếu không còn subtask nào thì bỏ qua hẳn lời gọi LLM.
+- Caller chọn subtasks cần lấy (mặc định cả 5): prompt + response_schema chỉ gồm
+  các subtask đó; block LLM được cache theo từng subtask (analysis_cache.py).
+- Prompt gửi tách: system_instruction tĩnh (PromptTemplate, biên dịch sẵn) + user
+  message chỉ gồm context / hints / văn bản. Phần tĩnh được cache phía server
+  (context_cache.py, Gemini CachedContent) → mỗi request chỉ tính token văn bản.
 """
 
-from typing import Dict, Any, List, Optional
+from typing import Dict, Any, Callable, Iterable, List, Optional, Tuple
+import copy
+import dataclasses
 import json
+import logging
 import os
+import threading
+import time
 from datetime import datetime
 
-import google.generativeai as genai
-from google.generativeai import GenerationConfig
 from dotenv import load_dotenv
 
-from .promptStore import prompt_analysis, prompt_analysis_vi
+from .context_cache import context_cache
+from .json_stream import StreamingObjectParser
+from .llm_backend import (
+    CachedContentNotFound,
+    LLMBackend,
+    LLMRequest,
+    LLMResponse,
+    get_llm_backend,
+)
+from .rate_limiter import estimated_request_tokens, governed_call, is_retryable_error
+from .circuit_breaker import (
+    LLM_ERRORS,
+    LLM_SECONDS,
+    breaker_enabled,
+    hedge_delay,
+    hedge_enabled,
+    hedged_call,
+    is_degradable_error,
+    llm_breaker,
+    llm_latency,
+)
+from .analysis_cache import analysis_cache, analysis_cache_enabled, content_fingerprint
+from .pre_detectors import PreDetection, PreDetectionDocument, pre_detectors_enabled, run_pre_detectors
+from .promptStore import UNIFIED_SUBTASKS, PromptTemplate, get_prompt_template, prompt_version
+from .spell_checker import check_spelling, local_spelling_enabled
 from .term_normalizer import NormalizationResult, normalize_text
+from ...core.metrics import StageTimer, gauge
+
+logger = logging.getLogger(__name__)
+
+ANALYSES_IN_PROGRESS = gauge("analysis_in_progress", "analyze_document calls currently running")
 
 # -------------------------------------------------------------------
 # Gemini config: đọc từ biến môi trường (.env backend)
@@ -32,12 +74,8 @@ from .term_normalizer import NormalizationResult, normalize_text
 load_dotenv()
 
 GEMINI_MODEL = os.getenv("GEMINI_MODEL", "gemini-2.5-flash")
-GEMINI_API_KEY = os.getenv("GEMINI_API_KEY")
-
-if not GEMINI_API_KEY:
-    raise ValueError("GEMINI_API_KEY not found in environment variables")
-
-genai.configure(api_key=GEMINI_API_KEY)
+# API key được kiểm tra lười khi tạo GeminiBackend (llm_backend.py) → import
+# module không cần key; LLM_BACKEND=fake chạy offline hoàn toàn.
 
 # -------------------------------------------------------------------
 # JSON schema cho Gemini
@@ -215,23 +253,329 @@ RESPONSE_SCHEMA: Dict[str, Any] = {
 }
 
 
+def build_response_schema(subtasks: Iterable[str]) -> Dict[str, Any]:
+    """
+    RESPONSE_SCHEMA chỉ giữ các block của subtasks được yêu cầu
+    (+ analysis_metadata, summary) → Gemini không sinh token cho block thừa.
+    """
+    wanted = set(subtasks)
+    dropped = [name for name in UNIFIED_SUBTASKS if name not in wanted]
+    schema = copy.deepcopy(RESPONSE_SCHEMA)
+    for name in dropped:
+        schema["properties"].pop(name, None)
+    schema["required"] = [name for name in schema["required"] if name not in dropped]
+    return schema
+
+
+def _merge_spelling_items(
+    block: Dict[str, Any],
+    new_items: List[Dict[str, Any]],
+) -> Dict[str, Any]:
+    """
+    Gộp item spelling vào block, bỏ item trùng (cùng vị trí + chuỗi)
+    hoặc chồng lấn vị trí với item đã có.
+    """
+    items = block.get("items") or []
+    spans = [
+        (it.get("start_pos"), it.get("end_pos"))
+        for it in items
+        if isinstance(it.get("start_pos"), int) and isinstance(it.get("end_pos"), int)
+    ]
+    seen_keys = {
+        (it.get("start_pos"), it.get("end_pos"), (it.get("original") or "").lower())
+        for it in items
+    }
+
+    for item in new_items:
+        start, end = item.get("start_pos"), item.get("end_pos")
+        key = (start, end, (item.get("original") or "").lower())
+        if key in seen_keys:
+            continue
+        if isinstance(start, int) and isinstance(end, int) and start >= 0:
+            if any(s < end and start < e for s, e in spans):
+                continue
+            spans.append((start, end))
+        items.append(item)
+        seen_keys.add(key)
+
+    block["items"] = items
+    block["total_found"] = len(items)
+    return block
+
+
+def _stream_llm_call(
+    backend: LLMBackend,
+    request: LLMRequest,
+    template: PromptTemplate,
+    model_name: str,
+    user_key: str,
+    on_block: Optional[Callable[[str, Any], None]] = None,
+) -> Tuple[LLMRequest, LLMResponse, StreamingObjectParser]:
+    """
+    1 lượt gọi LLM (limiter + breaker + hedge) dạng stream; block top-level được
+    parse ngay khi đóng. Stream đứt giữa chừng sau khi đã có block hoàn chỉnh →
+    giữ phần đã có thay vì gọi lại từ đầu.
+    """
+
+    def _send():
+        sent = request
+        started = time.perf_counter()
+        parser = StreamingObjectParser()
+
+        def _on_text(chunk: str) -> None:
+            for name, value in parser.feed(chunk):
+                if on_block is not None:
+                    on_block(name, value)
+
+        try:
+            try:
+                response = backend.generate_stream(sent, _on_text)
+            except CachedContentNotFound:
+                # Handle hết hạn phía server: bỏ handle, gửi inline ngay lần này
+                context_cache.invalidate(backend, model_name, template)
+                sent = dataclasses.replace(
+                    sent, cached_content=None, system_instruction=template.system_instruction
+                )
+                parser = StreamingObjectParser()
+                response = backend.generate_stream(sent, _on_text)
+        except Exception as exc:
+            LLM_ERRORS.labels(backend=backend.name, error=type(exc).__name__).inc()
+            if not parser.completed or not is_retryable_error(exc):
+                raise
+            logger.warning(
+                "LLM stream interrupted (%s) after blocks %s", type(exc).__name__, list(parser.completed)
+            )
+            response = LLMResponse(text=parser.buffer, output_tokens=len(parser.buffer) // 4)
+        elapsed = time.perf_counter() - started
+        llm_latency.observe(elapsed)
+        LLM_SECONDS.labels(backend=backend.name).observe(elapsed)
+        return sent, response, parser
+
+    def _governed():
+        return governed_call(
+            lambda: llm_breaker.call(_send) if breaker_enabled() else _send(),
+            user_key=user_key,
+            estimated_tokens=estimated_request_tokens(request.prompt, request.system_instruction),
+            usage=lambda sent_response: sent_response[1].prompt_tokens + sent_response[1].output_tokens,
+        )
+
+    if breaker_enabled():
+        llm_breaker.check()  # breaker mở → fail fast, không xếp hàng ở limiter
+    return hedged_call(_governed, hedge_delay() if hedge_enabled() else None)
+
+
+def _generate_llm_result(
+    prompt: str,
+    template: PromptTemplate,
+    model_name: str,
+    call_info: Optional[Dict[str, Any]] = None,
+    user_key: str = "anonymous",
+    render: Optional[Callable[[PromptTemplate], str]] = None,
+    on_block: Optional[Callable[[str, Any], None]] = None,
+    timer: Optional[StageTimer] = None,
+) -> Tuple[Optional[Dict[str, Any]], Optional[Exception]]:
+    """
+    Gọi LLM backend (stream + parse tăng dần) → (llm_result, last_error).
+    prompt: phần động của template. System instruction tĩnh đi qua cached-content
+    handle (context_cache) nếu có, không thì gửi inline.
+    Mọi lời gọi đi qua rate_limiter (RPM/TPM, hàng đợi công bằng theo user_key,
+    backoff khi 429/5xx) và circuit breaker (mở → CircuitOpenError ngay); hedge
+    thêm 1 lần sau p95 latency nếu LLM_HEDGE_ENABLED.
+
+    Output bị cắt / hỏng: block đã đóng được giữ, chỉ gọi lại 1 lần cho các block
+    còn thiếu (render(template_con) dựng prompt cho tập subtask đó; không có
+    render thì gửi lại prompt cũ). Vẫn thiếu → dùng bản repair dở dang nếu có.
+    on_block(name, value): gọi ngay khi 1 block top-level đóng trong stream.
+    timer: cộng "llm" (chờ limiter + gọi provider) và "parse" (CPU parse JSON) mỗi lượt.
+
+    EN: dùng response_schema đầy đủ (ổn định, ít biến thể).
+    VI: bỏ response_schema để Gemini tự do trả thêm spelling_errors,
+        vì tiếng Việt + mix EN-VI nhiều, schema cứng quá thì model hay skip block này.
+    """
+    backend = get_llm_backend()
+    info = call_info if call_info is not None else {}
+    usage = {"prompt_tokens": 0, "output_tokens": 0, "cached_tokens": 0}
+    stream_info: Dict[str, List[str]] = {"streamed": [], "repaired": [], "rerequested": [], "partial": []}
+    info.update({"backend": backend.name, "cached_content": None, "usage": usage, "stream": stream_info})
+
+    emitted: set = set()
+    emit_lock = threading.Lock()
+
+    def _emit_once(name: str, value: Any) -> None:
+        # hedge có thể stream cùng 1 block 2 lần
+        with emit_lock:
+            if name in emitted:
+                return
+            emitted.add(name)
+        if on_block is not None:
+            on_block(name, value)
+
+    merged: Dict[str, Any] = {}
+    partial: Dict[str, Any] = {}
+    last_error: Optional[Exception] = None
+    current_template, current_prompt = template, prompt
+
+    for attempt in range(2):
+        handle = context_cache.handle_for(backend, model_name, current_template)
+        request = LLMRequest(
+            model=model_name,
+            prompt=current_prompt,
+            subtasks=current_template.subtasks,
+            language=current_template.language,
+            template_key=f"{current_template.language}:{current_template.version}",
+            system_instruction=None if handle else current_template.system_instruction,
+            cached_content=handle.name if handle else None,
+            response_schema=(
+                None
+                if current_template.language == "vi"
+                else build_response_schema(current_template.subtasks)
+            ),
+        )
+        call_started = time.perf_counter()
+        sent, response, parser = _stream_llm_call(
+            backend, request, current_template, model_name, user_key, on_block=_emit_once
+        )
+        call_seconds = time.perf_counter() - call_started
+        stream_parse_seconds = parser.elapsed
+        info["cached_content"] = sent.cached_content
+        usage["prompt_tokens"] += response.prompt_tokens
+        usage["output_tokens"] += response.output_tokens
+        usage["cached_tokens"] += response.cached_tokens
+
+        recovered = parser.finish()
+        if timer is not None:
+            timer.add("llm", call_seconds - stream_parse_seconds)
+            timer.add("parse", parser.elapsed)
+        stream_info["streamed"] += [name for name in parser.completed if name not in stream_info["streamed"]]
+        stream_info["repaired"] += parser.repaired
+        for name, value in parser.completed.items():
+            merged.setdefault(name, value)
+        for name in parser.partial_keys:
+            partial.setdefault(name, recovered[name])
+
+        missing = [name for name in template.subtasks if not isinstance(merged.get(name), dict)]
+        # JSON đủ mà model bỏ block → chấp nhận như trước; chỉ gọi lại khi output hỏng / bị cắt
+        if not missing or (parser.done and not parser.invalid):
+            break
+        last_error = json.JSONDecodeError(
+            f"Incomplete LLM JSON, missing blocks {missing}", parser.buffer, len(parser.buffer)
+        )
+        logger.warning("Incomplete LLM JSON (attempt %d): missing blocks %s", attempt + 1, missing)
+        logger.debug("Response text (first 500 chars): %s", response.text[:500])
+        if attempt == 0:
+            stream_info["rerequested"] = missing
+            if render is not None:
+                current_template = get_prompt_template(template.language, missing)
+                current_prompt = render(current_template)
+
+    for name in template.subtasks:
+        if name not in merged and isinstance(partial.get(name), dict):
+            merged[name] = partial[name]
+            stream_info["partial"].append(name)
+    for name in ("analysis_metadata", "summary"):
+        if name not in merged and name in partial:
+            merged[name] = partial[name]
+
+    if not any(name in merged for name in template.subtasks):
+        return None, last_error or ValueError("LLM response has no analysis blocks")
+    return merged, None
+
+
+def _nli_contradictions(content: str, language: str) -> Optional[Dict[str, Any]]:
+    """Block contradictions từ NLI local (mDeBERTa); None nếu model không dùng được."""
+    try:
+        from .contradictions import check_contradictions
+    except ImportError as exc:  # torch / transformers chưa cài
+        logger.warning("NLI contradictions fallback unavailable: %s", exc)
+        return None
+
+    nli = check_contradictions(content, mode="finetuned" if language == "vi" else "base")
+    if not nli.get("success"):
+        return None
+    doc = PreDetectionDocument.build(content, language)
+    items = []
+    for item in nli.get("contradictions", []):
+        locations = {}
+        for prefix in ("sentence1", "sentence2"):
+            start = item.get(f"{prefix}_start")
+            if isinstance(start, int) and doc.sentences:
+                locations[f"{prefix}_location"] = doc.location(doc.sentence_at(start))
+        items.append(
+            {
+                "id": len(items) + 1,
+                "sentence1": item["sentence1"],
+                "sentence2": item["sentence2"],
+                **locations,
+                "contradiction_type": "logical",
+                "severity": "high" if item.get("confidence", 0) >= 0.9 else "medium",
+                "explanation": f"NLI model: contradiction (confidence {item.get('confidence', 0):.2f})",
+                "suggestion": "",
+            }
+        )
+    return {"total_found": len(items), "items": items}
+
+
+def _local_fallback_blocks(
+    content: str,
+    language: str,
+    subtasks: Iterable[str],
+    pre: Optional[PreDetection],
+) -> Dict[str, Dict[str, Any]]:
+    """
+    Kết quả local-only khi LLM không dùng được (breaker mở, hết retry):
+    contradictions từ NLI (LLM_FALLBACK_NLI), các subtask khác lấy item của
+    pre-detectors nếu có. Spelling rule-based / local vẫn merge ở bước 5.
+    """
+    blocks: Dict[str, Dict[str, Any]] = {}
+    for name in subtasks:
+        if name == "contradictions" and os.getenv("LLM_FALLBACK_NLI", "true").lower() in ("1", "true", "yes", "on"):
+            try:
+                block = _nli_contradictions(content, language)
+            except Exception as exc:  # noqa: BLE001 - fallback không được làm hỏng response
+                logger.warning("NLI contradictions fallback failed: %s", exc)
+                block = None
+            if block is not None:
+                blocks[name] = block
+                continue
+        if pre is not None and name in pre.items:
+            items = pre.items[name]
+            blocks[name] = {"total_found": len(items), "items": items}
+    return blocks
+
+
 def analyze_document(
     context: Dict[str, Any],
     content: str,
     language: str = "en",
     mode: str = "fast",  # chỉ để log, không đổi model
+    subtasks: Optional[Iterable[str]] = None,
+    user_key: Optional[str] = None,
+    on_block: Optional[Callable[[str, Any], None]] = None,
 ) -> Dict[str, Any]:
     """
     Phân tích toàn diện văn bản với 5 subtasks trong một lần gọi.
     (4 logic + 1 spelling)
 
+    subtasks: tập con của UNIFIED_SUBTASKS cần trả về (None = cả 5). Block của
+    subtask không được yêu cầu giữ giá trị rỗng mặc định.
+
+    user_key: id người gọi cho hàng đợi công bằng của rate_limiter (None = anonymous).
+    on_block(name, block): callback khi 1 block LLM đóng trong stream (trước khi
+    cả response xong), vd. để đẩy kết quả sớm cho FE.
+
     Flow ưu tiên:
-    1) Spell & Term Normalization (rule-based) → phát hiện lỗi chính tả rõ ràng trước.
-    2) Gọi Gemini unified analysis (5 subtasks).
-    3) Merge lỗi chính tả rule-based vào block spelling_errors của kết quả cuối.
+    1) Spell & Term Normalization (rule-based) + spelling local (SymSpell / bigram VI)
+       → phát hiện lỗi chính tả rõ ràng trước.
+    2) Gọi Gemini unified analysis (4 subtasks logic; thêm spelling nếu tắt local).
+    3) Merge lỗi chính tả rule-based + local vào block spelling_errors của kết quả cuối.
+
+    mode "fast": subtask mà pre-detectors đủ chắc (>= PRE_DETECTOR_CONFIDENCE) được
+    giải local; văn bản đơn giản có thể không cần gọi Gemini. mode "deep": chỉ dùng
+    pre-detectors làm hints trong prompt.
     """
 
     selected_model = GEMINI_MODEL  # luôn dùng 1 model Gemini 2.5
+    timer = StageTimer("analyze_document")
 
     result: Dict[str, Any] = {
         "success": False,
@@ -260,9 +604,18 @@ def analyze_document(
             "error": None,
             "normalization": {},
             "spelling_errors_rule_based": [],
+            "spelling_errors_local": [],
+            "spelling_engine": "llm",
+            "pre_detection": {},
+            "subtasks": [],
+            "cache": {"hits": [], "misses": []},
+            "prompt_version": None,
+            "llm": {},
+            "timings": {},
         },
     }
 
+    ANALYSES_IN_PROGRESS.inc()
     try:
         # -------- Validate input --------
         if not content or not content.strip():
@@ -277,86 +630,176 @@ def analyze_document(
             result["metadata"]["error"] = f"Invalid language '{language}'. Use 'en' or 'vi'."
             return result
 
+        wanted = set(UNIFIED_SUBTASKS if subtasks is None else subtasks)
+        unknown = sorted(wanted - set(UNIFIED_SUBTASKS))
+        if unknown or not wanted:
+            result["metadata"]["error"] = (
+                f"Invalid subtasks {unknown or '[]'}. Choose from {list(UNIFIED_SUBTASKS)}."
+            )
+            return result
+        requested = [name for name in UNIFIED_SUBTASKS if name in wanted]
+        result["metadata"]["subtasks"] = requested
+        timer.lap("validate")
+
         # -------- 1) SPELL & TERM NORMALIZATION (ưu tiên chạy TRƯỚC) --------
-        norm: NormalizationResult = normalize_text(content, language=language)
+        norm: NormalizationResult = normalize_text(
+            content, language=language, domain=context.get("domain")
+        )
+        timer.lap("normalization")
 
         # Đưa thông tin normalization vào metadata
         result["metadata"]["normalization"] = {
             "changed": norm.normalized_text != norm.original_text,
             "total_spelling_corrections": len(getattr(norm, "spelling_corrections", [])),
             "total_term_mappings": len(getattr(norm, "term_mappings", [])),
+            "dictionary_version": norm.dictionary_version,
         }
         result["metadata"]["spelling_errors_rule_based"] = getattr(
             norm, "spelling_corrections", []
         )
 
         if norm.normalized_text != norm.original_text:
-            print(
-                f"[Normalization] Text normalized (light) "
-                f"(spelling_corrections={result['metadata']['normalization']['total_spelling_corrections']}, "
-                f"term_mappings={result['metadata']['normalization']['total_term_mappings']})"
+            logger.debug("Text normalized (light)", extra=result["metadata"]["normalization"])
+
+        # -------- 1b) Spelling local: có vị trí chính xác, LLM không cần làm lại --------
+        llm_subtasks = list(requested)
+        local_spelling: List[Dict[str, Any]] = []
+        if "spelling_errors" in requested and local_spelling_enabled():
+            local_spelling = check_spelling(content, language=language)
+            llm_subtasks.remove("spelling_errors")
+            result["metadata"]["spelling_engine"] = "local"
+        result["metadata"]["spelling_errors_local"] = local_spelling
+        timer.lap("spelling")
+
+        # -------- 1c) Pre-detectors: hints cho prompt / thay subtask đủ chắc --------
+        pre: Optional[PreDetection] = None
+        resolved_locally: List[str] = []
+        hints: List[str] = []
+        if pre_detectors_enabled():
+            pre = run_pre_detectors(content, language=language)
+            if mode == "fast":
+                resolved = pre.resolved_subtasks()
+                resolved_locally = [name for name in llm_subtasks if name in resolved]
+                llm_subtasks = [name for name in llm_subtasks if name not in resolved]
+            result["metadata"]["pre_detection"] = {
+                **pre.summary(),
+                "resolved_subtasks": resolved_locally,
+            }
+            result["analysis_metadata"]["total_paragraphs"] = pre.shared.get("total_paragraphs", 0)
+            result["analysis_metadata"]["total_sentences"] = pre.shared.get("total_sentences", 0)
+        timer.lap("pre_detection")
+
+        # -------- 1d) Cache theo subtask: chỉ gọi LLM cho phần chưa có --------
+        fingerprint: Optional[str] = None
+        cached: Dict[str, Dict[str, Any]] = {}
+        if llm_subtasks and analysis_cache_enabled():
+            fingerprint = content_fingerprint(
+                content, language, context, norm.dictionary_version, prompt_version(language)
             )
+            cached = analysis_cache.get_many(fingerprint, llm_subtasks)
+            llm_subtasks = [name for name in llm_subtasks if name not in cached]
+        result["metadata"]["cache"] = {"hits": list(cached), "misses": list(llm_subtasks)}
+        timer.count("cache_hits", len(cached))
+        timer.count("cache_misses", len(llm_subtasks) if fingerprint is not None else 0)
+        timer.lap("cache_lookup")
+
+        if pre is not None:
+            hints = pre.hints_for(llm_subtasks)
+            result["metadata"]["pre_detection"]["llm_subtasks"] = list(llm_subtasks)
 
         # DÙ đã normalize, vẫn feed VĂN BẢN GỐC vào Gemini
         normalized_content_for_llm = content
 
-        # -------- 2) Build prompt theo ngôn ngữ --------
-        if language == "vi":
-            prompt = prompt_analysis_vi(context, normalized_content_for_llm)
-            print("Sử dụng prompt tiếng Việt...")
-        else:
-            prompt = prompt_analysis(context, normalized_content_for_llm)
-            print("Using English prompt...")
-
         result["analysis_metadata"]["language"] = language
 
-        # -------- 3) Gọi Gemini với cấu hình phù hợp ngôn ngữ --------
-        #
-        # EN: dùng response_schema đầy đủ (ổn định, ít biến thể).
-        # VI: bỏ response_schema để Gemini tự do trả thêm spelling_errors,
-        #     vì tiếng Việt + mix EN-VI nhiều, schema cứng quá thì model hay skip block này.
-        if language == "vi":
-            generation_config = GenerationConfig(
-                response_mime_type="application/json",
+        llm_result: Dict[str, Any] = {}
+        if llm_subtasks:
+            # -------- 2) Build prompt theo ngôn ngữ (template tĩnh + phần động) --------
+            template = get_prompt_template(language, llm_subtasks)
+            prompt = template.render(context, normalized_content_for_llm, hints=hints)
+            result["metadata"]["prompt_version"] = template.version
+            timer.count("prompt_chars", len(prompt))
+
+            # -------- 3) Gọi Gemini với cấu hình phù hợp ngôn ngữ --------
+            logger.info(
+                "Analyzing document (%d subtasks via LLM)",
+                len(llm_subtasks),
+                extra={"language": language, "model": selected_model, "mode": mode, "subtasks": llm_subtasks},
             )
-        else:
-            generation_config = GenerationConfig(
-                response_mime_type="application/json",
-                response_schema=RESPONSE_SCHEMA,
-            )
-
-        model = genai.GenerativeModel(
-            selected_model,
-            generation_config=generation_config,
-        )
-
-        lang_msg = (
-            "Đang phân tích văn bản toàn diện (5 nhiệm vụ: 4 logic + spelling)..."
-            if language == "vi"
-            else "Analyzing document comprehensively (5 subtasks: 4 logic + spelling)..."
-        )
-        print(f"{lang_msg} | model={selected_model} | mode_flag={mode}")
-
-        last_error: Optional[Exception] = None
-        llm_result: Optional[Dict[str, Any]] = None
-        response_text: str = ""
+            timer.lap("prompt")
 
-        for attempt in range(2):
             try:
-                response = model.generate_content(prompt)
-                response_text = (response.text or "").strip()
-                llm_result = json.loads(response_text)
-                break
-            except json.JSONDecodeError as e:
-                last_error = e
-                print(f"❌ JSON Parse Error (attempt {attempt + 1}): {e}")
-                print(f"Response text (first 500 chars): {response_text[:500]}...")
-
-        if llm_result is None:
-            result["metadata"]["error"] = (
-                f"Failed to parse LLM response as JSON after retries: {last_error}"
-            )
-            return result
+                parsed, last_error = _generate_llm_result(
+                    prompt,
+                    template,
+                    selected_model,
+                    call_info=result["metadata"]["llm"],
+                    user_key=user_key or "anonymous",
+                    render=lambda partial_template: partial_template.render(
+                        context,
+                        normalized_content_for_llm,
+                        hints=pre.hints_for(partial_template.subtasks) if pre is not None else [],
+                    ),
+                    on_block=on_block,
+                    timer=timer,
+                )
+                timer.checkpoint()  # "llm" / "parse" đã được cộng trong _generate_llm_result
+            except Exception as exc:
+                if not is_degradable_error(exc):
+                    raise
+                # Provider lỗi / breaker mở: trả kết quả local-only thay vì chờ timeout
+                logger.warning("LLM unavailable (%s: %s) → local-only analysis", type(exc).__name__, exc)
+                llm_result = _local_fallback_blocks(content, language, llm_subtasks, pre)
+                result["analysis_metadata"]["model"] = "local"
+                result["metadata"]["degraded"] = {
+                    "reason": type(exc).__name__,
+                    "detail": str(exc),
+                    "retry_after": getattr(exc, "retry_after", None),
+                    "skipped_subtasks": [name for name in llm_subtasks if name not in llm_result],
+                    "local_subtasks": sorted(llm_result),
+                }
+                fingerprint = None  # không cache kết quả degraded
+                parsed, last_error = llm_result, None
+                timer.lap("local_fallback")
+            usage = result["metadata"]["llm"].get("usage") or {}
+            for key in ("prompt_tokens", "output_tokens", "cached_tokens"):
+                timer.count(key, usage.get(key, 0))
+            if parsed is None:
+                result["metadata"]["error"] = (
+                    f"Failed to parse LLM response as JSON after retries: {last_error}"
+                )
+                return result
+            llm_result = parsed
+            if fingerprint is not None:
+                # block dựng lại từ stream bị cắt (partial) chưa đủ → không cache, lần sau hỏi lại
+                incomplete = set((result["metadata"]["llm"].get("stream") or {}).get("partial") or ())
+                for name in llm_subtasks:
+                    if name in llm_result and name not in incomplete:
+                        analysis_cache.put(
+                            fingerprint,
+                            name,
+                            {
+                                "block": llm_result[name],
+                                "analysis_metadata": llm_result.get("analysis_metadata"),
+                            },
+                        )
+        elif cached:
+            logger.info("All LLM subtasks served from cache: %s", list(cached))
+        else:
+            result["analysis_metadata"]["model"] = "local"
+            logger.info("All subtasks resolved locally, skip LLM", extra={"mode": mode})
+
+        for name, entry in cached.items():
+            llm_result[name] = entry["block"]
+            if entry.get("analysis_metadata"):
+                llm_result.setdefault("analysis_metadata", entry["analysis_metadata"])
+
+        # VI không có response_schema: bỏ block LLM tự thêm mà caller không yêu cầu
+        llm_result = {
+            key: value
+            for key, value in llm_result.items()
+            if key not in UNIFIED_SUBTASKS or key in requested
+        }
 
         result["success"] = True
 
@@ -421,48 +864,36 @@ def analyze_document(
                     result["spelling_errors"].get("items", []) or []
                 )
 
-        # -------- 5) MERGE lỗi chính tả rule-based vào spelling_errors chính --------
+        # Subtask giải bằng pre-detectors: kết quả local là kết quả cuối
+        for name in resolved_locally:
+            items = pre.items.get(name, [])
+            result[name] = {"total_found": len(items), "items": items}
+
+        # -------- 5) MERGE lỗi chính tả rule-based + local vào spelling_errors chính --------
         try:
             rb_corrections = norm.spelling_corrections or []
         except Exception:
             rb_corrections = []
 
-        if rb_corrections:
-            sp_block = result.get("spelling_errors") or {"total_found": 0, "items": []}
-            items = sp_block.get("items") or []
-
-            seen_keys = {
-                (
-                    it.get("start_pos"),
-                    it.get("end_pos"),
-                    (it.get("original") or "").lower(),
-                )
-                for it in items
+        rb_items = [
+            {
+                "original": corr.get("original", ""),
+                "suggested": corr.get("normalized", ""),
+                "start_pos": corr.get("start_pos", -1),
+                "end_pos": corr.get("end_pos", -1),
+                "language": language,
+                "reason": corr.get("reason", "rule_based_detection"),
             }
+            for corr in rb_corrections
+        ]
 
-            for corr in rb_corrections:
-                key = (
-                    corr.get("start_pos"),
-                    corr.get("end_pos"),
-                    (corr.get("original") or "").lower(),
-                )
-                if key in seen_keys:
-                    continue
-
-                items.append(
-                    {
-                        "original": corr.get("original", ""),
-                        "suggested": corr.get("normalized", ""),
-                        "start_pos": corr.get("start_pos", -1),
-                        "end_pos": corr.get("end_pos", -1),
-                        "language": language,
-                        "reason": corr.get("reason", "rule_based_detection"),
-                    }
-                )
-                seen_keys.add(key)
-
-            sp_block["items"] = items
-            sp_block["total_found"] = len(items)
+        if (rb_items or local_spelling) and "spelling_errors" in requested:
+            sp_block = result.get("spelling_errors") or {"total_found": 0, "items": []}
+            sp_block = _merge_spelling_items(sp_block, rb_items)
+            sp_block = _merge_spelling_items(sp_block, local_spelling)
+            sp_block["items"].sort(
+                key=lambda it: it["start_pos"] if isinstance(it.get("start_pos"), int) else -1
+            )
             result["spelling_errors"] = sp_block
 
         # -------- 6) Summary: tính lại total_issues cho chắc ăn --------
@@ -487,14 +918,17 @@ def analyze_document(
             result["summary"].setdefault("document_quality_score", 0)
             result["summary"].setdefault("key_recommendations", [])
 
-        print(
-            f"✅ Phân tích hoàn tất. "
-            f"Tổng issues: {result['summary'].get('total_issues', 0)}"
-        )
+        timer.lap("merge")
+
+        logger.info("Analysis done", extra={"total_issues": result["summary"].get("total_issues", 0)})
 
     except Exception as e:
         result["metadata"]["error"] = f"Error during analysis: {str(e)}"
-        print(f"❌ Error in analyze_document: {e}")
+        logger.exception("Error in analyze_document")
+    finally:
+        # Mọi nhánh return (kể cả lỗi validate) đều có timings
+        result["metadata"]["timings"] = timer.finish()
+        ANALYSES_IN_PROGRESS.dec()
 
     return result
 
@@ -8,6 +8,7 @@ from .promptStore import (
 )
 from .term_normalizer import (
     normalize_text,
+    get_normalizer_version,
     NormalizationResult
 )
 
@@ -16,5 +17,6 @@ __all__ = [
     "prompt_analysis",
     "prompt_analysis_vi",
     "normalize_text",
+    "get_normalizer_version",
     "NormalizationResult",
 ]
@@ -0,0 +1,107 @@
+"""
+analysis_cache.py
+
+Cache kết quả LLM theo từng subtask
+-----------------------------------
+- Key = hash(content) + language + hash(context) + dictionary_version (normalizer)
+  + tên subtask → kết quả của các tập subtask khác nhau trên cùng văn bản dùng lại
+  được cho nhau (vd. /unsupported-claims rồi /undefined-terms).
+- In-process LRU + TTL, thread-safe. Chỉ cache block do LLM sinh ra; kết quả local
+  (spelling, pre-detectors) đủ rẻ để tính lại.
+"""
+
+from __future__ import annotations
+
+import copy
+import hashlib
+import json
+import os
+import threading
+import time
+from collections import OrderedDict
+from typing import Any, Dict, Iterable, Optional, Tuple
+
+
+DEFAULT_CACHE_SIZE = 512
+DEFAULT_CACHE_TTL = 3600.0  # giây
+
+
+def analysis_cache_enabled() -> bool:
+    return os.getenv("ANALYSIS_CACHE_ENABLED", "true").strip().lower() in ("1", "true", "yes", "on")
+
+
+def _digest(value: str) -> str:
+    return hashlib.sha256(value.encode("utf-8")).hexdigest()
+
+
+def content_fingerprint(
+    content: str,
+    language: str,
+    context: Optional[Dict[str, Any]],
+    *extra: str,
+) -> str:
+    """
+    Phần chung của key cho mọi subtask: văn bản + ngôn ngữ + ngữ cảnh + các version
+    ảnh hưởng tới output (dictionary_version, ...).
+    """
+    context_json = json.dumps(context or {}, sort_keys=True, ensure_ascii=False, default=str)
+    parts = [_digest(content), language, _digest(context_json), *extra]
+    return _digest("\x1f".join(parts))
+
+
+class AnalysisCache:
+    """LRU + TTL cho block kết quả theo (fingerprint, subtask)."""
+
+    def __init__(self, max_entries: int = DEFAULT_CACHE_SIZE, ttl_seconds: float = DEFAULT_CACHE_TTL):
+        self.max_entries = max_entries
+        self.ttl_seconds = ttl_seconds
+        self._entries: "OrderedDict[Tuple[str, str], Tuple[float, Dict[str, Any]]]" = OrderedDict()
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, fingerprint: str, subtask: str) -> Optional[Dict[str, Any]]:
+        key = (fingerprint, subtask)
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None or entry[0] < time.monotonic():
+                if entry is not None:
+                    del self._entries[key]
+                self.misses += 1
+                return None
+            self._entries.move_to_end(key)
+            self.hits += 1
+            return copy.deepcopy(entry[1])
+
+    def get_many(self, fingerprint: str, subtasks: Iterable[str]) -> Dict[str, Dict[str, Any]]:
+        found: Dict[str, Dict[str, Any]] = {}
+        for subtask in subtasks:
+            entry = self.get(fingerprint, subtask)
+            if entry is not None:
+                found[subtask] = entry
+        return found
+
+    def put(self, fingerprint: str, subtask: str, value: Dict[str, Any]) -> None:
+        if self.max_entries <= 0:
+            return
+        expires_at = time.monotonic() + self.ttl_seconds
+        with self._lock:
+            self._entries[(fingerprint, subtask)] = (expires_at, copy.deepcopy(value))
+            self._entries.move_to_end((fingerprint, subtask))
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+
+    def clear(self) -> None:
+        with self._lock:
+            self._entries.clear()
+            self.hits = 0
+            self.misses = 0
+
+    def __len__(self) -> int:
+        return len(self._entries)
+
+
+analysis_cache = AnalysisCache(
+    max_entries=int(os.getenv("ANALYSIS_CACHE_SIZE", DEFAULT_CACHE_SIZE)),
+    ttl_seconds=float(os.getenv("ANALYSIS_CACHE_TTL", DEFAULT_CACHE_TTL)),
+)
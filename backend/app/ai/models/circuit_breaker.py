@@ -0,0 +1,334 @@
+"""
+circuit_breaker.py
+
+Circuit breaker + hedged requests cho lời gọi LLM
+--------------------------------------------------
+- CircuitBreaker: tỉ lệ lỗi (429/5xx/timeout) trong cửa sổ LLM_BREAKER_WINDOW
+  giây vượt LLM_BREAKER_FAILURE_RATE (và đủ LLM_BREAKER_MIN_CALLS lời gọi) → OPEN:
+  mọi lời gọi fail fast bằng CircuitOpenError trong LLM_BREAKER_OPEN_SECONDS,
+  analyze_document trả kết quả local-only. Hết thời gian → HALF_OPEN cho 1 lời
+  gọi thử; thành công → CLOSED, lỗi → OPEN lại.
+- LatencyTracker: latency các lời gọi thành công gần nhất → p95.
+- hedged_call(): (tuỳ chọn, LLM_HEDGE_ENABLED) lời gọi chưa xong sau p95 thì bắn
+  thêm 1 lần nữa, lấy kết quả nào về trước → chặn đuôi p99 khi provider chậm.
+  Pool hedge hết slot (LLM_HEDGE_WORKERS lời gọi đang chạy) → không hedge, chờ
+  lời gọi gốc (llm_hedges_skipped_total) thay vì xếp hàng thêm 1 bản.
+"""
+
+from __future__ import annotations
+
+import logging
+import os
+import threading
+import time
+from collections import deque
+from concurrent.futures import FIRST_COMPLETED, Future, ThreadPoolExecutor, wait
+from concurrent.futures import TimeoutError as FutureTimeout
+from typing import Callable, Deque, List, Optional, Tuple, TypeVar
+
+try:
+    from .llm_backend import LLMError
+    from .rate_limiter import LLMQueueTimeout, is_retryable_error
+    from ...core.metrics import counter, gauge, histogram
+except ImportError:
+    from llm_backend import LLMError
+    from rate_limiter import LLMQueueTimeout, is_retryable_error
+    from app.core.metrics import counter, gauge, histogram
+
+
+T = TypeVar("T")
+logger = logging.getLogger(__name__)
+
+CLOSED = "closed"
+HALF_OPEN = "half_open"
+OPEN = "open"
+_STATE_VALUES = {CLOSED: 0, HALF_OPEN: 1, OPEN: 2}
+
+CIRCUIT_STATE = gauge("llm_circuit_state", "LLM circuit breaker state (0 closed, 1 half-open, 2 open)")
+CIRCUIT_OPENED = counter("llm_circuit_open_total", "Times the LLM circuit breaker opened")
+SHORT_CIRCUITED = counter("llm_short_circuited_total", "LLM calls rejected while the circuit was open")
+HEDGES = counter("llm_hedged_requests_total", "Hedged LLM requests by winning attempt", ["winner"])
+HEDGES_SKIPPED = counter("llm_hedges_skipped_total", "Hedges not sent because the hedge pool was saturated")
+LLM_SECONDS = histogram("llm_request_seconds", "Latency of successful LLM calls", ["backend"])
+LLM_ERRORS = counter("llm_errors_total", "Failed LLM calls by error type", ["backend", "error"])
+
+
+def _env_bool(name: str, default: bool) -> bool:
+    return os.getenv(name, "true" if default else "false").strip().lower() in ("1", "true", "yes", "on")
+
+
+def _env_float(name: str, default: float) -> float:
+    try:
+        return float(os.getenv(name, default))
+    except ValueError:
+        return float(default)
+
+
+class CircuitOpenError(LLMError):
+    """Breaker đang mở: không gọi provider, caller dùng kết quả local."""
+
+
+def counts_as_failure(exc: BaseException) -> bool:
+    """Lỗi phản ánh sức khoẻ provider (429/5xx/timeout); lỗi request (schema, auth) thì không."""
+    return is_retryable_error(exc)
+
+
+def is_degradable_error(exc: BaseException) -> bool:
+    """Lỗi mà analyze_document nên trả kết quả local-only thay vì báo lỗi."""
+    return isinstance(exc, (CircuitOpenError, LLMQueueTimeout)) or is_retryable_error(exc)
+
+
+class CircuitBreaker:
+    def __init__(
+        self,
+        failure_rate: float = 0.5,
+        min_calls: int = 10,
+        window_seconds: float = 60.0,
+        open_seconds: float = 30.0,
+        half_open_calls: int = 1,
+        clock: Callable[[], float] = time.monotonic,
+    ):
+        self.failure_rate = failure_rate
+        self.min_calls = max(1, min_calls)
+        self.window_seconds = window_seconds
+        self.open_seconds = open_seconds
+        self.half_open_calls = max(1, half_open_calls)
+        self.clock = clock
+        self._state = CLOSED
+        self._opened_at = 0.0
+        self._probes = 0
+        self._calls: Deque[Tuple[float, bool]] = deque()  # (timestamp, failed)
+        self._lock = threading.Lock()
+
+    # ---------- trạng thái ----------
+
+    @property
+    def state(self) -> str:
+        with self._lock:
+            self._maybe_half_open()
+            return self._state
+
+    def _set_state(self, state: str) -> None:
+        self._state = state
+        CIRCUIT_STATE.set(_STATE_VALUES[state])
+
+    def _maybe_half_open(self) -> None:
+        if self._state == OPEN and self.clock() - self._opened_at >= self.open_seconds:
+            self._set_state(HALF_OPEN)
+            self._probes = 0
+
+    def _trim(self, now: float) -> None:
+        while self._calls and now - self._calls[0][0] > self.window_seconds:
+            self._calls.popleft()
+
+    def _open(self, now: float) -> None:
+        self._set_state(OPEN)
+        self._opened_at = now
+        self._calls.clear()
+        CIRCUIT_OPENED.inc()
+        logger.warning("Circuit OPEN for %.0fs → local-only analysis", self.open_seconds)
+
+    def retry_after(self) -> float:
+        with self._lock:
+            if self._state != OPEN:
+                return 0.0
+            return max(0.0, self.open_seconds - (self.clock() - self._opened_at))
+
+    # ---------- vòng đời 1 lời gọi ----------
+
+    def before_call(self) -> None:
+        """Raise CircuitOpenError nếu không được gọi; HALF_OPEN chỉ cho `half_open_calls` lời gọi thử."""
+        with self._lock:
+            self._maybe_half_open()
+            if self._state == CLOSED:
+                return
+            if self._state == HALF_OPEN and self._probes < self.half_open_calls:
+                self._probes += 1
+                return
+            SHORT_CIRCUITED.inc()
+            state = self._state
+            retry_after = max(0.0, self.open_seconds - (self.clock() - self._opened_at))
+        raise CircuitOpenError(f"LLM circuit {state}", retry_after=retry_after)
+
+    def check(self) -> None:
+        """Fail fast trước khi xếp hàng ở rate limiter (không chiếm lượt probe)."""
+        with self._lock:
+            self._maybe_half_open()
+            if self._state != OPEN:
+                return
+            SHORT_CIRCUITED.inc()
+            retry_after = max(0.0, self.open_seconds - (self.clock() - self._opened_at))
+        raise CircuitOpenError("LLM circuit open", retry_after=retry_after)
+
+    def record(self, failed: bool) -> None:
+        with self._lock:
+            now = self.clock()
+            if self._state == HALF_OPEN:
+                self._probes = max(0, self._probes - 1)
+                if failed:
+                    self._open(now)
+                else:
+                    self._set_state(CLOSED)
+                    self._calls.clear()
+                    logger.info("Circuit CLOSED (probe succeeded)")
+                return
+            if self._state == OPEN:
+                return  # lời gọi bắt đầu trước khi mở
+            self._calls.append((now, failed))
+            self._trim(now)
+            if len(self._calls) >= self.min_calls:
+                failures = sum(1 for _, bad in self._calls if bad)
+                if failures / len(self._calls) >= self.failure_rate:
+                    self._open(now)
+
+    def release(self) -> None:
+        """Lời gọi kết thúc bằng lỗi không liên quan sức khoẻ provider."""
+        with self._lock:
+            if self._state == HALF_OPEN:
+                self._probes = max(0, self._probes - 1)
+
+    def call(self, fn: Callable[[], T]) -> T:
+        self.before_call()
+        try:
+            result = fn()
+        except Exception as exc:  # noqa: BLE001 - phân loại rồi raise lại
+            if counts_as_failure(exc):
+                self.record(True)
+            else:
+                self.release()
+            raise
+        self.record(False)
+        return result
+
+    def reset(self) -> None:
+        with self._lock:
+            self._set_state(CLOSED)
+            self._calls.clear()
+            self._probes = 0
+
+
+class LatencyTracker:
+    """Latency (giây) của `size` lời gọi thành công gần nhất."""
+
+    def __init__(self, size: int = 200):
+        self._samples: Deque[float] = deque(maxlen=size)
+        self._lock = threading.Lock()
+
+    def observe(self, seconds: float) -> None:
+        with self._lock:
+            self._samples.append(seconds)
+
+    def __len__(self) -> int:
+        return len(self._samples)
+
+    def percentile(self, q: float) -> Optional[float]:
+        with self._lock:
+            samples = sorted(self._samples)
+        if not samples:
+            return None
+        index = min(len(samples) - 1, max(0, int(round(q * (len(samples) - 1)))))
+        return samples[index]
+
+    def clear(self) -> None:
+        with self._lock:
+            self._samples.clear()
+
+
+# ====== HEDGED REQUESTS ======
+
+class HedgePool:
+    """ThreadPoolExecutor + semaphore đếm slot đang dùng (lời gọi gốc và hedge đều chiếm 1 slot)."""
+
+    def __init__(self, max_workers: int):
+        self.executor = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix="llm-hedge")
+        self._slots = threading.BoundedSemaphore(max_workers)
+
+    def submit(self, fn: Callable[[], T], blocking: bool = True) -> Optional[Future]:
+        """blocking=False: pool đã đầy → None (không xếp hàng)."""
+        if not self._slots.acquire(blocking=blocking):
+            return None
+        try:
+            future = self.executor.submit(fn)
+        except BaseException:
+            self._slots.release()
+            raise
+        future.add_done_callback(lambda _: self._slots.release())
+        return future
+
+
+_hedge_pool: Optional[HedgePool] = None
+_hedge_lock = threading.Lock()
+
+
+def _pool() -> HedgePool:
+    global _hedge_pool
+    if _hedge_pool is None:
+        with _hedge_lock:
+            if _hedge_pool is None:
+                _hedge_pool = HedgePool(int(_env_float("LLM_HEDGE_WORKERS", 16)))
+    return _hedge_pool
+
+
+def hedge_enabled() -> bool:
+    return _env_bool("LLM_HEDGE_ENABLED", False)
+
+
+def hedge_delay(tracker: Optional[LatencyTracker] = None) -> Optional[float]:
+    """p95 latency (>= LLM_HEDGE_MIN_DELAY); None khi chưa đủ LLM_HEDGE_MIN_SAMPLES mẫu."""
+    tracker = tracker or llm_latency
+    if len(tracker) < int(_env_float("LLM_HEDGE_MIN_SAMPLES", 20)):
+        return None
+    p95 = tracker.percentile(_env_float("LLM_HEDGE_PERCENTILE", 0.95))
+    return max(p95 or 0.0, _env_float("LLM_HEDGE_MIN_DELAY", 0.5))
+
+
+def hedged_call(
+    fn: Callable[[], T],
+    delay: Optional[float],
+    pool: Optional[HedgePool] = None,
+) -> T:
+    """
+    Chạy fn(); chưa xong sau `delay` giây thì chạy thêm 1 bản, trả kết quả thành
+    công về trước. Bản thua vẫn chạy nốt ở nền (không huỷ được HTTP đồng bộ),
+    kết quả bị bỏ. delay None → gọi thẳng, không hedge. Pool không còn slot rảnh
+    → bỏ hedge, chờ bản gốc.
+    """
+    if delay is None:
+        return fn()
+    pool = pool or _pool()
+    primary = pool.submit(fn)
+    try:
+        return primary.result(timeout=delay)
+    except FutureTimeout:
+        pass
+
+    hedge = pool.submit(fn, blocking=False)
+    if hedge is None:
+        HEDGES_SKIPPED.inc()
+        return primary.result()
+    pending = {primary, hedge}
+    errors: List[BaseException] = []
+    while pending:
+        done, pending = wait(pending, return_when=FIRST_COMPLETED)
+        for future in done:
+            exc = future.exception()
+            if exc is None:
+                HEDGES.labels(winner="hedge" if future is hedge else "primary").inc()
+                return future.result()
+            errors.append(exc)
+    raise errors[0]
+
+
+# ====== SHARED INSTANCES ======
+
+llm_breaker = CircuitBreaker(
+    failure_rate=_env_float("LLM_BREAKER_FAILURE_RATE", 0.5),
+    min_calls=int(_env_float("LLM_BREAKER_MIN_CALLS", 10)),
+    window_seconds=_env_float("LLM_BREAKER_WINDOW", 60.0),
+    open_seconds=_env_float("LLM_BREAKER_OPEN_SECONDS", 30.0),
+)
+llm_latency = LatencyTracker(size=int(_env_float("LLM_LATENCY_WINDOW", 200)))
+
+
+def breaker_enabled() -> bool:
+    return _env_bool("LLM_BREAKER_ENABLED", True)
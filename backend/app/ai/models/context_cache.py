@@ -0,0 +1,174 @@
+"""
+context_cache.py
+
+Registry cached-content handle cho system instruction tĩnh
+----------------------------------------------------------
+- Mỗi (backend, model, language, prompt version) có 1 handle phía server chứa
+  PromptTemplate.system_instruction → mỗi request chỉ gửi / bị tính phí phần động.
+- Handle sắp hết hạn (< CONTEXT_CACHE_RENEW_BEFORE) thì gia hạn TTL; bị xoá / hết
+  hạn phía server thì tạo lại; gia hạn lỗi (429 / 5xx / mạng) thì dùng tiếp handle
+  cũ tới khi hết hạn.
+- Backend không tạo được (không hỗ trợ, prompt quá ngắn, lỗi quota...) → trả None,
+  caller gửi inline system_instruction; thử lại sau CONTEXT_CACHE_RETRY_AFTER giây.
+- Lời gọi create / renew không giữ lock chung của registry; mỗi key có lock riêng
+  (single-flight) → N request đồng thời cùng key chỉ tạo 1 handle.
+"""
+
+from __future__ import annotations
+
+import logging
+import os
+import threading
+import time
+from typing import Callable, Dict, Optional, Tuple
+
+try:
+    from .llm_backend import CachedContentHandle, CachedContentNotFound, LLMBackend, LLMError
+    from .promptStore import PromptTemplate
+except ImportError:
+    from llm_backend import CachedContentHandle, CachedContentNotFound, LLMBackend, LLMError
+    from promptStore import PromptTemplate
+
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_TTL = 3600.0
+DEFAULT_RENEW_BEFORE = 300.0
+DEFAULT_RETRY_AFTER = 600.0
+# Gemini từ chối cache nội dung quá ngắn (~1024 token) → khỏi tốn 1 lời gọi thất bại
+DEFAULT_MIN_CHARS = 4000
+
+
+def context_cache_enabled() -> bool:
+    return os.getenv("CONTEXT_CACHE_ENABLED", "true").strip().lower() in ("1", "true", "yes", "on")
+
+
+_Key = Tuple[str, str, str, str]
+
+
+class ContextCacheRegistry:
+    def __init__(
+        self,
+        ttl_seconds: float = DEFAULT_TTL,
+        renew_before: float = DEFAULT_RENEW_BEFORE,
+        retry_after: float = DEFAULT_RETRY_AFTER,
+        min_chars: int = DEFAULT_MIN_CHARS,
+        clock: Callable[[], float] = time.time,
+    ):
+        self.ttl_seconds = ttl_seconds
+        self.renew_before = renew_before
+        self.retry_after = retry_after
+        self.min_chars = min_chars
+        self.clock = clock
+        self._handles: Dict[_Key, CachedContentHandle] = {}
+        self._unavailable_until: Dict[_Key, float] = {}
+        self._key_locks: Dict[_Key, threading.Lock] = {}
+        self._lock = threading.Lock()
+        self.stats = {"created": 0, "renewed": 0, "renew_failed": 0, "reused": 0, "fallbacks": 0}
+
+    @staticmethod
+    def _key(backend: LLMBackend, model: str, template: PromptTemplate) -> _Key:
+        return (backend.name, model, template.language, template.version)
+
+    def handle_for(
+        self,
+        backend: LLMBackend,
+        model: str,
+        template: PromptTemplate,
+    ) -> Optional[CachedContentHandle]:
+        """Handle còn hạn cho template (tạo / gia hạn nếu cần); None → gửi inline."""
+        if not context_cache_enabled() or not backend.supports_context_cache:
+            return None
+        if len(template.system_instruction) < self.min_chars:
+            return None
+
+        key = self._key(backend, model, template)
+        with self._lock:
+            done, handle = self._lookup(key)
+            if done:
+                return handle
+            key_lock = self._key_locks.setdefault(key, threading.Lock())
+
+        # Gọi mạng (create / renew) ngoài self._lock: key khác không phải chờ.
+        # key_lock: mỗi key chỉ 1 caller tạo / gia hạn, caller sau dùng kết quả.
+        with key_lock:
+            with self._lock:
+                done, handle = self._lookup(key)
+                if done:
+                    return handle
+                now = self.clock()
+
+            try:
+                stat = None
+                if handle is not None:
+                    try:
+                        handle = backend.renew_cached_content(handle, self.ttl_seconds)
+                        stat = "renewed"
+                    except CachedContentNotFound:
+                        handle = None
+                    except LLMError as exc:
+                        # 429 / 5xx / mạng lúc gia hạn: handle cũ còn hạn thì dùng tiếp, lần sau thử gia hạn lại
+                        if handle.expires_at > now:
+                            logger.warning("Renewing cached content %s failed: %s → keep current handle", key, exc)
+                            with self._lock:
+                                self.stats["renew_failed"] += 1
+                            return handle
+                        handle = None
+                if handle is None:
+                    handle = backend.create_cached_content(
+                        model,
+                        template.system_instruction,
+                        self.ttl_seconds,
+                        display_name=f"logicguard-{template.language}-{template.version}",
+                    )
+                    stat = "created"
+            except LLMError as exc:  # ContextCacheUnavailable, hoặc 429 / 5xx khi tạo
+                logger.warning("Context cache unavailable for %s: %s → inline system_instruction", key, exc)
+                with self._lock:
+                    self._handles.pop(key, None)
+                    self._unavailable_until[key] = now + self.retry_after
+                    self.stats["fallbacks"] += 1
+                return None
+
+            with self._lock:
+                self.stats[stat] += 1
+                self._handles[key] = handle
+                self._unavailable_until.pop(key, None)
+            return handle
+
+    def _lookup(self, key: _Key) -> Tuple[bool, Optional[CachedContentHandle]]:
+        """Gọi khi giữ self._lock. (True, kết quả) nếu không cần gọi mạng; (False, handle cũ / None) nếu cần."""
+        now = self.clock()
+        if self._unavailable_until.get(key, 0.0) > now:
+            self.stats["fallbacks"] += 1
+            return True, None
+
+        handle = self._handles.get(key)
+        if handle is not None and handle.expires_at - now > self.renew_before:
+            self.stats["reused"] += 1
+            return True, handle
+        return False, handle
+
+    def invalidate(self, backend: LLMBackend, model: str, template: PromptTemplate) -> None:
+        """Handle bị server báo không tồn tại lúc generate → lần sau tạo lại."""
+        with self._lock:
+            self._handles.pop(self._key(backend, model, template), None)
+
+    def clear(self, backend: Optional[LLMBackend] = None) -> None:
+        """Xoá mọi handle (xoá luôn phía server nếu truyền backend)."""
+        with self._lock:
+            handles = list(self._handles.values())
+            self._handles.clear()
+            self._unavailable_until.clear()
+            self.stats = {name: 0 for name in self.stats}
+        if backend is not None:
+            for handle in handles:
+                backend.delete_cached_content(handle)
+
+
+context_cache = ContextCacheRegistry(
+    ttl_seconds=float(os.getenv("CONTEXT_CACHE_TTL", DEFAULT_TTL)),
+    renew_before=float(os.getenv("CONTEXT_CACHE_RENEW_BEFORE", DEFAULT_RENEW_BEFORE)),
+    retry_after=float(os.getenv("CONTEXT_CACHE_RETRY_AFTER", DEFAULT_RETRY_AFTER)),
+    min_chars=int(os.getenv("CONTEXT_CACHE_MIN_CHARS", DEFAULT_MIN_CHARS)),
+)
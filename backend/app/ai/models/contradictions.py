@@ -1,16 +1,30 @@
 from typing import List, Dict, Any, Tuple, Optional
 from datetime import datetime
-import re, numpy as np, itertools, torch, gc
+import re, numpy as np, itertools, torch, gc, time, logging
 import torch.nn.functional as F
 from transformers import AutoTokenizer, AutoModelForSequenceClassification
 from sentence_transformers import SentenceTransformer
-from app.utils.nlp import extract_sentences
+from app.core.metrics import StageTimer, counter, gauge, histogram
+from app.utils.nlp import SentenceSpan, extract_sentence_spans, strip_terminal_punctuation
 
 
+logger = logging.getLogger(__name__)
+
 # Model paths
 BASE_MODEL = "MoritzLaurer/mDeBERTa-v3-base-xnli-multilingual-nli-2mil7"
 FINETUNED_MODEL = "duowng/mDeBERTa-v3-base-xnli-multilingual-nli-2mil7-for-vietnamese"
 
+MODEL_LOADS = counter("model_loads_total", "Model loads (cache miss) by kind", ["kind"])
+MODEL_LOAD_SECONDS = histogram(
+    "model_load_seconds", "Time to load a model", ["kind"], buckets=(0.1, 0.5, 1, 2.5, 5, 10, 30, 60, 120, 300)
+)
+MODELS_LOADED = gauge("models_loaded", "Models currently held in the in-process cache", ["kind"])
+NLI_BATCH_SIZE = histogram(
+    "nli_batch_size", "Sentence pairs per NLI batch", buckets=(1, 2, 4, 8, 16, 32, 64, 128)
+)
+NLI_BATCH_SECONDS = histogram("nli_batch_seconds", "Tokenization + forward time per NLI batch (both directions)")
+NLI_PAIRS = counter("nli_pairs_total", "Sentence pairs scored by the NLI model")
+
 # Global cache cho models
 _cached_embedding_model = None
 _cached_embedding_model_name = None
@@ -34,13 +48,15 @@ def clear_model_cache():
     _cached_nli_model_path = None
     _cached_nli_device = None
     _cached_contra_idx = None
+    MODELS_LOADED.labels(kind="embedding").set(0)
+    MODELS_LOADED.labels(kind="nli").set(0)
     
     # Force garbage collection
     gc.collect()
     if torch.cuda.is_available():
         torch.cuda.empty_cache()
     
-    print("Model cache cleared")
+    logger.info("Model cache cleared")
 
 
 def _check_memory_and_clear_if_needed():
@@ -55,7 +71,7 @@ def _check_memory_and_clear_if_needed():
         
         # Nếu usage > 80%, clear cache
         if usage_percent > 80:
-            print(f"GPU memory usage: {usage_percent:.1f}% - Clearing cache...")
+            logger.warning("GPU memory usage %.1f%% - clearing cache", usage_percent)
             torch.cuda.empty_cache()
             gc.collect()
 
@@ -65,10 +81,14 @@ def _load_embedding_model(model_name: str) -> SentenceTransformer:
     global _cached_embedding_model, _cached_embedding_model_name
     
     if _cached_embedding_model_name != model_name:
-        print(f"Loading embedding model: {model_name}")
+        logger.info("Loading embedding model: %s", model_name)
+        started = time.perf_counter()
         _cached_embedding_model = SentenceTransformer(model_name, device="cpu")
         _cached_embedding_model.eval()
         _cached_embedding_model_name = model_name
+        MODEL_LOADS.labels(kind="embedding").inc()
+        MODEL_LOAD_SECONDS.labels(kind="embedding").observe(time.perf_counter() - started)
+        MODELS_LOADED.labels(kind="embedding").set(1)
     
     return _cached_embedding_model
 
@@ -90,9 +110,10 @@ def _load_nli_model(model_path: str, device: Optional[str] = None):
     # Check memory trước khi load model mới
     _check_memory_and_clear_if_needed()
     
-    print(f"📦 Loading NLI model: {model_path} on {device}")
+    logger.info("Loading NLI model: %s on %s", model_path, device)
     
     # Load model mới
+    started = time.perf_counter()
     _cached_nli_tokenizer = AutoTokenizer.from_pretrained(model_path)
     _cached_nli_model = AutoModelForSequenceClassification.from_pretrained(model_path)
     _cached_nli_model.eval()
@@ -102,6 +123,9 @@ def _load_nli_model(model_path: str, device: Optional[str] = None):
     _cached_nli_model_path = model_path
     _cached_nli_device = device
     _cached_contra_idx = _get_contradiction_idx_from_config(_cached_nli_model)
+    MODEL_LOADS.labels(kind="nli").inc()
+    MODEL_LOAD_SECONDS.labels(kind="nli").observe(time.perf_counter() - started)
+    MODELS_LOADED.labels(kind="nli").set(1)
     
     return _cached_nli_tokenizer, _cached_nli_model, _cached_contra_idx, device
 
@@ -187,12 +211,14 @@ def check_contradictions(
             "text": str,
             "total_sentences": int,
             "sentences": List[str],
+            "sentence_spans": [{"text", "start", "end", "hash"}],  # offset trên `text`
             "total_contradictions": int,
             "contradictions": [...],
             "metadata": {
                 "analyzed_at": str,
                 "threshold": float,
-                "error": Optional[str]
+                "error": Optional[str],
+                "timings": {"total_ms", "stages_ms": {...}, "counts": {...}}
             }
         }
     """
@@ -206,6 +232,7 @@ def check_contradictions(
             "text": text
         }
     
+    timer = StageTimer("check_contradictions")
     result = {
         "success": False,
         "mode": mode,
@@ -213,24 +240,33 @@ def check_contradictions(
         "text": text,
         "total_sentences": 0,
         "sentences": [],
+        "sentence_spans": [],
         "total_contradictions": 0,
         "contradictions": [],
         "metadata": {
             "analyzed_at": datetime.utcnow().isoformat(),
             "threshold": threshold,
-            "error": None
+            "error": None,
+            "timings": {}
         }
     }
     
     try:
-        # Bước 1: Tách câu
-        sentences = extract_sentences(text)
+        # Bước 1: Tách câu (giữ offset + hash để map về Sentence row)
+        spans = extract_sentence_spans(text)
+        sentences = [strip_terminal_punctuation(span.text) for span in spans]
         result["sentences"] = sentences
+        result["sentence_spans"] = [
+            {"text": span.text, "start": span.start, "end": span.end, "hash": span.hash}
+            for span in spans
+        ]
         result["total_sentences"] = len(sentences)
+        timer.count("sentences", len(sentences))
+        timer.lap("segmentation")
         if len(sentences) < 2:
             result["success"] = True
             result["metadata"]["error"] = "Cần ít nhất 2 câu để phân tích"
-            print("\nCần ít nhất 2 câu để phân tích mâu thuẫn")
+            logger.debug("Cần ít nhất 2 câu để phân tích mâu thuẫn")
             return result
         
         # Bước 2: Chọn và load NLI model (cached)
@@ -238,15 +274,19 @@ def check_contradictions(
         result["model_path"] = model_path
         
         tokenizer, model, contra_idx, device = _load_nli_model(model_path)
+        timer.lap("model_load")
         
         # Bước 3: Lọc cặp câu bằng embedding (nếu bật)
         if use_embeddings_filter:
             embedding_model = _load_embedding_model(embedding_model_name)
+            timer.lap("model_load")
             sentence_pairs = _filter_sentence_pairs_by_embedding(
-                sentences, embedding_model, sim_min, sim_max, top_k
+                sentences, embedding_model, sim_min, sim_max, top_k, timer=timer
             )
         else:
             sentence_pairs = list(itertools.combinations(range(len(sentences)), 2))
+            timer.lap("pair_filter")
+        timer.count("candidate_pairs", len(sentence_pairs))
         
         if not sentence_pairs:
             result["success"] = True
@@ -255,11 +295,14 @@ def check_contradictions(
         # Bước 4: Phân tích NLI cho từng batch
         contradictions_list = _analyze_nli_batches(
             sentences, sentence_pairs, tokenizer, model, device,
-            contra_idx, batch_size, max_length, threshold
+            contra_idx, batch_size, max_length, threshold, timer=timer
         )
+        timer.checkpoint()
         
         # Bước 5: Loại bỏ trùng lặp và format kết quả
         final_contradictions = _deduplicate_and_format(contradictions_list)
+        _attach_sentence_spans(final_contradictions, spans)
+        timer.lap("dedupe")
         
         result["success"] = True
         result["total_contradictions"] = len(final_contradictions)
@@ -270,7 +313,9 @@ def check_contradictions(
         
     except Exception as e:
         result["metadata"]["error"] = str(e)
-        print(f"Error: {e}")
+        logger.exception("check_contradictions failed")
+    finally:
+        result["metadata"]["timings"] = timer.finish()
     
     return result
 
@@ -280,15 +325,18 @@ def _filter_sentence_pairs_by_embedding(
     embedding_model: SentenceTransformer,
     sim_min: float,
     sim_max: float,
-    top_k: int
+    top_k: int,
+    timer: Optional[StageTimer] = None
 ) -> List[Tuple[int, int]]:
-    """Lọc cặp câu dựa trên embedding similarity"""
+    """Lọc cặp câu dựa trên embedding similarity (timer: embedding / pair_filter)"""
     with torch.no_grad():
         embs = embedding_model.encode(
             sentences, convert_to_tensor=True,
             normalize_embeddings=True,
             show_progress_bar=False, device="cpu"
         )
+    if timer is not None:
+        timer.lap("embedding")
     
     sim = torch.matmul(embs, embs.T).cpu().numpy()
     np.fill_diagonal(sim, -1.0)
@@ -302,6 +350,8 @@ def _filter_sentence_pairs_by_embedding(
         for j in idxs:
             if j > i:
                 sentence_pairs.append((i, j))
+    if timer is not None:
+        timer.lap("pair_filter")
     
     return sentence_pairs
 
@@ -315,13 +365,15 @@ def _analyze_nli_batches(
     contra_idx: int,
     batch_size: int,
     max_length: int,
-    threshold: float
+    threshold: float,
+    timer: Optional[StageTimer] = None
 ) -> List[Dict[str, Any]]:
-    """Phân tích NLI cho các batches của sentence pairs"""
+    """Phân tích NLI cho các batches của sentence pairs (timer: tokenization / forward)"""
     contradictions_list = []
     
     for b in range(0, len(sentence_pairs), batch_size):
         batch = sentence_pairs[b:b+batch_size]
+        started = time.perf_counter()
         
         # A->B
         premises = [sentences[i] for (i, j) in batch]
@@ -333,6 +385,7 @@ def _analyze_nli_batches(
         hyps_r = premises
         inputs_b = tokenizer(premises_r, hyps_r, return_tensors="pt",
                             truncation=True, padding=True, max_length=max_length).to(device)
+        tokenized = time.perf_counter()
         
         with torch.no_grad():
             use_amp = (device == "cuda") and _model_supports_amp(model)
@@ -346,6 +399,16 @@ def _analyze_nli_batches(
         
         probs_f = F.softmax(logits_f.float(), dim=-1).cpu().numpy()
         probs_b = F.softmax(logits_b.float(), dim=-1).cpu().numpy()
+        NLI_BATCH_SIZE.observe(len(batch))
+        NLI_BATCH_SECONDS.observe(time.perf_counter() - started)
+        NLI_PAIRS.inc(len(batch))
+        if timer is not None:
+            # .cpu() đồng bộ GPU → forward gồm cả thời gian kernel thật
+            timer.add("tokenization", tokenized - started)
+            timer.add("forward", time.perf_counter() - tokenized)
+            timer.count("nli_batches")
+            timer.count("nli_pairs", len(batch))
+            timer.count("nli_input_tokens", int(inputs_f["attention_mask"].sum()) + int(inputs_b["attention_mask"].sum()))
         
         for (i, (si, sj)) in enumerate(batch):
             p1 = float(probs_f[i, contra_idx])
@@ -375,6 +438,16 @@ def _analyze_nli_batches(
     return contradictions_list
 
 
+def _attach_sentence_spans(contradictions: List[Dict[str, Any]], spans: List[SentenceSpan]) -> None:
+    """Gắn offset (start/end trên text gốc) + hash của 2 câu vào mỗi contradiction"""
+    for item in contradictions:
+        for prefix in ("sentence1", "sentence2"):
+            span = spans[item[f"{prefix}_index"]]
+            item[f"{prefix}_start"] = span.start
+            item[f"{prefix}_end"] = span.end
+            item[f"{prefix}_hash"] = span.hash
+
+
 def _deduplicate_and_format(contradictions_list: List[Dict[str, Any]]) -> List[Dict[str, Any]]:
     """Loại bỏ trùng lặp và format kết quả"""
     dedup = {}
@@ -0,0 +1,283 @@
+"""
+json_stream.py
+
+Parse JSON output của LLM theo luồng + sửa lỗi cục bộ
+------------------------------------------------------
+- StreamingObjectParser: nhận từng chunk text của 1 JSON object, trả về cặp
+  (key, value) top-level ngay khi value đóng (vd. block "contradictions" xong
+  trước khi model sinh tiếp "undefined_terms").
+- repair_json(): sửa lỗi hay gặp của LLM — code fence ```json, dấu phẩy thừa
+  trước } / ], output bị cắt giữa chừng (đóng string / ngoặc còn mở, bỏ phần
+  key / value dở dang).
+- Block đã đóng trong stream coi là hoàn chỉnh; block chỉ có được nhờ repair
+  (bị cắt) thì caller nên gọi lại LLM cho riêng block đó.
+"""
+
+from __future__ import annotations
+
+import json
+import re
+import time
+from typing import Any, Dict, Iterable, List, Optional, Tuple
+
+_FENCE_START = re.compile(r"^\s*```(?:json|JSON)?\s*")
+_FENCE_END = re.compile(r"\s*```\s*$")
+_CLOSERS = {"{": "}", "[": "]"}
+_PRIMITIVE_TAIL = re.compile(r"(?:-?\d+(?:\.\d+)?(?:[eE][+-]?\d+)?|true|false|null)\s*$")
+
+
+def strip_code_fences(text: str) -> str:
+    text = _FENCE_START.sub("", text, count=1)
+    return _FENCE_END.sub("", text, count=1).strip()
+
+
+def _remove_trailing_commas(text: str) -> str:
+    """Bỏ dấu phẩy ngay trước } hoặc ] (ngoài string)."""
+    out: List[str] = []
+    in_string = escape = False
+    pending_comma: Optional[int] = None
+    for char in text:
+        if in_string:
+            out.append(char)
+            if escape:
+                escape = False
+            elif char == "\\":
+                escape = True
+            elif char == '"':
+                in_string = False
+            continue
+        if char in "}]" and pending_comma is not None:
+            del out[pending_comma]
+        if char == ",":
+            pending_comma = len(out)
+        elif not char.isspace():
+            pending_comma = None
+        if char == '"':
+            in_string = True
+        out.append(char)
+    return "".join(out)
+
+
+def _close_truncated(text: str) -> str:
+    """
+    Đóng JSON bị cắt: thử giữ nguyên phần cuối (primitive / string đủ), không được
+    thì cắt về vị trí an toàn gần nhất (sau 1 value hoàn chỉnh) rồi đóng ngoặc.
+    """
+    stack: List[str] = []
+    in_string = escape = False
+    string_is_key = False
+    last_significant = ""
+    safe_at = 0
+    safe_stack: List[str] = []
+
+    for index, char in enumerate(text):
+        if in_string:
+            if escape:
+                escape = False
+            elif char == "\\":
+                escape = True
+            elif char == '"':
+                in_string = False
+                last_significant = '"'
+                if not string_is_key:
+                    safe_at, safe_stack = index + 1, list(stack)
+            continue
+        if char.isspace():
+            continue
+        if char == '"':
+            in_string = True
+            string_is_key = bool(stack) and stack[-1] == "{" and last_significant in ("{", ",")
+        elif char in "{[":
+            stack.append(char)
+            safe_at, safe_stack = index + 1, list(stack)
+        elif char in "}]":
+            if stack:
+                stack.pop()
+            safe_at, safe_stack = index + 1, list(stack)
+        elif char == ",":
+            safe_at, safe_stack = index, list(stack)
+        last_significant = char
+
+    closers = "".join(_CLOSERS[opener] for opener in reversed(stack))
+    if in_string and not string_is_key:
+        candidate = text + '"' + closers
+    elif not in_string and _PRIMITIVE_TAIL.search(text) and last_significant not in (",", ":"):
+        candidate = text.rstrip() + closers
+    else:
+        candidate = None
+    if candidate is not None:
+        try:
+            json.loads(candidate)
+            return candidate
+        except json.JSONDecodeError:
+            pass
+    return text[:safe_at] + "".join(_CLOSERS[opener] for opener in reversed(safe_stack))
+
+
+def repair_json(text: str) -> Any:
+    """json.loads có sửa lỗi; vẫn hỏng thì raise json.JSONDecodeError."""
+    text = strip_code_fences(text)
+    try:
+        return json.loads(text)
+    except json.JSONDecodeError:
+        pass
+    text = _remove_trailing_commas(text)
+    try:
+        return json.loads(text)
+    except json.JSONDecodeError:
+        pass
+    return json.loads(_remove_trailing_commas(_close_truncated(text)))
+
+
+class StreamingObjectParser:
+    """
+    Parser tăng dần cho 1 JSON object top-level. feed(chunk) → list (key, value)
+    vừa hoàn chỉnh. Value đóng nhưng lỗi cú pháp nhỏ (dấu phẩy thừa) được repair.
+    """
+
+    # trạng thái ở depth 1
+    _BEFORE_OBJECT, _EXPECT_KEY, _IN_KEY, _EXPECT_COLON, _EXPECT_VALUE, _IN_VALUE, _DONE = range(7)
+
+    def __init__(self) -> None:
+        self.buffer = ""
+        self.completed: Dict[str, Any] = {}
+        self.repaired: List[str] = []  # key đóng nhưng cần bỏ dấu phẩy thừa
+        self.partial_keys: List[str] = []  # key chỉ có nhờ repair output bị cắt
+        self.invalid: List[str] = []  # key đóng nhưng value hỏng
+        self.elapsed = 0.0  # giây CPU dành cho parse (feed + finish)
+        self._pos = 0
+        self._state = self._BEFORE_OBJECT
+        self._key_start = 0
+        self._key = ""
+        self._value_start = 0
+        self._depth = 0
+        self._in_string = False
+        self._escape = False
+
+    @property
+    def done(self) -> bool:
+        return self._state == self._DONE
+
+    def feed(self, chunk: str) -> List[Tuple[str, Any]]:
+        started = time.perf_counter()
+        try:
+            return self._feed(chunk)
+        finally:
+            self.elapsed += time.perf_counter() - started
+
+    def _feed(self, chunk: str) -> List[Tuple[str, Any]]:
+        self.buffer += chunk
+        emitted: List[Tuple[str, Any]] = []
+        text = self.buffer
+        while self._pos < len(text) and self._state != self._DONE:
+            char = text[self._pos]
+            state = self._state
+            if state == self._BEFORE_OBJECT:
+                if char == "{":
+                    self._state = self._EXPECT_KEY
+                # bỏ qua code fence / text trước object
+            elif state == self._EXPECT_KEY:
+                if char == '"':
+                    self._state = self._IN_KEY
+                    self._key_start = self._pos + 1
+                    self._escape = False
+                elif char == "}":
+                    self._state = self._DONE
+            elif state == self._IN_KEY:
+                if self._escape:
+                    self._escape = False
+                elif char == "\\":
+                    self._escape = True
+                elif char == '"':
+                    self._key = json.loads(text[self._key_start - 1 : self._pos + 1])
+                    self._state = self._EXPECT_COLON
+            elif state == self._EXPECT_COLON:
+                if char == ":":
+                    self._state = self._EXPECT_VALUE
+            elif state == self._EXPECT_VALUE:
+                if not char.isspace():
+                    self._state = self._IN_VALUE
+                    self._value_start = self._pos
+                    self._depth = 0
+                    self._in_string = False
+                    self._escape = False
+                    continue  # xử lý lại ký tự này trong _IN_VALUE
+            elif state == self._IN_VALUE:
+                if self._scan_value_char(char):
+                    pair = self._emit(text[self._value_start : self._pos])
+                    if pair is not None:
+                        emitted.append(pair)
+                    self._state = self._DONE if char == "}" else self._EXPECT_KEY
+            self._pos += 1
+        return emitted
+
+    def _scan_value_char(self, char: str) -> bool:
+        """True khi `char` kết thúc value hiện tại (',' hoặc '}' ở depth 0)."""
+        if self._in_string:
+            if self._escape:
+                self._escape = False
+            elif char == "\\":
+                self._escape = True
+            elif char == '"':
+                self._in_string = False
+            return False
+        if char == '"':
+            self._in_string = True
+        elif char in "{[":
+            self._depth += 1
+        elif char in "}]":
+            if self._depth == 0:
+                return char == "}"
+            self._depth -= 1
+        elif char == "," and self._depth == 0:
+            return True
+        return False
+
+    def _emit(self, raw: str) -> Optional[Tuple[str, Any]]:
+        raw = raw.strip()
+        try:
+            value = json.loads(raw)
+        except json.JSONDecodeError:
+            try:
+                value = json.loads(_remove_trailing_commas(raw))
+            except json.JSONDecodeError:
+                self.invalid.append(self._key)  # hỏng không sửa được → coi như thiếu
+                return None
+            self.repaired.append(self._key)
+        self.completed[self._key] = value
+        return self._key, value
+
+    def finish(self) -> Dict[str, Any]:
+        """
+        Hết stream: key đã đóng + phần còn dở được repair (nếu được). Key chỉ có
+        nhờ repair → partial_keys.
+        """
+        started = time.perf_counter()
+        try:
+            return self._finish()
+        finally:
+            self.elapsed += time.perf_counter() - started
+
+    def _finish(self) -> Dict[str, Any]:
+        result = dict(self.completed)
+        if self.done:
+            return result
+        try:
+            recovered = repair_json(self.buffer)
+        except json.JSONDecodeError:
+            return result
+        if isinstance(recovered, dict):
+            for key, value in recovered.items():
+                if key not in result and key not in self.invalid:
+                    result[key] = value
+                    if key not in self.partial_keys:
+                        self.partial_keys.append(key)
+        return result
+
+
+def parse_stream(chunks: Iterable[str]) -> Tuple[Dict[str, Any], List[str]]:
+    """Tiện ích: parse toàn bộ chunks → (object, partial_keys)."""
+    parser = StreamingObjectParser()
+    for chunk in chunks:
+        parser.feed(chunk)
+    return parser.finish(), parser.partial_keys
@@ -0,0 +1,542 @@
+"""
+llm_backend.py
+
+Lớp trừu tượng gọi LLM cho unified analysis
+-------------------------------------------
+- LLMBackend: generate() + vòng đời cached-content handle (create / renew / delete).
+- GeminiBackend: google.generativeai, hỗ trợ context caching (CachedContent).
+- FakeLLMBackend: chạy local, không cần mạng / API key; mô phỏng handle (TTL,
+  hết hạn, bị xoá) để test luồng context cache.
+- Chọn backend qua env LLM_BACKEND = gemini | fake (mặc định gemini).
+"""
+
+from __future__ import annotations
+
+import itertools
+import json
+import math
+import os
+import random
+import re
+import threading
+import time
+from collections import deque
+from contextlib import contextmanager
+from dataclasses import dataclass
+from datetime import timedelta
+from typing import Any, Callable, Deque, Dict, Iterator, List, Optional, Sequence, Tuple
+
+
+class LLMError(Exception):
+    """Lỗi gọi LLM (mạng, quota, provider). retryable → rate_limiter backoff + thử lại."""
+
+    retryable = False
+
+    def __init__(self, message: str = "", retry_after: Optional[float] = None):
+        super().__init__(message)
+        self.retry_after = retry_after
+
+
+class LLMRateLimited(LLMError):
+    """429 / quota (RPM, TPM) phía provider."""
+
+    retryable = True
+
+
+class LLMUnavailable(LLMError):
+    """5xx / timeout phía provider."""
+
+    retryable = True
+
+
+class CachedContentNotFound(LLMError):
+    """Handle cached-content đã hết hạn / bị xoá phía server."""
+
+
+class ContextCacheUnavailable(LLMError):
+    """Backend không tạo được cached content (không hỗ trợ, prompt quá ngắn, quota...)."""
+
+
+@dataclass
+class LLMRequest:
+    model: str
+    prompt: str  # phần động (user message)
+    subtasks: Tuple[str, ...] = ()
+    language: str = "en"
+    # Template identity (language:version) → backend dùng lại model/config theo key này
+    template_key: str = ""
+    system_instruction: Optional[str] = None  # None khi đã nằm trong cached_content
+    cached_content: Optional[str] = None
+    response_schema: Optional[Dict[str, Any]] = None
+
+
+@dataclass
+class LLMResponse:
+    text: str
+    prompt_tokens: int = 0
+    output_tokens: int = 0
+    cached_tokens: int = 0
+
+
+@dataclass
+class CachedContentHandle:
+    name: str
+    expires_at: float  # time.time()
+
+
+class LLMBackend:
+    """Interface backend; backend không có context cache thì để mặc định."""
+
+    name: str = ""
+    supports_context_cache: bool = False
+
+    def generate(self, request: LLMRequest) -> LLMResponse:
+        raise NotImplementedError
+
+    def generate_stream(self, request: LLMRequest, on_text: Callable[[str], None]) -> LLMResponse:
+        """
+        Như generate() nhưng gọi on_text(chunk) ngay khi nhận từng đoạn text.
+        Mặc định: backend không stream → 1 chunk duy nhất.
+        """
+        response = self.generate(request)
+        on_text(response.text)
+        return response
+
+    def create_cached_content(
+        self,
+        model: str,
+        system_instruction: str,
+        ttl_seconds: float,
+        display_name: str = "",
+    ) -> CachedContentHandle:
+        raise ContextCacheUnavailable(f"Backend '{self.name}' does not support context caching")
+
+    def renew_cached_content(self, handle: CachedContentHandle, ttl_seconds: float) -> CachedContentHandle:
+        raise ContextCacheUnavailable(f"Backend '{self.name}' does not support context caching")
+
+    def delete_cached_content(self, handle: CachedContentHandle) -> None:
+        return None
+
+
+# ====== GEMINI ======
+
+class GeminiBackend(LLMBackend):
+    name = "gemini"
+    supports_context_cache = True
+
+    def __init__(self, api_key: Optional[str] = None, timeout: Optional[float] = None):
+        import google.generativeai as genai
+
+        self._genai = genai
+        # Provider chậm → DeadlineExceeded sau `timeout` giây thay vì treo worker
+        self.timeout = timeout or float(os.getenv("LLM_REQUEST_TIMEOUT", "60"))
+        api_key = api_key or os.getenv("GEMINI_API_KEY")
+        if not api_key:
+            raise ValueError("GEMINI_API_KEY not found in environment variables")
+        genai.configure(api_key=api_key)
+        self._models: Dict[Tuple[str, str, str], Any] = {}
+        self._cached: Dict[str, Any] = {}
+        self._lock = threading.Lock()
+
+    def _generation_config(self, request: LLMRequest):
+        from google.generativeai import GenerationConfig
+
+        if request.response_schema is None:
+            return GenerationConfig(response_mime_type="application/json")
+        return GenerationConfig(
+            response_mime_type="application/json",
+            response_schema=request.response_schema,
+        )
+
+    def _model(self, request: LLMRequest):
+        key = (request.model, request.template_key, request.cached_content or "")
+        with self._lock:
+            model = self._models.get(key)
+            if model is not None:
+                return model
+            if request.cached_content:
+                cached = self._cached.get(request.cached_content, request.cached_content)
+                model = self._genai.GenerativeModel.from_cached_content(
+                    cached,
+                    generation_config=self._generation_config(request),
+                )
+            else:
+                model = self._genai.GenerativeModel(
+                    request.model,
+                    generation_config=self._generation_config(request),
+                    system_instruction=request.system_instruction,
+                )
+            self._models[key] = model
+            return model
+
+    @contextmanager
+    def _mapped_errors(self, request: LLMRequest) -> Iterator[None]:
+        """Lỗi google.api_core → LLMError (CachedContentNotFound / LLMRateLimited / LLMUnavailable)."""
+        from google.api_core import exceptions as google_exceptions
+
+        try:
+            yield
+        except google_exceptions.NotFound as exc:
+            if request.cached_content:
+                self._forget(request.cached_content)
+                raise CachedContentNotFound(str(exc)) from exc
+            raise LLMError(str(exc)) from exc
+        except (google_exceptions.ResourceExhausted, google_exceptions.TooManyRequests) as exc:
+            raise LLMRateLimited(str(exc)) from exc
+        except (
+            google_exceptions.ServiceUnavailable,
+            google_exceptions.InternalServerError,
+            google_exceptions.DeadlineExceeded,
+        ) as exc:
+            raise LLMUnavailable(str(exc)) from exc
+
+    @staticmethod
+    def _usage(response, text: str) -> LLMResponse:
+        usage = getattr(response, "usage_metadata", None)
+        return LLMResponse(
+            text=text,
+            prompt_tokens=getattr(usage, "prompt_token_count", 0) or 0,
+            output_tokens=getattr(usage, "candidates_token_count", 0) or 0,
+            cached_tokens=getattr(usage, "cached_content_token_count", 0) or 0,
+        )
+
+    def generate(self, request: LLMRequest) -> LLMResponse:
+        with self._mapped_errors(request):
+            response = self._model(request).generate_content(
+                request.prompt,
+                request_options={"timeout": self.timeout},
+            )
+        return self._usage(response, (response.text or "").strip())
+
+    def generate_stream(self, request: LLMRequest, on_text: Callable[[str], None]) -> LLMResponse:
+        parts: List[str] = []
+        with self._mapped_errors(request):
+            response = self._model(request).generate_content(
+                request.prompt,
+                stream=True,
+                request_options={"timeout": self.timeout},
+            )
+            for chunk in response:
+                try:
+                    text = chunk.text
+                except ValueError:  # chunk không có text (vd. chỉ finish_reason)
+                    continue
+                if text:
+                    parts.append(text)
+                    on_text(text)
+        return self._usage(response, "".join(parts).strip())
+
+    def create_cached_content(
+        self,
+        model: str,
+        system_instruction: str,
+        ttl_seconds: float,
+        display_name: str = "",
+    ) -> CachedContentHandle:
+        from google.generativeai import caching
+
+        try:
+            cached = caching.CachedContent.create(
+                model=model,
+                display_name=display_name[:128] or None,
+                system_instruction=system_instruction,
+                ttl=timedelta(seconds=ttl_seconds),
+            )
+        except Exception as exc:  # noqa: BLE001 - InvalidArgument (quá ngắn), quota, ...
+            raise ContextCacheUnavailable(str(exc)) from exc
+        with self._lock:
+            self._cached[cached.name] = cached
+        return CachedContentHandle(cached.name, time.time() + ttl_seconds)
+
+    def renew_cached_content(self, handle: CachedContentHandle, ttl_seconds: float) -> CachedContentHandle:
+        from google.api_core import exceptions as google_exceptions
+        from google.generativeai import caching
+
+        cached = self._cached.get(handle.name)
+        try:
+            if cached is None:
+                cached = caching.CachedContent.get(handle.name)
+            cached.update(ttl=timedelta(seconds=ttl_seconds))
+        except google_exceptions.NotFound as exc:
+            self._forget(handle.name)
+            raise CachedContentNotFound(str(exc)) from exc
+        except Exception as exc:  # noqa: BLE001 - 429, 503, mạng, PermissionDenied, ...
+            raise ContextCacheUnavailable(str(exc)) from exc
+        return CachedContentHandle(handle.name, time.time() + ttl_seconds)
+
+    def delete_cached_content(self, handle: CachedContentHandle) -> None:
+        cached = self._cached.get(handle.name)
+        self._forget(handle.name)
+        if cached is not None:
+            try:
+                cached.delete()
+            except Exception:  # noqa: BLE001 - server tự xoá khi hết TTL
+                pass
+
+    def _forget(self, name: str) -> None:
+        with self._lock:
+            self._cached.pop(name, None)
+            for key in [key for key in self._models if key[2] == name]:
+                del self._models[key]
+
+
+# ====== FAKE (local) ======
+
+def empty_analysis_response(subtasks: Sequence[str]) -> Dict[str, Any]:
+    """JSON hợp lệ theo schema, không có item nào."""
+    result: Dict[str, Any] = {
+        "analysis_metadata": {
+            "analyzed_at": "1970-01-01T00:00:00",
+            "writing_type": "Document",
+            "total_paragraphs": 0,
+            "total_sentences": 0,
+        },
+        "summary": {
+            "total_issues": 0,
+            "critical_issues": 0,
+            "document_quality_score": 100,
+            "key_recommendations": [],
+        },
+    }
+    for name in subtasks:
+        result[name] = {"total_found": 0, "items": []}
+    return result
+
+
+def _estimate_tokens(text: Optional[str]) -> int:
+    return len(text or "") // 4
+
+
+_SYNTHETIC_CHOICES = {
+    "severity": ("high", "medium", "low"),
+    "contradiction_type": ("factual", "numerical", "temporal", "logical"),
+    "status": ("unsupported", "weak_evidence"),
+    "claim_type": ("absolute", "comparative", "causal", "predictive"),
+    "flag": ("abrupt_transition", "missing_link"),
+    "language": ("en",),
+}
+_DEFAULT_WORDS = ("remote", "work", "productivity", "evidence", "study", "claim", "offices", "growth")
+
+
+def synthesize_from_schema(
+    schema: Dict[str, Any],
+    rng: random.Random,
+    items_per_block: int = 2,
+    words: Sequence[str] = _DEFAULT_WORDS,
+    field: str = "",
+) -> Any:
+    """Sinh giá trị hợp lệ theo JSON schema (kiểu response_schema Gemini) để load test."""
+    kind = schema.get("type")
+    if kind == "object":
+        value = {
+            name: synthesize_from_schema(sub, rng, items_per_block, words, name)
+            for name, sub in schema.get("properties", {}).items()
+        }
+        if isinstance(value.get("items"), list) and "total_found" in value:
+            value["total_found"] = len(value["items"])
+        return value
+    if kind == "array":
+        count = items_per_block if field == "items" else 2
+        return [synthesize_from_schema(schema.get("items", {}), rng, items_per_block, words, field) for _ in range(count)]
+    if kind == "integer":
+        return rng.randint(1, 5)
+    if kind == "number":
+        return round(rng.random(), 2)
+    if kind == "boolean":
+        return rng.random() < 0.5
+    if field in _SYNTHETIC_CHOICES:
+        return rng.choice(_SYNTHETIC_CHOICES[field])
+    return " ".join(rng.choice(words) for _ in range(rng.randint(3, 10)))
+
+
+class FakeLLMBackend(LLMBackend):
+    """
+    Backend local cho test / dev offline / load test.
+    - responder(request) → dict (sẽ dump JSON) hoặc str; mặc định: block rỗng
+      cho mọi subtask được yêu cầu, hoặc item tổng hợp theo response_schema khi
+      items_per_block > 0. generate_stream() chia text thành chunk_size ký tự.
+    - Mô phỏng provider: latency lognormal (median latency_ms, độ lệch
+      latency_sigma), tỉ lệ lỗi 503 (error_rate) / 429 (rate_limit_rate), số
+      output token tính phí (output_tokens, mặc định ~len(text)/4).
+    - Handle cached-content có TTL thật (đồng hồ `clock`), hết hạn → CachedContentNotFound.
+    - requests / events: deque chỉ giữ `history_size` phần tử gần nhất.
+    - LLM_BACKEND=fake: cấu hình qua env FAKE_LLM_* (from_env()).
+    """
+
+    name = "fake"
+
+    def __init__(
+        self,
+        responder: Optional[Callable[[LLMRequest], Any]] = None,
+        supports_context_cache: bool = True,
+        min_cache_chars: int = 0,
+        clock: Callable[[], float] = time.time,
+        chunk_size: int = 256,
+        latency_ms: float = 0.0,
+        latency_sigma: float = 0.0,
+        error_rate: float = 0.0,
+        rate_limit_rate: float = 0.0,
+        items_per_block: int = 0,
+        output_tokens: Optional[int] = None,
+        seed: Optional[int] = None,
+        sleep: Callable[[float], None] = time.sleep,
+        history_size: int = 1000,
+    ):
+        self.chunk_size = max(1, chunk_size)
+        self.responder = responder or self._default_response
+        self.supports_context_cache = supports_context_cache
+        self.min_cache_chars = min_cache_chars
+        self.clock = clock
+        self.latency_ms = latency_ms
+        self.latency_sigma = latency_sigma
+        self.error_rate = error_rate
+        self.rate_limit_rate = rate_limit_rate
+        self.items_per_block = items_per_block
+        self.output_tokens = output_tokens
+        self.sleep = sleep
+        self.rng = random.Random(seed)
+        self.handles: Dict[str, Tuple[str, float]] = {}
+        # chỉ giữ history_size request / event gần nhất → load test dài không phình bộ nhớ
+        self.requests: Deque[LLMRequest] = deque(maxlen=history_size)
+        self.events: Deque[Tuple[str, str]] = deque(maxlen=history_size)  # (create|renew|delete|expired, handle)
+        self._ids = itertools.count(1)
+        self._lock = threading.Lock()
+
+    @classmethod
+    def from_env(cls) -> "FakeLLMBackend":
+        def _float(name: str, default: float) -> float:
+            return float(os.getenv(name, default))
+
+        seed = os.getenv("FAKE_LLM_SEED")
+        output_tokens = os.getenv("FAKE_LLM_OUTPUT_TOKENS")
+        return cls(
+            latency_ms=_float("FAKE_LLM_LATENCY_MS", 0.0),
+            latency_sigma=_float("FAKE_LLM_LATENCY_SIGMA", 0.0),
+            error_rate=_float("FAKE_LLM_ERROR_RATE", 0.0),
+            rate_limit_rate=_float("FAKE_LLM_RATE_LIMIT_RATE", 0.0),
+            items_per_block=int(_float("FAKE_LLM_ITEMS", 0)),
+            output_tokens=int(output_tokens) if output_tokens else None,
+            seed=int(seed) if seed else None,
+            history_size=int(_float("FAKE_LLM_HISTORY", 1000)),
+        )
+
+    def _default_response(self, request: LLMRequest) -> Dict[str, Any]:
+        if self.items_per_block <= 0 or request.response_schema is None:
+            # VI không gửi response_schema → block rỗng (vẫn hợp lệ)
+            return empty_analysis_response(request.subtasks)
+        words = re.findall(r"[^\W\d_]{4,}", request.prompt)[-200:] or _DEFAULT_WORDS
+        with self._lock:
+            return synthesize_from_schema(request.response_schema, self.rng, self.items_per_block, words)
+
+    def _sample_latency(self) -> float:
+        if self.latency_ms <= 0:
+            return 0.0
+        with self._lock:
+            jitter = math.exp(self.rng.gauss(0.0, self.latency_sigma)) if self.latency_sigma > 0 else 1.0
+        return self.latency_ms * jitter / 1000.0
+
+    def _inject_failure(self) -> None:
+        with self._lock:
+            roll = self.rng.random()
+        if roll < self.rate_limit_rate:
+            raise LLMRateLimited("fake 429: quota exceeded", retry_after=1.0)
+        if roll < self.rate_limit_rate + self.error_rate:
+            self.sleep(self._sample_latency())
+            raise LLMUnavailable("fake 503: backend error")
+
+    def generate(self, request: LLMRequest) -> LLMResponse:
+        with self._lock:
+            self.requests.append(request)
+            cached_tokens = 0
+            if request.cached_content:
+                entry = self.handles.get(request.cached_content)
+                if entry is None or entry[1] <= self.clock():
+                    self.handles.pop(request.cached_content, None)
+                    self.events.append(("expired", request.cached_content))
+                    raise CachedContentNotFound(f"{request.cached_content} not found")
+                cached_tokens = _estimate_tokens(entry[0])
+
+        self._inject_failure()
+        latency = self._sample_latency()
+        if latency:
+            self.sleep(latency)
+        payload = self.responder(request)
+        text = payload if isinstance(payload, str) else json.dumps(payload, ensure_ascii=False)
+        return LLMResponse(
+            text=text,
+            prompt_tokens=_estimate_tokens(request.prompt) + _estimate_tokens(request.system_instruction),
+            output_tokens=self.output_tokens if self.output_tokens is not None else _estimate_tokens(text),
+            cached_tokens=cached_tokens,
+        )
+
+    def generate_stream(self, request: LLMRequest, on_text: Callable[[str], None]) -> LLMResponse:
+        response = self.generate(request)
+        for start in range(0, len(response.text), self.chunk_size):
+            on_text(response.text[start : start + self.chunk_size])
+        return response
+
+    def create_cached_content(
+        self,
+        model: str,
+        system_instruction: str,
+        ttl_seconds: float,
+        display_name: str = "",
+    ) -> CachedContentHandle:
+        if not self.supports_context_cache:
+            raise ContextCacheUnavailable("Context caching disabled on fake backend")
+        if len(system_instruction) < self.min_cache_chars:
+            raise ContextCacheUnavailable("Cached content is too small")
+        with self._lock:
+            name = f"cachedContents/fake-{next(self._ids)}"
+            expires_at = self.clock() + ttl_seconds
+            self.handles[name] = (system_instruction, expires_at)
+            self.events.append(("create", name))
+        return CachedContentHandle(name, expires_at)
+
+    def renew_cached_content(self, handle: CachedContentHandle, ttl_seconds: float) -> CachedContentHandle:
+        with self._lock:
+            entry = self.handles.get(handle.name)
+            if entry is None or entry[1] <= self.clock():
+                self.handles.pop(handle.name, None)
+                raise CachedContentNotFound(f"{handle.name} not found")
+            expires_at = self.clock() + ttl_seconds
+            self.handles[handle.name] = (entry[0], expires_at)
+            self.events.append(("renew", handle.name))
+        return CachedContentHandle(handle.name, expires_at)
+
+    def delete_cached_content(self, handle: CachedContentHandle) -> None:
+        with self._lock:
+            if self.handles.pop(handle.name, None) is not None:
+                self.events.append(("delete", handle.name))
+
+
+# ====== REGISTRY ======
+
+_BACKEND_FACTORIES: Dict[str, Callable[[], LLMBackend]] = {
+    "gemini": GeminiBackend,
+    "fake": FakeLLMBackend.from_env,
+}
+_backend: Optional[LLMBackend] = None
+_backend_lock = threading.Lock()
+
+
+def get_llm_backend() -> LLMBackend:
+    """Backend dùng chung cho toàn app (tạo lười theo env LLM_BACKEND)."""
+    global _backend
+    if _backend is None:
+        with _backend_lock:
+            if _backend is None:
+                name = os.getenv("LLM_BACKEND", "gemini").strip().lower()
+                factory = _BACKEND_FACTORIES.get(name)
+                if factory is None:
+                    raise ValueError(f"Unknown LLM_BACKEND '{name}'. Use one of {sorted(_BACKEND_FACTORIES)}")
+                _backend = factory()
+    return _backend
+
+
+def set_llm_backend(backend: Optional[LLMBackend]) -> Optional[LLMBackend]:
+    """Thay backend (test / load test); trả về backend cũ. None → tạo lại theo env."""
+    global _backend
+    with _backend_lock:
+        previous, _backend = _backend, backend
+    return previous
@@ -0,0 +1,408 @@
+"""
+pre_detectors.py
+
+Rule-based Pre-detection (chạy trước Gemini)
+--------------------------------------------
+Mục tiêu:
+- Làm local những việc vốn chỉ là pattern rule (xem docstring undefinedTerms.py /
+  unsupportedClaims.py): index lần xuất hiện đầu của từ viết tắt / thuật ngữ,
+  match pattern định nghĩa ("là", "được hiểu là", "gọi là", "(viết tắt của …)",
+  "stands for", ...), nhận diện bằng chứng (số liệu, trích dẫn, nguồn).
+- Kết quả dùng theo 2 cách:
+    * hints: vài dòng gợi ý có cấu trúc, chèn vào prompt cho subtask vẫn gọi LLM
+    * items + confidence: nếu đủ chắc (mode "fast"), thay hẳn subtask đó,
+      không cần gửi section + block JSON của nó cho Gemini nữa.
+- Detector là plugin: kế thừa PreDetector, đăng ký bằng register_detector().
+"""
+
+from __future__ import annotations
+
+import os
+import re
+from dataclasses import dataclass, field
+from typing import Any, Dict, Iterable, List, Optional, Set, Tuple
+
+from app.utils.nlp import SentenceSpan, split_sentences
+
+
+# Subtask đủ chắc (>= ngưỡng) mới được thay LLM ở mode "fast"
+DEFAULT_CONFIDENCE_THRESHOLD = 0.85
+# Văn bản "đơn giản": rule-based đủ bao quát cho undefined terms / claims
+DEFAULT_SIMPLE_MAX_SENTENCES = 8
+# Giới hạn số dòng hint mỗi detector (hint để rút gọn việc của LLM, không phình prompt)
+MAX_HINTS_PER_DETECTOR = 12
+
+
+def pre_detectors_enabled() -> bool:
+    return os.getenv("PRE_DETECTORS_ENABLED", "true").strip().lower() in ("1", "true", "yes", "on")
+
+
+def confidence_threshold() -> float:
+    return float(os.getenv("PRE_DETECTOR_CONFIDENCE", DEFAULT_CONFIDENCE_THRESHOLD))
+
+
+# ====== DOCUMENT VIEW ======
+
+@dataclass
+class PreDetectionDocument:
+    """Văn bản đã tách đoạn / câu (offset trên chuỗi gốc) dùng chung cho mọi detector."""
+    content: str
+    language: str
+    paragraphs: List[Tuple[int, int]]
+    sentences: List[SentenceSpan]
+    # index câu -> index đoạn (0-based)
+    sentence_paragraph: List[int]
+
+    @classmethod
+    def build(cls, content: str, language: str) -> "PreDetectionDocument":
+        breaks = r"\n\s*\n" if re.search(r"\n\s*\n", content) else r"\n"
+        paragraphs: List[Tuple[int, int]] = []
+        cursor = 0
+        for match in list(re.finditer(breaks, content)) + [None]:
+            end = match.start() if match else len(content)
+            if content[cursor:end].strip():
+                paragraphs.append((cursor, end))
+            cursor = match.end() if match else cursor
+
+        sentences: List[SentenceSpan] = []
+        sentence_paragraph: List[int] = []
+        for p_index, (start, end) in enumerate(paragraphs):
+            for span in split_sentences(content[start:end]):
+                sentences.append(SentenceSpan(span.text, span.start + start, span.end + start))
+                sentence_paragraph.append(p_index)
+        return cls(content, language, paragraphs, sentences, sentence_paragraph)
+
+    def sentence_at(self, position: int) -> int:
+        for index, span in enumerate(self.sentences):
+            if span.start <= position < span.end:
+                return index
+        return max(len(self.sentences) - 1, 0)
+
+    def location(self, sentence_index: int) -> str:
+        """Cùng format location mà prompt yêu cầu: "Paragraph X, Sentence Y" (1-based)."""
+        p_index = self.sentence_paragraph[sentence_index]
+        first = self.sentence_paragraph.index(p_index)
+        return f"Paragraph {p_index + 1}, Sentence {sentence_index - first + 1}"
+
+
+@dataclass
+class PreDetection:
+    """Kết quả gộp của mọi detector."""
+    hints: Dict[str, List[str]] = field(default_factory=dict)
+    items: Dict[str, List[Dict[str, Any]]] = field(default_factory=dict)
+    confidence: Dict[str, float] = field(default_factory=dict)
+    # dữ liệu trung gian chia sẻ giữa các detector (vd. definitions → term_index)
+    shared: Dict[str, Any] = field(default_factory=dict)
+    detectors: List[str] = field(default_factory=list)
+
+    def add_hint(self, subtask: str, line: str) -> None:
+        self.hints.setdefault(subtask, []).append(line)
+
+    def resolve(self, subtask: str, items: List[Dict[str, Any]], confidence: float) -> None:
+        self.items[subtask] = items
+        self.confidence[subtask] = max(confidence, self.confidence.get(subtask, 0.0))
+
+    def resolved_subtasks(self, threshold: Optional[float] = None) -> Set[str]:
+        if threshold is None:
+            threshold = confidence_threshold()
+        return {name for name, value in self.confidence.items() if value >= threshold}
+
+    def hints_for(self, subtasks: Iterable[str]) -> List[str]:
+        wanted = set(subtasks)
+        return [line for name, lines in self.hints.items() if name in wanted for line in lines]
+
+    def summary(self) -> Dict[str, Any]:
+        return {
+            "detectors": list(self.detectors),
+            "confidence": dict(self.confidence),
+            "total_hints": sum(len(lines) for lines in self.hints.values()),
+            "items_found": {name: len(items) for name, items in self.items.items()},
+        }
+
+
+class PreDetector:
+    """Base class cho detector. name phải unique trong registry."""
+
+    name: str = ""
+
+    def detect(self, doc: PreDetectionDocument, report: PreDetection) -> None:
+        raise NotImplementedError
+
+
+# ====== BUILT-IN DETECTORS ======
+
+class StructureDetector(PreDetector):
+    """
+    Văn bản 1 đoạn → không thể có logical jump; < 2 câu → không thể có mâu thuẫn.
+    """
+
+    name = "structure"
+
+    def detect(self, doc: PreDetectionDocument, report: PreDetection) -> None:
+        report.shared["total_paragraphs"] = len(doc.paragraphs)
+        report.shared["total_sentences"] = len(doc.sentences)
+        if len(doc.paragraphs) < 2:
+            report.resolve("logical_jumps", [], 1.0)
+        if len(doc.sentences) < 2:
+            report.resolve("contradictions", [], 1.0)
+
+
+# Token dạng thuật ngữ: viết tắt (NLP, GPT-4, RAG) hoặc CamelCase (NoSQL, PyTorch)
+_TERM_TOKEN = r"[A-Z][A-Za-z0-9]*[A-Z][A-Za-z0-9]*(?:-[A-Za-z0-9]+)*"
+_TERM_RE = re.compile(rf"(?<![\w-])({_TERM_TOKEN})s?(?![\w-])")
+
+# Cụm từ viết hoa có thể là phần mở rộng: "Natural Language Processing (NLP)"
+_EXPANSION_RE = re.compile(rf"([^\W\d_][\w-]*(?:\s+[^\W\d_][\w-]*){{1,7}})\s*\(\s*({_TERM_TOKEN})\s*\)")
+
+_DEFINITION_PATTERNS = {
+    "en": [
+        rf"(?P<term>{_TERM_TOKEN}|\"[^\"]+\")\s*\(\s*(?:short for|stands for|i\.e\.,?)\s+(?P<definition>[^)]+)\)",
+        rf"(?P<term>{_TERM_TOKEN}|\"[^\"]+\")\s*,?\s+(?:is|are)\s+(?:defined as|called|known as|short for)\s+(?P<definition>[^.;]+)",
+        rf"(?P<term>{_TERM_TOKEN}|\"[^\"]+\")\s*,?\s+(?:means|refers to|stands for|denotes)\s+(?P<definition>[^.;]+)",
+        rf"(?P<term>{_TERM_TOKEN}|\"[^\"]+\")\s*,\s+(?:also known as|which is|i\.e\.,?)\s+(?P<definition>[^.;]+)",
+        rf"(?P<term>{_TERM_TOKEN})\s+(?:is|are)\s+(?:an?|the)\s+(?P<definition>[^.;]+)",
+    ],
+    "vi": [
+        rf"(?P<term>{_TERM_TOKEN}|\"[^\"]+\")\s*\(\s*(?:viết tắt của|tức là|nghĩa là)\s+(?P<definition>[^)]+)\)",
+        rf"(?P<term>{_TERM_TOKEN}|\"[^\"]+\")\s*,?\s+(?:được hiểu là|được định nghĩa là|có nghĩa là|nghĩa là|tức là|hay còn gọi là|là viết tắt của|là)\s+(?P<definition>[^.;]+)",
+        rf"(?:gọi là|được gọi là)\s+(?P<term>{_TERM_TOKEN}|\"[^\"]+\")(?P<definition>)",
+    ],
+}
+_COMPILED_DEFINITIONS = {
+    language: [re.compile(pattern) for pattern in patterns]
+    for language, patterns in _DEFINITION_PATTERNS.items()
+}
+
+
+def _normalize_term(term: str) -> str:
+    term = term.strip().strip('"').strip()
+    if len(term) > 2 and term.endswith("s") and term[:-1].isupper():
+        term = term[:-1]
+    return term
+
+
+class DefinitionDetector(PreDetector):
+    """Match pattern định nghĩa EN + VI (cả 2 bộ, văn bản hay trộn ngôn ngữ)."""
+
+    name = "definitions"
+
+    def detect(self, doc: PreDetectionDocument, report: PreDetection) -> None:
+        definitions: Dict[str, Dict[str, Any]] = {}
+        for patterns in _COMPILED_DEFINITIONS.values():
+            for pattern in patterns:
+                for match in pattern.finditer(doc.content):
+                    term = _normalize_term(match.group("term"))
+                    if term and term not in definitions:
+                        definitions[term] = {
+                            "position": match.start(),
+                            "definition": (match.group("definition") or "").strip(),
+                        }
+        for match in _EXPANSION_RE.finditer(doc.content):
+            term = match.group(2)
+            expansion = match.group(1).split()
+            # Phần mở rộng phải "khớp" viết tắt: đủ số từ (NLP ← Natural Language Processing)
+            if len(expansion) >= min(len(term), 2) and term not in definitions:
+                definitions[term] = {"position": match.start(2), "definition": match.group(1).strip()}
+        report.shared["definitions"] = definitions
+
+
+class TermIndexDetector(PreDetector):
+    """
+    Index lần xuất hiện đầu của mỗi thuật ngữ (viết tắt / CamelCase) và kiểm tra
+    có định nghĩa ở câu đó hoặc câu ngay sau không.
+    """
+
+    name = "term_index"
+
+    # Viết tắt phổ biến, không cần định nghĩa
+    COMMON_TERMS = frozenset({
+        "AI", "OK", "TV", "PC", "USA", "UK", "EU", "UN", "CEO", "PDF", "URL", "HTML", "USB",
+        "GPS", "FAQ", "ID", "IT", "PhD", "HTTP", "HTTPS", "API", "CPU", "GPU", "AM", "PM", "VN", "TP", "HCM", "THPT", "ĐH",
+    })
+
+    def detect(self, doc: PreDetectionDocument, report: PreDetection) -> None:
+        definitions: Dict[str, Dict[str, Any]] = report.shared.get("definitions", {})
+        index: Dict[str, Dict[str, Any]] = {}
+        for match in _TERM_RE.finditer(doc.content):
+            term = _normalize_term(match.group(1))
+            entry = index.get(term)
+            if entry is None:
+                index[term] = {"start": match.start(1), "end": match.end(1), "count": 1}
+            else:
+                entry["count"] += 1
+        report.shared["term_index"] = index
+
+        items: List[Dict[str, Any]] = []
+        for term, entry in sorted(index.items(), key=lambda kv: kv[1]["start"]):
+            if term in self.COMMON_TERMS or not doc.sentences:
+                continue
+            sentence_index = doc.sentence_at(entry["start"])
+            definition = definitions.get(term)
+            if definition is not None:
+                defined_at = doc.sentence_at(definition["position"])
+                if defined_at <= sentence_index + 1:
+                    report.add_hint(
+                        "undefined_terms",
+                        f'"{term}" defined at first use ({doc.location(sentence_index)})',
+                    )
+                    continue
+            location = doc.location(sentence_index)
+            items.append(
+                {
+                    "term": term,
+                    "first_appeared": location,
+                    "context_snippet": doc.sentences[sentence_index].text[:150],
+                    "is_defined": False,
+                    "reason": "Acronym / technical term used without a definition pattern at first occurrence",
+                    "suggestion": "Expand or define the term the first time it appears",
+                    "start_pos": entry["start"],
+                    "end_pos": entry["end"],
+                    "source": "rule_based",
+                }
+            )
+            report.add_hint(
+                "undefined_terms",
+                f'"{term}" first used in {location} ({entry["count"]}x), no definition pattern found',
+            )
+
+        simple = len(doc.sentences) <= int(
+            os.getenv("PRE_DETECTOR_SIMPLE_MAX_SENTENCES", DEFAULT_SIMPLE_MAX_SENTENCES)
+        )
+        report.resolve("undefined_terms", items, 0.9 if simple else 0.5)
+
+
+_EVIDENCE_RES = [
+    re.compile(r"\d+(?:[.,]\d+)?\s*(?:%|‰|percent|phần trăm)", re.IGNORECASE),
+    re.compile(r"\[\d+(?:\s*[,–-]\s*\d+)*\]"),  # [12], [3-5]
+    re.compile(r"\([^()]*\b(?:19|20)\d{2}[a-z]?\)"),  # (Smith, 2020), (Nguyễn và cs., 2021)
+    re.compile(r"\bet al\.", re.IGNORECASE),
+    re.compile(r"https?://\S+"),
+    re.compile(
+        r"\b(?:according to|reported by|data from|survey|study|studies|research shows|"
+        r"theo|nghiên cứu (?:của|cho thấy)|báo cáo|khảo sát|số liệu|thống kê|dữ liệu từ)\b",
+        re.IGNORECASE,
+    ),
+    re.compile(r"\b\d{2,}(?:[.,]\d+)*\b"),  # số liệu cụ thể
+]
+
+_CLAIM_MARKERS = {
+    "absolute": re.compile(
+        r"\b(?:always|never|all|none|every|completely|perfectly|definitely|certainly|"
+        r"luôn luôn|luôn|không bao giờ|tất cả|hoàn toàn|chắc chắn|tuyệt đối|mọi)\b",
+        re.IGNORECASE,
+    ),
+    "comparative": re.compile(
+        r"\b(?:better|worse|faster|slower|more \w+ than|less \w+ than|superior|"
+        r"tốt hơn|kém hơn|nhanh hơn|chậm hơn|vượt trội|hiệu quả hơn)\b",
+        re.IGNORECASE,
+    ),
+    "causal": re.compile(
+        r"\b(?:causes?|leads? to|results? in|because of|due to|"
+        r"gây ra|dẫn đến|dẫn tới|là nguyên nhân|do đó|vì vậy)\b",
+        re.IGNORECASE,
+    ),
+    "predictive": re.compile(
+        r"\b(?:will|is going to|in the future|sẽ|trong tương lai)\b",
+        re.IGNORECASE,
+    ),
+}
+
+
+class EvidenceDetector(PreDetector):
+    """
+    Câu có dấu hiệu khẳng định (tuyệt đối / so sánh / nhân quả / dự đoán)
+    mà trong ±2 câu không có bằng chứng (số liệu, trích dẫn, nguồn) → nghi unsupported.
+    """
+
+    name = "evidence"
+    WINDOW = 2
+
+    def detect(self, doc: PreDetectionDocument, report: PreDetection) -> None:
+        evidence = [any(r.search(span.text) for r in _EVIDENCE_RES) for span in doc.sentences]
+        report.shared["evidence_sentences"] = [i for i, flag in enumerate(evidence) if flag]
+
+        items: List[Dict[str, Any]] = []
+        for index, span in enumerate(doc.sentences):
+            claim_type = next(
+                (name for name, pattern in _CLAIM_MARKERS.items() if pattern.search(span.text)),
+                None,
+            )
+            if claim_type is None:
+                continue
+            window = range(max(0, index - self.WINDOW), min(len(doc.sentences), index + self.WINDOW + 1))
+            if any(evidence[i] for i in window):
+                report.add_hint(
+                    "unsupported_claims",
+                    f"{doc.location(index)}: {claim_type} claim with nearby evidence",
+                )
+                continue
+            location = doc.location(index)
+            items.append(
+                {
+                    "claim": span.text,
+                    "location": location,
+                    "status": "unsupported",
+                    "claim_type": claim_type,
+                    "reason": f"No data, citation or source within ±{self.WINDOW} sentences",
+                    "surrounding_context": " ".join(doc.sentences[i].text for i in window)[:300],
+                    "suggestion": "Add concrete evidence, cite a source, or soften the claim.",
+                    "start_pos": span.start,
+                    "end_pos": span.end,
+                    "source": "rule_based",
+                }
+            )
+            report.add_hint(
+                "unsupported_claims",
+                f"{location}: {claim_type} claim, no evidence within ±{self.WINDOW} sentences",
+            )
+
+        simple = len(doc.sentences) <= int(
+            os.getenv("PRE_DETECTOR_SIMPLE_MAX_SENTENCES", DEFAULT_SIMPLE_MAX_SENTENCES)
+        )
+        # Không khớp marker nào ≠ không có claim (danh sách marker hẹp) → chỉ văn bản ngắn mới đủ tin
+        report.resolve("unsupported_claims", items, 0.9 if simple else 0.5)
+
+
+# ====== REGISTRY ======
+
+# Thứ tự chạy có ý nghĩa: definitions phải chạy trước term_index
+_DETECTORS: Dict[str, PreDetector] = {}
+
+
+def register_detector(detector: PreDetector) -> PreDetector:
+    if not detector.name:
+        raise ValueError("Detector must define a name")
+    _DETECTORS[detector.name] = detector
+    return detector
+
+
+def unregister_detector(name: str) -> None:
+    _DETECTORS.pop(name, None)
+
+
+def registered_detectors() -> List[str]:
+    return list(_DETECTORS)
+
+
+for _detector in (StructureDetector(), DefinitionDetector(), TermIndexDetector(), EvidenceDetector()):
+    register_detector(_detector)
+
+
+def run_pre_detectors(
+    content: str,
+    language: str = "vi",
+    names: Optional[Iterable[str]] = None,
+) -> PreDetection:
+    """Chạy các detector (mặc định: tất cả đã đăng ký) trên văn bản gốc."""
+    doc = PreDetectionDocument.build(content or "", language)
+    report = PreDetection()
+    selected = list(names) if names is not None else list(_DETECTORS)
+    for name in selected:
+        detector = _DETECTORS.get(name)
+        if detector is None:
+            raise ValueError(f"Unknown pre-detector '{name}'")
+        detector.detect(doc, report)
+        report.detectors.append(name)
+    for subtask, lines in report.hints.items():
+        del lines[MAX_HINTS_PER_DETECTOR:]
+    return report
@@ -7,6 +7,10 @@ Chứa các prompt dùng cho:
 - Unified Analysis EN (4 + 1 subtasks: contradictions, undefined terms, unsupported claims,
   logical jumps, spelling errors)
 - Unified Analysis VI (5 subtasks tương tự, tiếng Việt)
+- Cả 2 prompt unified nhận tham số subtasks để chỉ sinh section + block JSON
+  cho các nhiệm vụ cần gọi LLM (xem UNIFIED_SUBTASKS)
+- Prompt unified được tách: system instruction tĩnh (biên dịch 1 lần, có version)
+  + phần động (context, hints, văn bản) → xem PromptTemplate / get_prompt_template()
 
 Lưu ý quan trọng:
 - Các prompt unified (prompt_analysis, prompt_analysis_vi) có thêm block "spelling_errors"
@@ -19,7 +23,10 @@ Lưu ý quan trọng:
   từ term_normalizer.py thông qua metadata.spelling_errors như bạn đã làm.
 """
 
-from typing import Dict, Any
+import hashlib
+from dataclasses import dataclass, field
+from functools import lru_cache
+from typing import Any, Callable, Dict, Iterable, List, Optional, Tuple
 
 
 # ==============================
@@ -272,82 +279,88 @@ Return ONLY the JSON output. Do not include any markdown code blocks, commentary
 
 
 # =======================================
-# 3. UNIFIED ANALYSIS – ENGLISH
+# 3. UNIFIED ANALYSIS – SUBTASK SECTIONS
 # =======================================
-
-def prompt_analysis(context: Dict[str, Any], content: str) -> str:
-    """
-    Unified English prompt:
-    - Runs 5 subtasks in one call:
-      1) Contradictions
-      2) Undefined Terms
-      3) Unsupported Claims
-      4) Logical Jumps
-      5) Spelling Errors (EN + VI within the document)
-    """
-
-    writing_type = context.get("writing_type", "Document")
-    main_goal = context.get("main_goal", "")
-    criteria = context.get("criteria", [])
-    constraints = context.get("constraints", [])
-
-    context_lines = []
-    context_lines.append(f"Writing Type: {writing_type}")
-    if main_goal:
-        context_lines.append(f"Main Goal: {main_goal}")
-    if criteria:
-        context_lines.append("Criteria:")
-        for c in criteria:
-            context_lines.append(f"  - {c}")
-    if constraints:
-        context_lines.append("Constraints:")
-        for r in constraints:
-            context_lines.append(f"  - {r}")
-    context_block = "\n".join(context_lines)
-
-    prompt = f"""
-You are LogicGuard, an AI assistant specialized in logical and structural analysis of {writing_type} documents.
-
-Your mission: analyse the document along 5 dimensions:
-1) Contradictions
-2) Undefined Terms
-3) Unsupported Claims
-4) Logical Jumps
-5) Spelling Errors (English + Vietnamese)
-
-You receive:
-- CONTEXT: high-level info about the writing task.
-- CONTENT: the full original document as a plain string.
-
-IMPORTANT GLOBAL RULES:
-- You MUST return ONLY ONE JSON object.
-- The JSON MUST be valid (no trailing commas, no comments).
-- Do NOT wrap the JSON in markdown (no ```).
-- Do NOT output any explanation text outside of the JSON.
+# Prompt unified được ghép từ các section theo subtask, để caller có thể bỏ bớt
+# subtask (vd. spelling đã chạy local) mà không phải trả token cho phần đó.
+
+# Thứ tự subtask trong prompt (cũng là thứ tự block trong JSON đầu ra)
+UNIFIED_SUBTASKS = (
+    "contradictions",
+    "undefined_terms",
+    "unsupported_claims",
+    "logical_jumps",
+    "spelling_errors",
+)
+
+_SECTION_SEPARATOR = "------------------------------------------\n"
+
+
+def _select_subtasks(subtasks: Optional[Iterable[str]]) -> List[str]:
+    """Chuẩn hoá danh sách subtask theo thứ tự UNIFIED_SUBTASKS."""
+    if subtasks is None:
+        return list(UNIFIED_SUBTASKS)
+
+    requested = set(subtasks)
+    unknown = requested - set(UNIFIED_SUBTASKS)
+    if unknown:
+        raise ValueError(f"Unknown subtask(s): {sorted(unknown)}")
+    selected = [name for name in UNIFIED_SUBTASKS if name in requested]
+    if not selected:
+        raise ValueError("At least one subtask is required")
+    return selected
+
+
+_EN_HINTS_HEADER = (
+    "### PRE-DETECTED HINTS (rule-based; verify against CONTENT, do not copy blindly)"
+)
+_VI_HINTS_HEADER = (
+    "### GỢI Ý PHÁT HIỆN TRƯỚC (rule-based; đối chiếu với CONTENT, không chép nguyên)"
+)
+
+
+def _hints_block(hints: Optional[Iterable[str]], header: str) -> str:
+    """Section gợi ý từ pre-detectors; rỗng thì prompt giữ nguyên như cũ."""
+    lines = [line for line in (hints or []) if line]
+    if not lines:
+        return ""
+    body = "\n".join(f"- {line}" for line in lines)
+    return f"\n{_SECTION_SEPARATOR}{header}\n{body}\n"
+
+
+def _total_issues_formula(selected: List[str]) -> str:
+    return "\n".join(
+        f"  {'+ ' if i else ''}{name}.total_found" for i, name in enumerate(selected)
+    )
+
+
+_EN_DIMENSIONS = {
+    "contradictions": "Contradictions",
+    "undefined_terms": "Undefined Terms",
+    "unsupported_claims": "Unsupported Claims",
+    "logical_jumps": "Logical Jumps",
+    "spelling_errors": "Spelling Errors (English + Vietnamese)",
+}
+
+_EN_DETECT_LABELS = {
+    "contradictions": "contradictions",
+    "undefined_terms": "undefined terms",
+    "unsupported_claims": "unsupported claims",
+    "logical_jumps": "logical jumps",
+}
+
+_EN_SPELLING_RULES = """\
 - ALL positions (start_pos, end_pos) for spelling errors are 0-based character indices
   on the ORIGINAL CONTENT string exactly as given in the DOCUMENT block.
 - end_pos is exclusive (same convention as Python slicing: content[start_pos:end_pos]).
 - Do NOT treat brand names or clearly intentional product/model names as spelling errors
   (e.g., "iPhone", "YouTube", "Z-Trax", "NeuroLearn-X", etc.).
+"""
 
-------------------------------------------
-### CONTEXT
-{context_block}
-
-------------------------------------------
-### DOCUMENT (CONTENT STRING TO ANALYSE)
-<<<BEGIN DOCUMENT>>>
-{content}
-<<<END DOCUMENT>>>
-
-You MUST use this exact CONTENT above to:
-- Detect contradictions, undefined terms, unsupported claims, logical jumps.
-- Detect spelling errors (both English and Vietnamese).
-- Compute all start_pos / end_pos for spelling_errors.
-
-------------------------------------------
-### SUBTASK 1 – CONTRADICTIONS
-
+_EN_SUBTASKS = {
+    "contradictions": (
+        "CONTRADICTIONS",
+        """\
 - Find pairs of statements (sentences) that cannot both be true.
 - Look for conflicting facts, numbers, dates, events, or strong opinions that directly oppose each other.
 - For each contradiction item:
@@ -358,10 +371,11 @@ You MUST use this exact CONTENT above to:
   - explanation: 1–3 sentences explaining why they contradict.
   - suggestion: concrete suggestion to resolve or clarify the conflict.
 - total_found MUST equal the length of items.
-
-------------------------------------------
-### SUBTASK 2 – UNDEFINED TERMS
-
+""",
+    ),
+    "undefined_terms": (
+        "UNDEFINED TERMS",
+        """\
 - Find technical terms, acronyms, model names, product names, or domain-specific concepts
   that are important but NOT clearly defined at first use.
 - A term is considered "defined" if:
@@ -377,10 +391,11 @@ You MUST use this exact CONTENT above to:
   - reason: why this term is considered undefined or unclear.
   - suggestion: how the author could define or clarify it.
 - total_found MUST equal the length of items.
-
-------------------------------------------
-### SUBTASK 3 – UNSUPPORTED CLAIMS
-
+""",
+    ),
+    "unsupported_claims": (
+        "UNSUPPORTED CLAIMS",
+        """\
 A claim is:
 - A statement that asserts something about reality, trends, relationships, predictions, comparisons, or causes.
 
@@ -402,10 +417,11 @@ For each unsupported claim item:
 - suggestion: what kind of evidence or rephrasing would fix it.
 
 total_found MUST equal the length of items.
-
-------------------------------------------
-### SUBTASK 4 – LOGICAL JUMPS
-
+""",
+    ),
+    "logical_jumps": (
+        "LOGICAL JUMPS",
+        """\
 - Inspect transitions between paragraphs.
 - A logical jump occurs when the topic or reasoning changes abruptly
   without any clear bridge sentence, explanation, or justification.
@@ -421,10 +437,11 @@ total_found MUST equal the length of items.
   - suggestion: how to add a bridge or restructure paragraphs.
 - Only include items where coherence_score < 0.7.
 - total_found MUST equal the length of items.
-
-------------------------------------------
-### SUBTASK 5 – SPELLING ERRORS (EN + VI)
-
+""",
+    ),
+    "spelling_errors": (
+        "SPELLING ERRORS (EN + VI)",
+        """\
 - Detect spelling mistakes in both English and Vietnamese in the CONTENT.
 - Include common typos, extra letters, missing letters, swapped letters,
   or obviously wrong spellings of common words or phrases.
@@ -449,24 +466,16 @@ total_found MUST equal the length of items.
   - reason: short explanation why this is considered a spelling error.
 - If there are no obvious spelling errors, set total_found = 0 and items = [].
 - total_found MUST equal the length of items.
+""",
+    ),
+}
 
-------------------------------------------
-### JSON OUTPUT FORMAT (STRICT)
-
-Return JSON with exactly this structure (field names must match):
-
-{{
-    "analysis_metadata": {{
-        "analyzed_at": "ISO timestamp",
-        "writing_type": "{writing_type}",
-        "total_paragraphs": <int>,
-        "total_sentences": <int>
-    }},
-    
-    "contradictions": {{
+_EN_JSON_BLOCKS = {
+    "contradictions": """\
+    "contradictions": {
         "total_found": <int>,
         "items": [
-            {{
+            {
                 "id": 1,
                 "sentence1": "Full text of first statement",
                 "sentence2": "Full text of contradicting statement",
@@ -476,28 +485,28 @@ Return JSON with exactly this structure (field names must match):
                 "severity": "high|medium|low",
                 "explanation": "Why these two statements contradict each other",
                 "suggestion": "How to resolve or clarify the conflict"
-            }}
+            }
         ]
-    }},
-    
-    "undefined_terms": {{
+    }""",
+    "undefined_terms": """\
+    "undefined_terms": {
         "total_found": <int>,
         "items": [
-            {{
+            {
                 "term": "gradient clipping",
                 "first_appeared": "Paragraph 3, Sentence 1",
                 "context_snippet": "Short excerpt showing where the term appears...",
                 "is_defined": false,
                 "reason": "Term appears without definition or clear explanation",
                 "suggestion": "Provide a short definition or explanation the first time it appears"
-            }}
+            }
         ]
-    }},
-    
-    "unsupported_claims": {{
+    }""",
+    "unsupported_claims": """\
+    "unsupported_claims": {
         "total_found": <int>,
         "items": [
-            {{
+            {
                 "claim": "AI can perfectly predict human emotions.",
                 "location": "Paragraph 2, Sentence 3",
                 "status": "unsupported",
@@ -505,14 +514,14 @@ Return JSON with exactly this structure (field names must match):
                 "reason": "No supporting data, examples, or citations within ±2 sentences",
                 "surrounding_context": "Short excerpt around the claim...",
                 "suggestion": "Add concrete evidence, cite research, or weaken the claim."
-            }}
+            }
         ]
-    }},
-    
-    "logical_jumps": {{
+    }""",
+    "logical_jumps": """\
+    "logical_jumps": {
         "total_found": <int>,
         "items": [
-            {{
+            {
                 "from_paragraph": 5,
                 "to_paragraph": 6,
                 "from_paragraph_summary": "Short summary of paragraph 5 topic",
@@ -522,97 +531,41 @@ Return JSON with exactly this structure (field names must match):
                 "severity": "high|medium|low",
                 "explanation": "Why this transition feels abrupt or poorly connected",
                 "suggestion": "Add a linking sentence, reorder paragraphs, or clarify why the topic changes."
-            }}
+            }
         ]
-    }},
-    
-    "spelling_errors": {{
+    }""",
+    "spelling_errors": """\
+    "spelling_errors": {
         "total_found": <int>,
         "items": [
-            {{
+            {
                 "original": "deeplearnnig",
                 "suggested": "deep learning",
                 "start_pos": 120,
                 "end_pos": 132,
                 "language": "en",
                 "reason": "Common English AI term misspelled (letters swapped)"
-            }}
+            }
         ]
-    }},
-    
-    "summary": {{
-        "total_issues": <int>,
-        "critical_issues": <int>,
-        "document_quality_score": <int>,
-        "key_recommendations": [
-            "Most important recommendation 1",
-            "Most important recommendation 2",
-            "Most important recommendation 3"
-        ]
-    }}
-}}
-
-- total_issues should approximately equal:
-  contradictions.total_found
-  + undefined_terms.total_found
-  + unsupported_claims.total_found
-  + logical_jumps.total_found
-  + spelling_errors.total_found
-
-------------------------------------------
-Return ONLY valid JSON. Do NOT include markdown, comments, or any text outside the JSON.
-"""
-    return prompt
-
-
-# =======================================
-# 4. UNIFIED ANALYSIS – VIETNAMESE
-# =======================================
-
-def prompt_analysis_vi(context: Dict[str, Any], content: str) -> str:
-    """
-    Unified Vietnamese prompt – 5 nhiệm vụ:
-    1) Mâu thuẫn logic
-    2) Thuật ngữ chưa định nghĩa
-    3) Luận điểm thiếu chứng cứ
-    4) Nhảy logic
-    5) Lỗi chính tả (VI + EN trong văn bản)
-    ƯU TIÊN: phát hiện lỗi chính tả TRƯỚC, sau đó mới tới các lỗi logic khác.
-    """
-
-    writing_type = context.get("writing_type", "Văn bản")
-    main_goal = context.get("main_goal", "")
-    criteria = context.get("criteria", [])
-    constraints = context.get("constraints", [])
-
-    context_lines = []
-    context_lines.append(f"Loại văn bản: {writing_type}")
-    if main_goal:
-        context_lines.append(f"Mục tiêu chính: {main_goal}")
-    if criteria:
-        context_lines.append("Tiêu chí đánh giá:")
-        for c in criteria:
-            context_lines.append(f"  - {c}")
-    if constraints:
-        context_lines.append("Ràng buộc:")
-        for r in constraints:
-            context_lines.append(f"  - {r}")
-    context_block = "\n".join(context_lines)
-
-    prompt = f"""
-Bạn là LogicGuard – AI phân tích logic và cấu trúc cho các tài liệu {writing_type}.
-
-Nhiệm vụ: phân tích văn bản theo 5 chiều:
-1) Mâu thuẫn logic (Contradictions)
-2) Thuật ngữ chưa định nghĩa (Undefined Terms)
-3) Luận điểm thiếu chứng cứ (Unsupported Claims)
-4) Nhảy logic (Logical Jumps)
-5) Lỗi chính tả (tiếng Việt + tiếng Anh xuất hiện trong văn bản)
-
-Bạn nhận được:
-- CONTEXT: thông tin tổng quan về nhiệm vụ viết.
-- CONTENT: toàn bộ văn bản gốc dạng chuỗi.
-
+    }""",
+}
+
+_VI_DIMENSIONS = {
+    "contradictions": "Mâu thuẫn logic (Contradictions)",
+    "undefined_terms": "Thuật ngữ chưa định nghĩa (Undefined Terms)",
+    "unsupported_claims": "Luận điểm thiếu chứng cứ (Unsupported Claims)",
+    "logical_jumps": "Nhảy logic (Logical Jumps)",
+    "spelling_errors": "Lỗi chính tả (tiếng Việt + tiếng Anh xuất hiện trong văn bản)",
+}
+
+_VI_DETECT_LABELS = {
+    "contradictions": "mâu thuẫn",
+    "undefined_terms": "thuật ngữ chưa định nghĩa",
+    "unsupported_claims": "luận điểm thiếu chứng cứ",
+    "logical_jumps": "nhảy logic",
+}
+
+_VI_SPELLING_PRIORITY = """\
 ⚠️ QUY TẮC ƯU TIÊN CỰC KỲ QUAN TRỌNG:
 - BƯỚC 1: Đọc toàn bộ văn bản và PHẢI phát hiện lỗi chính tả trước tiên.
 - BƯỚC 2: Sau khi đã xác định xong các lỗi chính tả rõ ràng, bạn mới phân tích 4 nhóm lỗi logic còn lại.
@@ -623,25 +576,12 @@ Bạn nhận được:
 
 - Nếu bạn gần như chắc chắn (> 70%) một từ/cụm từ là sai chính tả theo NGỮ CẢNH,
   bạn PHẢI gắn cờ lỗi đó (KHÔNG bỏ qua chỉ vì hơi không chắc).
+"""
 
-------------------------------------------
-### NGỮ CẢNH
-{context_block}
-
-------------------------------------------
-### VĂN BẢN (CONTENT GỐC CẦN PHÂN TÍCH)
-<<<BẮT ĐẦU VĂN BẢN>>>
-{content}
-<<<KẾT THÚC VĂN BẢN>>>
-
-Bạn PHẢI dùng chính xác chuỗi CONTENT trên để:
-- Phát hiện mâu thuẫn, thuật ngữ chưa định nghĩa, luận điểm thiếu chứng cứ, nhảy logic.
-- Phát hiện lỗi chính tả (tiếng Việt + tiếng Anh).
-- Tính mọi start_pos / end_pos cho spelling_errors.
-
-------------------------------------------
-### 1) MÂU THUẪN LOGIC (contradictions)
-
+_VI_SUBTASKS = {
+    "contradictions": (
+        "MÂU THUẪN LOGIC (contradictions)",
+        """\
 - Tìm các cặp câu / phát biểu không thể cùng đúng.
 - Tập trung vào xung đột về số liệu, ngày tháng, sự kiện, hoặc khẳng định đối lập trực tiếp.
 - Mỗi item:
@@ -652,10 +592,11 @@ Bạn PHẢI dùng chính xác chuỗi CONTENT trên để:
   - explanation: 1–3 câu giải thích vì sao hai câu mâu thuẫn.
   - suggestion: gợi ý cụ thể để sửa hoặc làm rõ.
 - total_found PHẢI bằng số lượng items.
-
-------------------------------------------
-### 2) THUẬT NGỮ CHƯA ĐỊNH NGHĨA (undefined_terms)
-
+""",
+    ),
+    "undefined_terms": (
+        "THUẬT NGỮ CHƯA ĐỊNH NGHĨA (undefined_terms)",
+        """\
 - Tìm các thuật ngữ kỹ thuật, tên mô hình, tên sản phẩm, từ viết tắt,
   khái niệm chuyên ngành quan trọng nhưng KHÔNG được giải thích rõ ở lần xuất hiện đầu.
 - Một thuật ngữ được xem là "đã định nghĩa" nếu:
@@ -674,10 +615,11 @@ Bạn PHẢI dùng chính xác chuỗi CONTENT trên để:
   - reason: vì sao xem là chưa định nghĩa / chưa rõ.
   - suggestion: gợi ý cách bổ sung định nghĩa.
 - total_found PHẢI bằng số lượng items.
-
-------------------------------------------
-### 3) LUẬN ĐIỂM THIẾU CHỨNG CỨ (unsupported_claims)
-
+""",
+    ),
+    "unsupported_claims": (
+        "LUẬN ĐIỂM THIẾU CHỨNG CỨ (unsupported_claims)",
+        """\
 Luận điểm là:
 - Khẳng định về sự thật, xu hướng, quan hệ, dự đoán, so sánh, hay nhân quả.
 
@@ -699,10 +641,11 @@ Mỗi item:
 - suggestion: gợi ý loại chứng cứ cần bổ sung hoặc cách giảm mức độ tuyệt đối của câu.
 
 total_found PHẢI bằng số lượng items.
-
-------------------------------------------
-### 4) NHẢY LOGIC (logical_jumps)
-
+""",
+    ),
+    "logical_jumps": (
+        "NHẢY LOGIC (logical_jumps)",
+        """\
 - Xem xét sự chuyển ý giữa các đoạn văn.
 - Nhảy logic xảy ra khi chủ đề hoặc lập luận đổi hướng đột ngột,
   thiếu câu nối, giải thích, hoặc mối liên hệ rõ ràng.
@@ -718,10 +661,11 @@ total_found PHẢI bằng số lượng items.
   - suggestion: gợi ý thêm câu chuyển ý, sắp xếp lại đoạn, hoặc giải thích liên kết.
 - Chỉ đưa vào các item có coherence_score < 0.7.
 - total_found PHẢI bằng số lượng items.
-
-------------------------------------------
-### 5) LỖI CHÍNH TẢ (spelling_errors – tiếng Việt + tiếng Anh)
-
+""",
+    ),
+    "spelling_errors": (
+        "LỖI CHÍNH TẢ (spelling_errors – tiếng Việt + tiếng Anh)",
+        """\
 ĐÂY LÀ BƯỚC ƯU TIÊN HÀNG ĐẦU.
 
 - Phát hiện lỗi chính tả rõ ràng trong cả tiếng Việt và tiếng Anh xuất hiện trong CONTENT.
@@ -758,7 +702,227 @@ Nếu không có lỗi rõ ràng:
 - items = [].
 
 total_found PHẢI bằng số lượng items.
+""",
+    ),
+}
+
+_VI_JSON_BLOCK = """\
+    "{name}": {{
+        "total_found": <số nguyên>,
+        "items": [ ... ]
+    }}"""
+
+
+# =======================================
+# 4. PROMPT TEMPLATES (static + dynamic)
+# =======================================
+#
+# Phần hướng dẫn (nhiệm vụ, luật, section subtask, format JSON) chỉ phụ thuộc
+# (language, subtasks) → build 1 lần, cache lại, gửi qua system_instruction
+# (hoặc context caching của Gemini). Mỗi request chỉ render phần động nhỏ:
+# CONTEXT (kể cả writing_type), hints, DOCUMENT.
+
+
+@dataclass(frozen=True)
+class PromptTemplate:
+    """Template unified đã biên dịch cho 1 (language, subtasks)."""
+    language: str
+    subtasks: Tuple[str, ...]
+    system_instruction: str
+    # sha256 rút gọn của system_instruction: đổi text prompt → đổi version → cache miss
+    version: str
+    render_dynamic: Callable[..., str] = field(repr=False, compare=False)
+
+    def render(
+        self,
+        context: Dict[str, Any],
+        content: str,
+        hints: Optional[Iterable[str]] = None,
+    ) -> str:
+        """Phần động (user message) cho 1 request."""
+        return self.render_dynamic(context, content, hints)
+
+    def full_prompt(
+        self,
+        context: Dict[str, Any],
+        content: str,
+        hints: Optional[Iterable[str]] = None,
+    ) -> str:
+        """System instruction + phần động trong 1 chuỗi (cho model không hỗ trợ system_instruction)."""
+        return f"{self.system_instruction}\n{self.render(context, content, hints)}"
+
+
+def _template_version(system_instruction: str) -> str:
+    return hashlib.sha256(system_instruction.encode("utf-8")).hexdigest()[:16]
+
+
+def _context_block(
+    context: Dict[str, Any],
+    labels: Tuple[str, str, str, str],
+    default_writing_type: str,
+) -> str:
+    writing_type_label, goal_label, criteria_label, constraints_label = labels
+    writing_type = context.get("writing_type", default_writing_type)
+    main_goal = context.get("main_goal", "")
+    criteria = context.get("criteria", [])
+    constraints = context.get("constraints", [])
+
+    context_lines = []
+    context_lines.append(f"{writing_type_label}: {writing_type}")
+    if main_goal:
+        context_lines.append(f"{goal_label}: {main_goal}")
+    if criteria:
+        context_lines.append(f"{criteria_label}:")
+        for c in criteria:
+            context_lines.append(f"  - {c}")
+    if constraints:
+        context_lines.append(f"{constraints_label}:")
+        for r in constraints:
+            context_lines.append(f"  - {r}")
+    return "\n".join(context_lines)
+
+
+# ---------- ENGLISH ----------
+
+_EN_CONTEXT_LABELS = ("Writing Type", "Main Goal", "Criteria", "Constraints")
+
+
+def _system_instruction_en(selected: List[str]) -> str:
+    dimensions = "\n".join(
+        f"{i}) {_EN_DIMENSIONS[name]}" for i, name in enumerate(selected, 1)
+    )
+    spelling = "spelling_errors" in selected
+    spelling_rules = _EN_SPELLING_RULES if spelling else ""
+
+    usage_lines = []
+    detect = [_EN_DETECT_LABELS[name] for name in selected if name in _EN_DETECT_LABELS]
+    if detect:
+        usage_lines.append(f"- Detect {', '.join(detect)}.")
+    if spelling:
+        usage_lines.append("- Detect spelling errors (both English and Vietnamese).")
+        usage_lines.append("- Compute all start_pos / end_pos for spelling_errors.")
+    usage_block = "\n".join(usage_lines)
+
+    subtask_sections = "".join(
+        f"{_SECTION_SEPARATOR}### SUBTASK {i} – {_EN_SUBTASKS[name][0]}\n\n{_EN_SUBTASKS[name][1]}\n"
+        for i, name in enumerate(selected, 1)
+    )
+    json_blocks = "".join(f"{_EN_JSON_BLOCKS[name]},\n    \n" for name in selected)
+
+    return f"""
+You are LogicGuard, an AI assistant specialized in logical and structural analysis of documents
+(the writing type is given in CONTEXT).
+
+Your mission: analyse the document along {len(selected)} dimensions:
+{dimensions}
+
+You receive (in the user message):
+- CONTEXT: high-level info about the writing task.
+- CONTENT: the full original document as a plain string.
+
+IMPORTANT GLOBAL RULES:
+- You MUST return ONLY ONE JSON object.
+- The JSON MUST be valid (no trailing commas, no comments).
+- Do NOT wrap the JSON in markdown (no ```).
+- Do NOT output any explanation text outside of the JSON.
+{spelling_rules}
+You MUST use the exact CONTENT from the user message to:
+{usage_block}
+
+{subtask_sections}------------------------------------------
+### JSON OUTPUT FORMAT (STRICT)
+
+Return JSON with exactly this structure (field names must match):
+
+{{
+    "analysis_metadata": {{
+        "analyzed_at": "ISO timestamp",
+        "writing_type": "<Writing Type from CONTEXT>",
+        "total_paragraphs": <int>,
+        "total_sentences": <int>
+    }},
+    
+{json_blocks}    "summary": {{
+        "total_issues": <int>,
+        "critical_issues": <int>,
+        "document_quality_score": <int>,
+        "key_recommendations": [
+            "Most important recommendation 1",
+            "Most important recommendation 2",
+            "Most important recommendation 3"
+        ]
+    }}
+}}
+
+- total_issues should approximately equal:
+{_total_issues_formula(selected)}
+
 ------------------------------------------
+Return ONLY valid JSON. Do NOT include markdown, comments, or any text outside the JSON.
+"""
+
+
+def _render_dynamic_en(
+    context: Dict[str, Any],
+    content: str,
+    hints: Optional[Iterable[str]],
+) -> str:
+    context_block = _context_block(context, _EN_CONTEXT_LABELS, "Document")
+    hints_block = _hints_block(hints, _EN_HINTS_HEADER)
+    return f"""{_SECTION_SEPARATOR}### CONTEXT
+{context_block}
+{hints_block}
+{_SECTION_SEPARATOR}### DOCUMENT (CONTENT STRING TO ANALYSE)
+<<<BEGIN DOCUMENT>>>
+{content}
+<<<END DOCUMENT>>>
+"""
+
+
+# ---------- VIETNAMESE ----------
+
+_VI_CONTEXT_LABELS = ("Loại văn bản", "Mục tiêu chính", "Tiêu chí đánh giá", "Ràng buộc")
+
+
+def _system_instruction_vi(selected: List[str]) -> str:
+    dimensions = "\n".join(
+        f"{i}) {_VI_DIMENSIONS[name]}" for i, name in enumerate(selected, 1)
+    )
+    spelling = "spelling_errors" in selected
+    priority_block = f"\n{_VI_SPELLING_PRIORITY}" if spelling else ""
+
+    usage_lines = []
+    detect = [_VI_DETECT_LABELS[name] for name in selected if name in _VI_DETECT_LABELS]
+    if detect:
+        usage_lines.append(f"- Phát hiện {', '.join(detect)}.")
+    if spelling:
+        usage_lines.append("- Phát hiện lỗi chính tả (tiếng Việt + tiếng Anh).")
+        usage_lines.append("- Tính mọi start_pos / end_pos cho spelling_errors.")
+    usage_block = "\n".join(usage_lines)
+
+    subtask_sections = "".join(
+        f"{_SECTION_SEPARATOR}### {i}) {_VI_SUBTASKS[name][0]}\n\n{_VI_SUBTASKS[name][1]}\n"
+        for i, name in enumerate(selected, 1)
+    )
+    json_blocks = "".join(
+        f"{_VI_JSON_BLOCK.format(name=name)},\n    \n" for name in selected
+    )
+
+    return f"""
+Bạn là LogicGuard – AI phân tích logic và cấu trúc tài liệu
+(loại văn bản được cho trong NGỮ CẢNH).
+
+Nhiệm vụ: phân tích văn bản theo {len(selected)} chiều:
+{dimensions}
+
+Bạn nhận được (trong tin nhắn người dùng):
+- CONTEXT: thông tin tổng quan về nhiệm vụ viết.
+- CONTENT: toàn bộ văn bản gốc dạng chuỗi.
+{priority_block}
+Bạn PHẢI dùng chính xác chuỗi CONTENT trong tin nhắn người dùng để:
+{usage_block}
+
+{subtask_sections}------------------------------------------
 ### ĐỊNH DẠNG JSON ĐẦU RA (CHUẨN)
 
 Bạn PHẢI trả về JSON với cấu trúc (tên trường y hệt):
@@ -766,37 +930,12 @@ Bạn PHẢI trả về JSON với cấu trúc (tên trường y hệt):
 {{
     "analysis_metadata": {{
         "analyzed_at": "Timestamp ISO",
-        "writing_type": "{writing_type}",
+        "writing_type": "<Loại văn bản trong NGỮ CẢNH>",
         "total_paragraphs": <số nguyên>,
         "total_sentences": <số nguyên>
     }},
     
-    "contradictions": {{
-        "total_found": <số nguyên>,
-        "items": [ ... ]
-    }},
-    
-    "undefined_terms": {{
-        "total_found": <số nguyên>,
-        "items": [ ... ]
-    }},
-    
-    "unsupported_claims": {{
-        "total_found": <số nguyên>,
-        "items": [ ... ]
-    }},
-    
-    "logical_jumps": {{
-        "total_found": <số nguyên>,
-        "items": [ ... ]
-    }},
-    
-    "spelling_errors": {{
-        "total_found": <số nguyên>,
-        "items": [ ... ]
-    }},
-    
-    "summary": {{
+{json_blocks}    "summary": {{
         "total_issues": <tổng số vấn đề phát hiện>,
         "critical_issues": <số vấn đề mức high>,
         "document_quality_score": <0-100>,
@@ -809,13 +948,111 @@ Bạn PHẢI trả về JSON với cấu trúc (tên trường y hệt):
 }}
 
 - total_issues nên xấp xỉ:
-  contradictions.total_found
-  + undefined_terms.total_found
-  + unsupported_claims.total_found
-  + logical_jumps.total_found
-  + spelling_errors.total_found
+{_total_issues_formula(selected)}
 
 ------------------------------------------
 Chỉ trả về JSON hợp lệ. KHÔNG trả lời thêm, KHÔNG dùng markdown, KHÔNG giải thích ngoài JSON.
 """
-    return prompt
+
+
+def _render_dynamic_vi(
+    context: Dict[str, Any],
+    content: str,
+    hints: Optional[Iterable[str]],
+) -> str:
+    context_block = _context_block(context, _VI_CONTEXT_LABELS, "Văn bản")
+    hints_block = _hints_block(hints, _VI_HINTS_HEADER)
+    return f"""{_SECTION_SEPARATOR}### NGỮ CẢNH
+{context_block}
+{hints_block}
+{_SECTION_SEPARATOR}### VĂN BẢN (CONTENT GỐC CẦN PHÂN TÍCH)
+<<<BẮT ĐẦU VĂN BẢN>>>
+{content}
+<<<KẾT THÚC VĂN BẢN>>>
+"""
+
+
+_TEMPLATE_BUILDERS = {
+    "en": (_system_instruction_en, _render_dynamic_en),
+    "vi": (_system_instruction_vi, _render_dynamic_vi),
+}
+
+
+@lru_cache(maxsize=None)
+def _compile_template(language: str, selected: Tuple[str, ...]) -> PromptTemplate:
+    build_system, render_dynamic = _TEMPLATE_BUILDERS[language]
+    system_instruction = build_system(list(selected))
+    return PromptTemplate(
+        language=language,
+        subtasks=selected,
+        system_instruction=system_instruction,
+        version=_template_version(system_instruction),
+        render_dynamic=render_dynamic,
+    )
+
+
+def get_prompt_template(
+    language: str,
+    subtasks: Optional[Iterable[str]] = None,
+) -> PromptTemplate:
+    """Template đã biên dịch (cache theo language + tập subtask)."""
+    if language not in _TEMPLATE_BUILDERS:
+        raise ValueError(f"Unsupported prompt language '{language}'")
+    return _compile_template(language, tuple(_select_subtasks(subtasks)))
+
+
+def prompt_version(language: str) -> str:
+    """
+    Version của bộ prompt unified cho 1 ngôn ngữ (template đủ 5 subtasks).
+    Dùng trong key analysis cache: sửa bất kỳ text prompt nào → kết quả cũ hết hiệu lực.
+    """
+    return get_prompt_template(language).version
+
+
+# =======================================
+# 5. UNIFIED ANALYSIS – 1 CHUỖI (tương thích ngược)
+# =======================================
+
+def prompt_analysis(
+    context: Dict[str, Any],
+    content: str,
+    subtasks: Optional[Iterable[str]] = None,
+    hints: Optional[Iterable[str]] = None,
+) -> str:
+    """
+    Unified English prompt:
+    - Runs the selected subtasks in one call (default: all 5):
+      1) Contradictions
+      2) Undefined Terms
+      3) Unsupported Claims
+      4) Logical Jumps
+      5) Spelling Errors (EN + VI within the document)
+    - subtasks: subset of UNIFIED_SUBTASKS; sections, JSON blocks and the
+      total_issues formula are only emitted for the selected ones.
+    - hints: rule-based pre-detection lines (pre_detectors.py), rendered as a
+      short section the model should verify instead of re-deriving.
+    Static instruction + dynamic part in one string; Analysis.py sends them
+    separately via get_prompt_template().
+    """
+    return get_prompt_template("en", subtasks).full_prompt(context, content, hints)
+
+
+def prompt_analysis_vi(
+    context: Dict[str, Any],
+    content: str,
+    subtasks: Optional[Iterable[str]] = None,
+    hints: Optional[Iterable[str]] = None,
+) -> str:
+    """
+    Unified Vietnamese prompt – mặc định 5 nhiệm vụ:
+    1) Mâu thuẫn logic
+    2) Thuật ngữ chưa định nghĩa
+    3) Luận điểm thiếu chứng cứ
+    4) Nhảy logic
+    5) Lỗi chính tả (VI + EN trong văn bản)
+    ƯU TIÊN: phát hiện lỗi chính tả TRƯỚC, sau đó mới tới các lỗi logic khác.
+    subtasks: tập con của UNIFIED_SUBTASKS, chỉ sinh section/JSON cho các nhiệm vụ được chọn.
+    hints: gợi ý rule-based từ pre_detectors.py, chèn thành 1 section ngắn để model kiểm chứng.
+    Phần tĩnh + phần động trong 1 chuỗi; Analysis.py gửi tách riêng qua get_prompt_template().
+    """
+    return get_prompt_template("vi", subtasks).full_prompt(context, content, hints)
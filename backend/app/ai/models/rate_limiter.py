@@ -0,0 +1,394 @@
+"""
+rate_limiter.py
+
+Client-side rate limiter + concurrency governor cho lời gọi Gemini
+-------------------------------------------------------------------
+- TokenBucket cho requests/phút (LLM_RPM) và tokens/phút (LLM_TPM); 0 = không giới hạn.
+  LLM_RPM / LLM_TPM là quota của CẢ deployment: limiter nằm trong từng process nên
+  mỗi worker nhận LLM_RPM / WEB_CONCURRENCY (số worker uvicorn / gunicorn).
+- Tối đa LLM_MAX_CONCURRENCY lời gọi đồng thời.
+- Hàng đợi công bằng theo user (round-robin): 1 user gửi 20 request không chặn
+  request của user khác; mỗi lượt cấp quyền chuyển user vừa được phục vụ xuống cuối.
+- governed_call(): gọi trong limiter, lỗi 429/5xx → exponential backoff + full
+  jitter (tôn trọng retry_after); 429 còn "pause" cả limiter để các caller khác
+  không cùng lúc đập vào quota → throughput giữ ở trần quota thay vì sụp vì retry.
+- Metric: llm_queue_depth, llm_inflight_requests, llm_limiter_wait_seconds,
+  llm_retries_total, llm_rate_limited_total, llm_tokens_total.
+"""
+
+from __future__ import annotations
+
+import logging
+import os
+import random
+import threading
+import time
+from collections import OrderedDict, deque
+from contextlib import contextmanager
+from typing import Callable, Deque, Iterator, Optional, TypeVar
+
+try:
+    from .llm_backend import LLMError, LLMRateLimited
+    from ...core.metrics import counter, gauge, histogram
+except ImportError:
+    from llm_backend import LLMError, LLMRateLimited
+    from app.core.metrics import counter, gauge, histogram
+
+
+T = TypeVar("T")
+logger = logging.getLogger(__name__)
+
+DEFAULT_RPM = 60
+DEFAULT_TPM = 0
+DEFAULT_MAX_CONCURRENCY = 8
+DEFAULT_QUEUE_TIMEOUT = 60.0
+DEFAULT_MAX_RETRIES = 4
+DEFAULT_BACKOFF_BASE = 1.0
+DEFAULT_BACKOFF_CAP = 30.0
+# Ước lượng output token khi xin quota TPM trước lời gọi (chỉnh lại theo usage thực)
+DEFAULT_ESTIMATED_OUTPUT_TOKENS = 2048
+
+QUEUE_DEPTH = gauge("llm_queue_depth", "LLM calls waiting in the client-side limiter queue")
+INFLIGHT = gauge("llm_inflight_requests", "LLM calls currently holding a concurrency slot")
+WAIT_SECONDS = histogram("llm_limiter_wait_seconds", "Time spent queued before an LLM call")
+RETRIES = counter("llm_retries_total", "LLM calls retried after a retryable error", ["reason"])
+RATE_LIMITED = counter("llm_rate_limited_total", "429 / quota errors returned by the LLM provider")
+TOKENS = counter("llm_tokens_total", "Tokens billed by the LLM provider (prompt + output)")
+
+
+class LLMQueueTimeout(LLMError):
+    """Chờ trong hàng đợi limiter quá LLM_QUEUE_TIMEOUT giây."""
+
+
+def _env_float(name: str, default: float) -> float:
+    try:
+        return float(os.getenv(name, default))
+    except ValueError:
+        return float(default)
+
+
+def _per_process_quota(name: str, default: float) -> float:
+    """Quota toàn deployment chia đều cho WEB_CONCURRENCY worker (0 = không giới hạn giữ nguyên)."""
+    total = _env_float(name, default)
+    workers = max(1, int(_env_float("WEB_CONCURRENCY", 1)))
+    return total / workers if total > 0 else total
+
+
+def estimate_tokens(text: Optional[str]) -> int:
+    """Ước lượng thô ~4 ký tự / token (đủ để xin quota TPM trước lời gọi)."""
+    return len(text or "") // 4
+
+
+class TokenBucket:
+    """Bucket nạp đều `rate_per_minute` token/phút, dung lượng = 1 phút quota."""
+
+    def __init__(self, rate_per_minute: float, clock: Callable[[], float] = time.monotonic):
+        self.rate_per_minute = float(rate_per_minute)
+        self.capacity = self.rate_per_minute
+        self.clock = clock
+        self._tokens = self.capacity
+        self._updated = clock()
+
+    @property
+    def unlimited(self) -> bool:
+        return self.rate_per_minute <= 0
+
+    def _refill(self) -> None:
+        now = self.clock()
+        elapsed = max(0.0, now - self._updated)
+        self._updated = now
+        self._tokens = min(self.capacity, self._tokens + elapsed * self.rate_per_minute / 60.0)
+
+    def time_until(self, amount: float) -> float:
+        """Số giây tới khi lấy được `amount` token (0 = lấy được ngay)."""
+        if self.unlimited:
+            return 0.0
+        self._refill()
+        amount = min(amount, self.capacity)  # request lớn hơn cả quota/phút vẫn phải chạy được
+        missing = amount - self._tokens
+        return 0.0 if missing <= 0 else missing * 60.0 / self.rate_per_minute
+
+    def consume(self, amount: float) -> None:
+        if not self.unlimited:
+            self._refill()
+            self._tokens -= min(amount, self.capacity)
+
+    def adjust(self, delta: float) -> None:
+        """Điều chỉnh theo usage thực (delta > 0: dùng nhiều hơn ước lượng → nợ quota)."""
+        if not self.unlimited:
+            self._refill()
+            self._tokens = min(self.capacity, self._tokens - delta)
+
+
+class _Waiter:
+    __slots__ = ("user_key", "tokens")
+
+    def __init__(self, user_key: str, tokens: int):
+        self.user_key = user_key
+        self.tokens = tokens
+
+
+class Permit:
+    """Quyền gọi LLM đang giữ; record_usage() để bù trừ token ước lượng."""
+
+    def __init__(self, limiter: "LLMRateLimiter", estimated_tokens: int, waited: float):
+        self._limiter = limiter
+        self.estimated_tokens = estimated_tokens
+        self.waited = waited
+
+    def record_usage(self, actual_tokens: int) -> None:
+        TOKENS.inc(max(0, actual_tokens))
+        self._limiter._adjust_tokens(actual_tokens - self.estimated_tokens)
+        self.estimated_tokens = actual_tokens
+
+
+class LLMRateLimiter:
+    def __init__(
+        self,
+        rpm: float = DEFAULT_RPM,
+        tpm: float = DEFAULT_TPM,
+        max_concurrency: int = DEFAULT_MAX_CONCURRENCY,
+        queue_timeout: float = DEFAULT_QUEUE_TIMEOUT,
+        backoff_base: float = DEFAULT_BACKOFF_BASE,
+        backoff_cap: float = DEFAULT_BACKOFF_CAP,
+        clock: Callable[[], float] = time.monotonic,
+    ):
+        self.requests = TokenBucket(rpm, clock)
+        self.tokens = TokenBucket(tpm, clock)
+        self.max_concurrency = max(1, int(max_concurrency))
+        self.queue_timeout = queue_timeout
+        self.backoff_base = backoff_base
+        self.backoff_cap = backoff_cap
+        self.clock = clock
+        self._queues: "OrderedDict[str, Deque[_Waiter]]" = OrderedDict()
+        self._active = 0
+        self._waiting = 0
+        self._paused_until = 0.0
+        self._cond = threading.Condition()
+
+    # ---------- trạng thái ----------
+
+    @property
+    def queue_depth(self) -> int:
+        return self._waiting
+
+    @property
+    def active(self) -> int:
+        return self._active
+
+    def pause(self, seconds: float) -> None:
+        """Provider trả 429: tạm ngừng cấp quyền cho mọi caller trong `seconds` giây."""
+        if seconds <= 0:
+            return
+        with self._cond:
+            self._paused_until = max(self._paused_until, self.clock() + seconds)
+
+    # ---------- cấp quyền ----------
+
+    def _is_next(self, waiter: _Waiter) -> bool:
+        if not self._queues:
+            return False
+        user_key, queue = next(iter(self._queues.items()))
+        return user_key == waiter.user_key and queue[0] is waiter
+
+    def _dequeue(self, waiter: _Waiter, served: bool) -> None:
+        queue = self._queues.get(waiter.user_key)
+        if queue is None:
+            return
+        try:
+            queue.remove(waiter)
+        except ValueError:
+            return
+        if not queue:
+            del self._queues[waiter.user_key]
+        elif served:
+            self._queues.move_to_end(waiter.user_key)  # round-robin giữa các user
+        self._waiting -= 1
+        QUEUE_DEPTH.set(self._waiting)
+
+    def _wait_time(self, waiter: _Waiter) -> Optional[float]:
+        """None = chờ tới khi được notify (chưa tới lượt / hết slot), 0 = cấp ngay."""
+        if not self._is_next(waiter) or self._active >= self.max_concurrency:
+            return None
+        return max(
+            self._paused_until - self.clock(),
+            self.requests.time_until(1),
+            self.tokens.time_until(waiter.tokens),
+            0.0,
+        )
+
+    @contextmanager
+    def acquire(
+        self,
+        user_key: str = "anonymous",
+        estimated_tokens: int = 0,
+        timeout: Optional[float] = None,
+    ) -> Iterator[Permit]:
+        timeout = self.queue_timeout if timeout is None else timeout
+        waiter = _Waiter(user_key or "anonymous", max(0, int(estimated_tokens)))
+        started = time.monotonic()
+        deadline = started + timeout
+
+        with self._cond:
+            self._queues.setdefault(waiter.user_key, deque()).append(waiter)
+            self._waiting += 1
+            QUEUE_DEPTH.set(self._waiting)
+            while True:
+                wait = self._wait_time(waiter)
+                if wait == 0.0:
+                    break
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    self._dequeue(waiter, served=False)
+                    self._cond.notify_all()
+                    raise LLMQueueTimeout(
+                        f"LLM queue timeout after {timeout:.1f}s (user={waiter.user_key}, depth={self._waiting})"
+                    )
+                self._cond.wait(remaining if wait is None else min(wait, remaining))
+
+            self._dequeue(waiter, served=True)
+            self.requests.consume(1)
+            self.tokens.consume(waiter.tokens)
+            self._active += 1
+            INFLIGHT.set(self._active)
+            self._cond.notify_all()  # user kế tiếp trong vòng round-robin có thể tới lượt
+
+        waited = time.monotonic() - started
+        WAIT_SECONDS.observe(waited)
+        try:
+            yield Permit(self, waiter.tokens, waited)
+        finally:
+            with self._cond:
+                self._active -= 1
+                INFLIGHT.set(self._active)
+                self._cond.notify_all()
+
+    def _adjust_tokens(self, delta: int) -> None:
+        with self._cond:
+            self.tokens.adjust(delta)
+            self._cond.notify_all()
+
+
+# ====== RETRY / BACKOFF ======
+
+_RETRYABLE_GOOGLE_ERRORS = (
+    "ResourceExhausted",
+    "TooManyRequests",
+    "ServiceUnavailable",
+    "InternalServerError",
+    "DeadlineExceeded",
+)
+
+
+def is_retryable_error(exc: BaseException) -> bool:
+    """429 / 5xx / timeout phía provider; lỗi khác (schema, auth, JSON) không retry."""
+    if isinstance(exc, LLMError):
+        return exc.retryable
+    if type(exc).__name__ in _RETRYABLE_GOOGLE_ERRORS:
+        return True
+    code = getattr(exc, "code", None)
+    code = getattr(code, "value", code)  # grpc StatusCode / int HTTP
+    return isinstance(code, int) and (code == 429 or 500 <= code < 600)
+
+
+def _is_rate_limit(exc: BaseException) -> bool:
+    if isinstance(exc, LLMRateLimited):
+        return True
+    return type(exc).__name__ in ("ResourceExhausted", "TooManyRequests") or getattr(exc, "code", None) == 429
+
+
+def backoff_delay(
+    attempt: int,
+    base: float = DEFAULT_BACKOFF_BASE,
+    cap: float = DEFAULT_BACKOFF_CAP,
+    retry_after: Optional[float] = None,
+    rng: Callable[[], float] = random.random,
+) -> float:
+    """Exponential backoff với full jitter; không ngắn hơn retry_after của provider."""
+    delay = rng() * min(cap, base * (2 ** attempt))
+    if retry_after:
+        delay = max(delay, float(retry_after))
+    return delay
+
+
+def governed_call(
+    fn: Callable[[], T],
+    user_key: str = "anonymous",
+    estimated_tokens: int = 0,
+    usage: Optional[Callable[[T], int]] = None,
+    limiter: Optional[LLMRateLimiter] = None,
+    max_retries: Optional[int] = None,
+    sleep: Callable[[float], None] = time.sleep,
+) -> T:
+    """
+    Gọi fn() trong limiter, retry lỗi tạm thời. usage(result) → token thực tế để
+    bù trừ quota TPM. Backoff chờ ngoài slot (không giữ concurrency khi ngủ).
+    """
+    limiter = limiter or get_rate_limiter()
+    if max_retries is None:
+        max_retries = int(_env_float("LLM_MAX_RETRIES", DEFAULT_MAX_RETRIES))
+
+    attempt = 0
+    while True:
+        try:
+            with limiter.acquire(user_key, estimated_tokens) as permit:
+                result = fn()
+                if usage is not None:
+                    permit.record_usage(usage(result))
+                return result
+        except LLMQueueTimeout:
+            raise
+        except Exception as exc:  # noqa: BLE001 - lọc bằng is_retryable_error
+            if not is_retryable_error(exc) or attempt >= max_retries:
+                raise
+            retry_after = getattr(exc, "retry_after", None)
+            delay = backoff_delay(attempt, limiter.backoff_base, limiter.backoff_cap, retry_after)
+            if _is_rate_limit(exc):
+                RATE_LIMITED.inc()
+                limiter.pause(delay)
+                RETRIES.labels(reason="rate_limited").inc()
+            else:
+                RETRIES.labels(reason="unavailable").inc()
+            logger.info(
+                "%s (attempt %d/%d) → retry in %.2fs", type(exc).__name__, attempt + 1, max_retries, delay
+            )
+            attempt += 1
+            sleep(delay)
+
+
+# ====== SHARED LIMITER ======
+
+_limiter: Optional[LLMRateLimiter] = None
+_limiter_lock = threading.Lock()
+
+
+def get_rate_limiter() -> LLMRateLimiter:
+    """Limiter dùng chung cho mọi lời gọi Gemini trong process (cấu hình qua env)."""
+    global _limiter
+    if _limiter is None:
+        with _limiter_lock:
+            if _limiter is None:
+                _limiter = LLMRateLimiter(
+                    rpm=_per_process_quota("LLM_RPM", DEFAULT_RPM),
+                    tpm=_per_process_quota("LLM_TPM", DEFAULT_TPM),
+                    max_concurrency=int(_env_float("LLM_MAX_CONCURRENCY", DEFAULT_MAX_CONCURRENCY)),
+                    queue_timeout=_env_float("LLM_QUEUE_TIMEOUT", DEFAULT_QUEUE_TIMEOUT),
+                    backoff_base=_env_float("LLM_BACKOFF_BASE", DEFAULT_BACKOFF_BASE),
+                    backoff_cap=_env_float("LLM_BACKOFF_CAP", DEFAULT_BACKOFF_CAP),
+                )
+    return _limiter
+
+
+def set_rate_limiter(limiter: Optional[LLMRateLimiter]) -> Optional[LLMRateLimiter]:
+    """Thay limiter (test / load test); trả về limiter cũ. None → tạo lại theo env."""
+    global _limiter
+    with _limiter_lock:
+        previous, _limiter = _limiter, limiter
+    return previous
+
+
+def estimated_request_tokens(prompt: str, system_instruction: Optional[str] = None) -> int:
+    """Token xin trước cho 1 lời gọi: prompt (+ instruction inline) + output ước lượng."""
+    output = int(_env_float("LLM_ESTIMATED_OUTPUT_TOKENS", DEFAULT_ESTIMATED_OUTPUT_TOKENS))
+    return estimate_tokens(prompt) + estimate_tokens(system_instruction) + output
+
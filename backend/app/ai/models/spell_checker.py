@@ -0,0 +1,523 @@
+"""
+spell_checker.py
+
+Local Spelling Engine (EN + VI)
+-------------------------------
+Mục tiêu:
+- Phát hiện lỗi chính tả NGAY trên máy chủ (vài ms), không cần LLM.
+- Kết quả có start_pos / end_pos chính xác trên chuỗi gốc → đổ thẳng
+  vào block spelling_errors của analyze_document.
+
+Cách làm:
+- EN: SymSpell (symmetric delete) trên lexicon tần suất từ
+  (app/ai/data/lexicon/en*.tsv), khoảng cách Damerau-Levenshtein (OSA).
+  Chỉ gắn cờ từ thường (không viết hoa, không chứa số), dài >= 4,
+  không có trong lexicon và có gợi ý trong phạm vi max_edit_distance.
+- VI: lexicon cặp âm tiết (bigram, app/ai/data/lexicon/vi*.tsv).
+  Một âm tiết bị nghi sai khi cặp với âm tiết liền trước / liền sau
+  không có trong lexicon, nhưng đổi dấu thanh / dấu phụ / phụ âm dễ nhầm
+  (tr/ch, s/x, d/gi/r, c/t, n/ng...) thì thành 1 bigram đã biết,
+  vd. "sức khẻ" → "sức khỏe", "nghiên cú" → "nghiên cứu".
+"""
+
+from __future__ import annotations
+
+import logging
+import os
+import re
+import threading
+import unicodedata
+from dataclasses import dataclass
+from typing import Any, Dict, Iterable, List, Optional, Set, Tuple
+
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_LEXICON_DIR = os.path.join(
+    os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "data", "lexicon"
+)
+
+# Khoảng cách 2 tăng index ~2.5 lần (RAM + thời gian build), lợi ích nhỏ với văn bản học thuật
+DEFAULT_MAX_EDIT_DISTANCE = 1
+DEFAULT_PREFIX_LENGTH = 7
+
+# Từ EN ngắn hơn ngưỡng này rất dễ báo nhầm (viết tắt, ký hiệu) → bỏ qua
+MIN_EN_WORD_LENGTH = 4
+
+
+def local_spelling_enabled() -> bool:
+    """Bật / tắt spelling local (LOCAL_SPELLING_ENABLED, mặc định bật)."""
+    return os.getenv("LOCAL_SPELLING_ENABLED", "true").strip().lower() in ("1", "true", "yes", "on")
+
+
+# ====== EDIT DISTANCE ======
+
+def damerau_levenshtein(a: str, b: str, max_distance: int) -> int:
+    """
+    Optimal String Alignment distance (thêm / xoá / thay / đổi chỗ 2 ký tự kề nhau).
+    Trả về max_distance + 1 nếu vượt ngưỡng (dừng sớm theo hàng).
+    """
+    if a == b:
+        return 0
+    len_a, len_b = len(a), len(b)
+    if abs(len_a - len_b) > max_distance:
+        return max_distance + 1
+    if not len_a or not len_b:
+        return max(len_a, len_b)
+
+    previous2: List[int] = []
+    previous = list(range(len_b + 1))
+    for i in range(1, len_a + 1):
+        current = [i] + [0] * len_b
+        row_min = i
+        ca = a[i - 1]
+        for j in range(1, len_b + 1):
+            cb = b[j - 1]
+            cost = 0 if ca == cb else 1
+            value = min(previous[j] + 1, current[j - 1] + 1, previous[j - 1] + cost)
+            if i > 1 and j > 1 and ca == b[j - 2] and a[i - 2] == cb:
+                value = min(value, previous2[j - 2] + 1)
+            current[j] = value
+            if value < row_min:
+                row_min = value
+        if row_min > max_distance:
+            return max_distance + 1
+        previous2, previous = previous, current
+    distance = previous[len_b]
+    return distance if distance <= max_distance else max_distance + 1
+
+
+# ====== LEXICON ======
+
+def load_lexicon_file(path: str) -> Dict[str, int]:
+    """Đọc 1 file TSV "<term>\\t<count>" (dòng "#" là comment)."""
+    entries: Dict[str, int] = {}
+    with open(path, "r", encoding="utf-8-sig") as fh:
+        for raw_line in fh:
+            line = raw_line.rstrip("\r\n")
+            if not line or line.startswith("#"):
+                continue
+            term, sep, count = line.partition("\t")
+            if not sep or not term:
+                continue
+            try:
+                entries[term] = entries.get(term, 0) + int(count)
+            except ValueError:
+                continue
+    return entries
+
+
+def lexicon_paths(language: str, directory: Optional[str] = None) -> List[str]:
+    """<language>.tsv + mọi <language>.<tên>.tsv (bổ sung theo domain)."""
+    directory = directory or os.getenv("SPELLING_LEXICON_DIR") or DEFAULT_LEXICON_DIR
+    try:
+        names = sorted(os.listdir(directory))
+    except OSError:
+        return []
+    return [
+        os.path.join(directory, name)
+        for name in names
+        if name == f"{language}.tsv" or (name.startswith(f"{language}.") and name.endswith(".tsv"))
+    ]
+
+
+@dataclass
+class Suggestion:
+    term: str
+    distance: int
+    count: int
+
+
+class SymSpellIndex:
+    """
+    Index symmetric-delete: mỗi từ trong lexicon sinh các biến thể xoá
+    (tối đa max_edit_distance ký tự, trên prefix_length ký tự đầu).
+    Lookup chỉ cần sinh biến thể xoá của từ cần tra rồi tra dict →
+    không phải duyệt toàn bộ lexicon.
+    """
+
+    def __init__(
+        self,
+        max_edit_distance: int = DEFAULT_MAX_EDIT_DISTANCE,
+        prefix_length: int = DEFAULT_PREFIX_LENGTH,
+    ) -> None:
+        if prefix_length <= max_edit_distance:
+            raise ValueError("prefix_length must be greater than max_edit_distance")
+        self.max_edit_distance = max_edit_distance
+        self.prefix_length = prefix_length
+        self.words: Dict[str, int] = {}
+        self._deletes: Dict[str, List[str]] = {}
+
+    def __len__(self) -> int:
+        return len(self.words)
+
+    def __contains__(self, word: str) -> bool:
+        return word in self.words
+
+    def _edits(self, word: str, distance: int, out: Set[str]) -> None:
+        distance += 1
+        if len(word) <= 1:
+            return
+        for i in range(len(word)):
+            candidate = word[:i] + word[i + 1:]
+            if candidate not in out:
+                out.add(candidate)
+                if distance < self.max_edit_distance:
+                    self._edits(candidate, distance, out)
+
+    def _delete_variants(self, word: str) -> Set[str]:
+        prefix = word[: self.prefix_length]
+        variants = {prefix}
+        self._edits(prefix, 0, variants)
+        return variants
+
+    def add(self, word: str, count: int = 1) -> None:
+        if word in self.words:
+            self.words[word] += count
+            return
+        self.words[word] = count
+        for variant in self._delete_variants(word):
+            self._deletes.setdefault(variant, []).append(word)
+
+    def update(self, entries: Dict[str, int]) -> None:
+        for word, count in entries.items():
+            self.add(word, count)
+
+    def lookup(self, word: str, max_distance: Optional[int] = None) -> List[Suggestion]:
+        """Các từ trong lexicon cách `word` <= max_distance, sắp theo (distance, -count)."""
+        if max_distance is None or max_distance > self.max_edit_distance:
+            max_distance = self.max_edit_distance
+
+        if word in self.words:
+            return [Suggestion(word, 0, self.words[word])]
+
+        seen: Set[str] = set()
+        suggestions: List[Suggestion] = []
+        for variant in self._delete_variants(word):
+            for candidate in self._deletes.get(variant, ()):
+                if candidate in seen:
+                    continue
+                seen.add(candidate)
+                distance = damerau_levenshtein(word, candidate, max_distance)
+                if distance <= max_distance:
+                    suggestions.append(Suggestion(candidate, distance, self.words[candidate]))
+
+        suggestions.sort(key=lambda s: (s.distance, -s.count))
+        return suggestions
+
+
+# ====== VIETNAMESE SYLLABLES ======
+
+# Dấu thanh (tách khỏi dấu phụ mũ / móc / trăng khi so sánh)
+_TONE_MARKS = {"\u0300", "\u0301", "\u0303", "\u0309", "\u0323"}
+
+# Âm tiết tiếng Việt không dấu (dùng để không coi "cong nghe" là lỗi tiếng Anh)
+_VI_SYLLABLE_RE = re.compile(
+    r"^(ngh|ng|nh|ch|gh|gi|kh|ph|qu|th|tr|[bcdghklmnpqrstvx])?"
+    r"(uye|uya|ieu|yeu|uoi|uou|oai|oay|oeo|uay|uya|[aeiouy]{1,2})"
+    r"(ch|ng|nh|[cmnpt])?$"
+)
+
+_WORD_RE = re.compile(r"[^\W\d_]+")
+
+
+def _canonical_syllable(syllable: str) -> str:
+    """
+    Dạng chuẩn để so khớp lexicon: lowercase + NFC, dấu thanh tách ra cuối
+    → "khoẻ" (kiểu cũ) và "khỏe" (kiểu mới) cho cùng 1 khoá.
+    """
+    decomposed = unicodedata.normalize("NFD", syllable.lower())
+    tones = "".join(ch for ch in decomposed if ch in _TONE_MARKS)
+    base = "".join(ch for ch in decomposed if ch not in _TONE_MARKS)
+    return unicodedata.normalize("NFC", base) + tones
+
+
+def strip_diacritics(text: str) -> str:
+    decomposed = unicodedata.normalize("NFD", text.lower().replace("đ", "d"))
+    return "".join(ch for ch in decomposed if not unicodedata.combining(ch))
+
+
+def phonetic_key(syllable: str) -> str:
+    """
+    Khoá "nghe giống nhau": bỏ dấu, gộp các phụ âm đầu / cuối hay nhầm
+    (tr/ch, x/s, gi/d/r, c/t, ng/n, nh/n, ch/t cuối, k/c, gh/g, ngh/ng).
+    """
+    key = strip_diacritics(syllable)
+    for old, new in (("ngh", "ng"), ("gh", "g"), ("tr", "ch"), ("gi", "d")):
+        if key.startswith(old):
+            key = new + key[len(old):]
+            break
+    else:
+        if key[:1] in ("x", "r") or (key[:1] == "k" and key[1:2] != "h"):
+            key = {"x": "s", "r": "d", "k": "c"}[key[0]] + key[1:]
+    for old, new in (("ng", "n"), ("nh", "n"), ("ch", "t"), ("c", "t")):
+        if key.endswith(old) and len(key) > len(old):
+            key = key[: -len(old)] + new
+            break
+    return key
+
+
+def looks_like_vietnamese(token: str) -> bool:
+    return bool(_VI_SYLLABLE_RE.match(strip_diacritics(token)))
+
+
+def _match_case(source: str, target: str) -> str:
+    if source.isupper() and len(source) > 1:
+        return target.upper()
+    if source[:1].isupper():
+        return target[:1].upper() + target[1:]
+    return target
+
+
+class VietnameseBigramModel:
+    """
+    Lexicon bigram âm tiết + index theo âm tiết đầu / âm tiết sau.
+
+    Entry 1 âm tiết trong lexicon là từ đơn thông dụng ("có", "cho", "quá"...):
+    không bao giờ bị sửa, vì đứng cạnh từ bất kỳ vẫn có thể đúng.
+    """
+
+    def __init__(self, entries: Optional[Dict[str, int]] = None) -> None:
+        self.bigrams: Dict[Tuple[str, str], int] = {}
+        self.syllables: Set[str] = set()
+        self.standalone: Set[str] = set()
+        # âm tiết đầu → [(âm tiết sau, dạng hiển thị, count)]
+        self._by_head: Dict[str, List[Tuple[str, str, int]]] = {}
+        # âm tiết sau → [(âm tiết đầu, dạng hiển thị, count)]
+        self._by_tail: Dict[str, List[Tuple[str, str, int]]] = {}
+        if entries:
+            self.update(entries)
+
+    def update(self, entries: Dict[str, int]) -> None:
+        for phrase, count in entries.items():
+            parts = phrase.split()
+            if len(parts) == 1:
+                self.standalone.add(_canonical_syllable(parts[0]))
+                continue
+            if len(parts) != 2:
+                continue
+            head, tail = (_canonical_syllable(p) for p in parts)
+            key = (head, tail)
+            if key in self.bigrams:
+                self.bigrams[key] += count
+                continue
+            self.bigrams[key] = count
+            self.syllables.update(key)
+            self._by_head.setdefault(head, []).append((tail, parts[1].lower(), count))
+            self._by_tail.setdefault(tail, []).append((head, parts[0].lower(), count))
+
+    def known(self, first: str, second: str) -> bool:
+        return (_canonical_syllable(first), _canonical_syllable(second)) in self.bigrams
+
+    def _close(self, observed: str, canonical: str, display: str) -> Optional[int]:
+        observed_canonical = _canonical_syllable(observed)
+        if observed_canonical == canonical or observed_canonical in self.standalone:
+            return None
+        if observed_canonical in self.syllables:
+            # Âm tiết có thật → chỉ chấp nhận nhầm dấu thanh / dấu phụ
+            return 0 if strip_diacritics(observed) == strip_diacritics(display) else None
+        # Âm tiết lạ → khoá phát âm trùng, hoặc chỉ thừa / thiếu 1 ký tự ("khẻ" / "khỏe", "cú" / "cứu")
+        observed_key, expected_key = phonetic_key(observed), phonetic_key(display)
+        if observed_key == expected_key:
+            return 0
+        if abs(len(observed_key) - len(expected_key)) == 1 and damerau_levenshtein(observed_key, expected_key, 1) == 1:
+            return 1
+        return None
+
+    def suggest_tail(self, head: str, observed: str) -> Optional[Tuple[str, int, int]]:
+        """Sửa âm tiết sau của cặp (head, observed) → (âm tiết đúng, distance, count)."""
+        return self._best(self._by_head.get(_canonical_syllable(head), ()), observed)
+
+    def suggest_head(self, observed: str, tail: str) -> Optional[Tuple[str, int, int]]:
+        """Sửa âm tiết đầu của cặp (observed, tail)."""
+        return self._best(self._by_tail.get(_canonical_syllable(tail), ()), observed)
+
+    def _best(self, partners: Iterable[Tuple[str, str, int]], observed: str) -> Optional[Tuple[str, int, int]]:
+        best: Optional[Tuple[str, int, int]] = None
+        for canonical, display, count in partners:
+            distance = self._close(observed, canonical, display)
+            if distance is None:
+                continue
+            if best is None or (distance, -count) < (best[1], -best[2]):
+                best = (display, distance, count)
+        return best
+
+
+# ====== CHECKER ======
+
+class SpellChecker:
+    """
+    Engine spelling local, build lexicon lazy (lần check đầu tiên) và
+    dùng chung giữa các request (thread-safe khi build).
+    """
+
+    def __init__(
+        self,
+        lexicon_dir: Optional[str] = None,
+        max_edit_distance: Optional[int] = None,
+    ) -> None:
+        self.lexicon_dir = lexicon_dir
+        if max_edit_distance is None:
+            max_edit_distance = int(os.getenv("SPELLING_MAX_EDIT_DISTANCE", DEFAULT_MAX_EDIT_DISTANCE))
+        self.max_edit_distance = max_edit_distance
+
+        self._lock = threading.Lock()
+        self._en: Optional[SymSpellIndex] = None
+        self._vi: Optional[VietnameseBigramModel] = None
+
+    def _load(self, language: str) -> Dict[str, int]:
+        entries: Dict[str, int] = {}
+        for path in lexicon_paths(language, self.lexicon_dir):
+            try:
+                for term, count in load_lexicon_file(path).items():
+                    entries[term] = entries.get(term, 0) + count
+            except (OSError, UnicodeDecodeError) as exc:
+                logger.warning("Skip lexicon %s: %s", path, exc)
+        return entries
+
+    def _ensure_loaded(self) -> Tuple[SymSpellIndex, VietnameseBigramModel]:
+        if self._en is None or self._vi is None:
+            with self._lock:
+                if self._en is None:
+                    index = SymSpellIndex(max_edit_distance=self.max_edit_distance)
+                    index.update(self._load("en"))
+                    self._en = index
+                if self._vi is None:
+                    self._vi = VietnameseBigramModel(self._load("vi"))
+        return self._en, self._vi
+
+    def check(self, text: str, language: str = "vi") -> List[Dict[str, Any]]:
+        """
+        Trả về list item đúng format spelling_errors:
+        original / suggested / start_pos / end_pos (exclusive) / language / reason.
+        """
+        if not text:
+            return []
+
+        en_index, vi_model = self._ensure_loaded()
+        tokens = [(m.start(), m.end(), m.group()) for m in _WORD_RE.finditer(text)]
+        # Văn bản có chữ tiếng Việt → token ASCII dạng âm tiết ("cong nghe") không phải lỗi EN
+        mixed = language == "vi" or any(not word.isascii() for _, _, word in tokens)
+
+        items = self._check_vietnamese(text, tokens, vi_model)
+        flagged = [(it["start_pos"], it["end_pos"]) for it in items]
+        items.extend(self._check_english(text, tokens, en_index, mixed, flagged))
+        items.sort(key=lambda it: it["start_pos"])
+        return items
+
+    # ---------- VI ----------
+
+    @staticmethod
+    def _adjacent(text: str, left: Tuple[int, int, str], right: Tuple[int, int, str]) -> bool:
+        gap = text[left[1]:right[0]]
+        return bool(gap) and gap.isspace() and "\n" not in gap
+
+    def _check_vietnamese(
+        self,
+        text: str,
+        tokens: List[Tuple[int, int, str]],
+        model: VietnameseBigramModel,
+    ) -> List[Dict[str, Any]]:
+        items: List[Dict[str, Any]] = []
+        covered_until = -1
+
+        for i, token in enumerate(tokens):
+            start, end, word = token
+            if start < covered_until:
+                continue
+            prev = tokens[i - 1] if i > 0 and self._adjacent(text, tokens[i - 1], token) else None
+            nxt = tokens[i + 1] if i + 1 < len(tokens) and self._adjacent(text, token, tokens[i + 1]) else None
+
+            # Âm tiết ghép hợp lệ với 1 trong 2 bên → coi là đúng
+            if (prev and model.known(prev[2], word)) or (nxt and model.known(word, nxt[2])):
+                continue
+
+            candidates = []
+            if prev and prev[0] >= covered_until:
+                found = model.suggest_tail(prev[2], word)
+                if found:
+                    fixed = _match_case(word, found[0])
+                    candidates.append((found[1], -found[2], prev[0], end,
+                                       text[prev[0]:start] + fixed))
+            if nxt:
+                found = model.suggest_head(word, nxt[2])
+                if found:
+                    fixed = _match_case(word, found[0])
+                    candidates.append((found[1], -found[2], start, nxt[1],
+                                       fixed + text[end:nxt[1]]))
+            if not candidates:
+                continue
+
+            _, _, span_start, span_end, suggested = min(candidates)
+            items.append(
+                {
+                    "original": text[span_start:span_end],
+                    "suggested": suggested,
+                    "start_pos": span_start,
+                    "end_pos": span_end,
+                    "language": "vi",
+                    "reason": "local_spellcheck: dấu / âm tiết không khớp cụm từ thông dụng",
+                }
+            )
+            covered_until = span_end
+
+        return items
+
+    # ---------- EN ----------
+
+    def _check_english(
+        self,
+        text: str,
+        tokens: List[Tuple[int, int, str]],
+        index: SymSpellIndex,
+        mixed: bool,
+        flagged: List[Tuple[int, int]],
+    ) -> List[Dict[str, Any]]:
+        candidates = []
+        frequency: Dict[str, int] = {}
+        for start, end, word in tokens:
+            if not word.isascii() or not word.islower() or len(word) < MIN_EN_WORD_LENGTH:
+                continue
+            if word in index:
+                continue
+            # Sát "/", "@", "_", "." ... → URL, email, tên file, code
+            before = text[start - 1] if start else " "
+            after = text[end] if end < len(text) else " "
+            if before in "/@_.\\-#" or after in "/@_\\-" or (after == "." and end + 1 < len(text) and text[end + 1].isalnum()):
+                continue
+            if mixed and looks_like_vietnamese(word):
+                continue
+            frequency[word] = frequency.get(word, 0) + 1
+            candidates.append((start, end, word))
+
+        items: List[Dict[str, Any]] = []
+        for start, end, word in candidates:
+            # Từ lạ lặp lại nhiều lần thường là thuật ngữ / tên riêng cố ý
+            if frequency[word] > 1:
+                continue
+            if any(s < end and start < e for s, e in flagged):
+                continue
+            # Gõ sai hiếm khi rơi vào chữ cái đầu → bỏ gợi ý đổi chữ đầu ("rigor" → "igor")
+            suggestions = [s for s in index.lookup(word) if s.term[:1] == word[:1]]
+            if not suggestions:
+                continue
+            best = suggestions[0]
+            items.append(
+                {
+                    "original": word,
+                    "suggested": best.term,
+                    "start_pos": start,
+                    "end_pos": end,
+                    "language": "en",
+                    "reason": f"local_spellcheck: not in lexicon, edit distance {best.distance}",
+                }
+            )
+        return items
+
+
+spell_checker = SpellChecker()
+
+
+def check_spelling(text: str, language: str = "vi") -> List[Dict[str, Any]]:
+    """Hàm gọi chính — dùng trong Analysis.py."""
+    return spell_checker.check(text, language=language)
@@ -11,13 +11,25 @@ Mục tiêu:
     * term_mappings
     * normalized_text
     * original_text
+- Tất cả entry của từ điển được compile thành 1 Aho-Corasick automaton
+  (ReplacementMatcher), quét văn bản 1 lượt, leftmost-longest.
+- Từ điển lớn nằm trong file TSV theo ngôn ngữ / domain, tự reload khi file đổi.
 """
 
 from __future__ import annotations
 
+from collections import OrderedDict, deque
 from dataclasses import dataclass
-from typing import List, Dict, Any
+from typing import List, Dict, Any, Optional, Tuple, Union
+import hashlib
+import logging
+import mmap
+import os
 import re
+import threading
+import time
+
+logger = logging.getLogger(__name__)
 
 
 @dataclass
@@ -35,6 +47,9 @@ class NormalizationResult:
     # field dùng để debug / hiển thị lịch sử thay thế
     mappings: List[Dict[str, Any]]
 
+    # version của bộ từ điển / matcher đã dùng (đưa vào cache key của analysis)
+    dictionary_version: str = ""
+
 
 # ====== BASIC REPLACEMENTS ======
 # Có thể mở rộng dần theo nhu cầu thực tế.
@@ -83,61 +98,347 @@ BASIC_REPLACEMENTS_VI: Dict[str, str] = {
 }
 
 
-def _apply_basic_replacements(text: str, replacements: Dict[str, str]) -> NormalizationResult:
+# ====== MULTI-PATTERN MATCHER ======
+
+def _fold(text: str) -> str:
+    """
+    Case-fold mà GIỮ NGUYÊN độ dài chuỗi, để offset trên chuỗi fold
+    trùng với offset trên chuỗi gốc (start_pos / end_pos cho FE).
+    Ký tự nào lower() ra nhiều hơn 1 ký tự (vd: "İ") thì giữ nguyên.
+    """
+    folded = text.lower()
+    if len(folded) == len(text):
+        return folded
+    return "".join(ch.lower() if len(ch.lower()) == 1 else ch for ch in text)
+
+
+def dictionary_version(replacements: Dict[str, str]) -> str:
+    """Hash ổn định của một bộ từ điển, dùng làm version cho matcher đã compile."""
+    digest = hashlib.sha1()
+    for wrong, correct in sorted(replacements.items()):
+        digest.update(wrong.encode("utf-8"))
+        digest.update(b"\x00")
+        digest.update(correct.encode("utf-8"))
+        digest.update(b"\x01")
+    return digest.hexdigest()[:16]
+
+
+class ReplacementMatcher:
+    """
+    Aho-Corasick automaton trên các key đã case-fold.
+
+    - Build 1 lần cho mỗi version từ điển.
+    - find() quét văn bản 1 lượt, trả về các match không chồng lấn
+      theo ngữ nghĩa leftmost-longest.
+    """
+
+    def __init__(self, replacements: Dict[str, str], version: Optional[str] = None) -> None:
+        self.version = version or dictionary_version(replacements)
+        self.size = len(replacements)
+
+        # Trie: _goto[node][char] -> node, _depth[node] = độ dài key nếu node là terminal
+        self._goto: List[Dict[str, int]] = [{}]
+        self._depth: List[int] = [0]
+        self._fail: List[int] = [0]
+        self._dict_link: List[int] = [0]  # terminal gần nhất theo chuỗi fail (0 = không có)
+        # node terminal -> {key gốc: correct}, để ưu tiên biến thể khớp đúng chữ hoa/thường
+        self._variants: Dict[int, Dict[str, str]] = {}
+
+        for wrong, correct in replacements.items():
+            if not wrong:
+                continue
+            node = 0
+            for ch in _fold(wrong):
+                nxt = self._goto[node].get(ch)
+                if nxt is None:
+                    nxt = len(self._goto)
+                    self._goto[node][ch] = nxt
+                    self._goto.append({})
+                    self._depth.append(0)
+                    self._fail.append(0)
+                    self._dict_link.append(0)
+                node = nxt
+            self._depth[node] = len(wrong)
+            self._variants.setdefault(node, {})[wrong] = correct
+
+        self._build_links()
+
+    def _build_links(self) -> None:
+        queue = deque(self._goto[0].values())
+        while queue:
+            node = queue.popleft()
+            for ch, child in self._goto[node].items():
+                queue.append(child)
+                fallback = self._fail[node]
+                while fallback and ch not in self._goto[fallback]:
+                    fallback = self._fail[fallback]
+                target = self._goto[fallback].get(ch, 0)
+                self._fail[child] = target if target != child else 0
+                self._dict_link[child] = target if self._depth[target] else self._dict_link[target]
+
+    def find(self, text: str) -> List[Tuple[int, int, str]]:
+        """Trả về list (start, end, correct) đã sắp theo vị trí, không chồng lấn."""
+        if not text or self.size == 0:
+            return []
+
+        goto, fail, depth, dict_link = self._goto, self._fail, self._depth, self._dict_link
+
+        # start -> (end, node) dài nhất bắt đầu tại start
+        longest: Dict[int, Tuple[int, int]] = {}
+        node = 0
+        for i, ch in enumerate(_fold(text)):
+            while node and ch not in goto[node]:
+                node = fail[node]
+            node = goto[node].get(ch, 0)
+
+            hit = node if depth[node] else dict_link[node]
+            while hit:
+                end = i + 1
+                start = end - depth[hit]
+                best = longest.get(start)
+                if best is None or end > best[0]:
+                    longest[start] = (end, hit)
+                hit = dict_link[hit]
+
+        matches: List[Tuple[int, int, str]] = []
+        cursor = 0
+        for start in sorted(longest):
+            if start < cursor:
+                continue
+            end, hit = longest[start]
+            variants = self._variants[hit]
+            correct = variants.get(text[start:end])
+            if correct is None:
+                correct = next(iter(variants.values()))
+            matches.append((start, end, correct))
+            cursor = end
+        return matches
+
+
+_MATCHER_CACHE: Dict[str, ReplacementMatcher] = {}
+_MATCHER_CACHE_MAX = 8
+
+
+def get_matcher(replacements: Dict[str, str]) -> ReplacementMatcher:
+    """Lấy matcher đã compile cho bộ từ điển (cache theo version)."""
+    version = dictionary_version(replacements)
+    matcher = _MATCHER_CACHE.get(version)
+    if matcher is None:
+        if len(_MATCHER_CACHE) >= _MATCHER_CACHE_MAX:
+            _MATCHER_CACHE.pop(next(iter(_MATCHER_CACHE)))
+        matcher = ReplacementMatcher(replacements, version=version)
+        _MATCHER_CACHE[version] = matcher
+    return matcher
+
+
+# ====== FILE-BACKED DICTIONARIES (hot reload) ======
+#
+# Ngoài BASIC_REPLACEMENTS_* (seed trong code), normalizer đọc thêm từ điển
+# từ thư mục NORMALIZER_DICT_DIR (mặc định: app/ai/data/dictionaries):
+#   - <language>.tsv           vd: en.tsv, vi.tsv
+#   - <language>.<domain>.tsv  vd: vi.medical.tsv
+# Mỗi dòng: "<sai>\t<đúng>", dòng bắt đầu bằng "#" là comment.
+# Entry trong file ghi đè seed trong code khi trùng key.
+
+DEFAULT_DICTIONARY_DIR = os.path.join(
+    os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "data", "dictionaries"
+)
+DICTIONARY_LANGUAGES = ("en", "vi")
+# domain lấy từ request của client → chỉ nhận slug có file <language>.<domain>.tsv thật
+_DOMAIN_RE = re.compile(r"^[a-z0-9][a-z0-9_-]{0,63}$")
+
+
+def load_dictionary_file(path: str) -> Dict[str, str]:
+    """Đọc 1 file TSV qua mmap (page cache được chia sẻ giữa các worker)."""
+    entries: Dict[str, str] = {}
+    with open(path, "rb") as fh:
+        if os.fstat(fh.fileno()).st_size == 0:
+            return entries
+        with mmap.mmap(fh.fileno(), 0, access=mmap.ACCESS_READ) as mm:
+            for raw_line in iter(mm.readline, b""):
+                line = raw_line.decode("utf-8-sig").rstrip("\r\n")
+                if not line or line.startswith("#"):
+                    continue
+                wrong, sep, correct = line.partition("\t")
+                if sep and wrong and correct:
+                    entries[wrong] = correct
+    return entries
+
+
+class DictionaryStore:
+    """
+    Quản lý từ điển theo (domain) + matcher đã compile.
+
+    - Lazy: chỉ đọc file ở lần normalize đầu tiên.
+    - Hot reload: tối đa mỗi `reload_interval` giây stat() lại các file,
+      nếu mtime/size đổi (hoặc có file mới) thì build lại matcher.
+    - matcher.version là hash nội dung từ điển → giống nhau giữa các worker,
+      dùng được làm 1 phần của cache key cho analysis.
+    """
+
+    def __init__(self, directory: Optional[str] = None, reload_interval: Optional[float] = None) -> None:
+        self.directory = directory or os.getenv("NORMALIZER_DICT_DIR") or DEFAULT_DICTIONARY_DIR
+        if reload_interval is None:
+            reload_interval = float(os.getenv("NORMALIZER_RELOAD_INTERVAL", "2.0"))
+        self.reload_interval = reload_interval
+
+        self._lock = threading.Lock()
+        # domain -> (fingerprint, matcher, checked_at); LRU, tối đa _MATCHER_CACHE_MAX domain
+        self._entries: "OrderedDict[Optional[str], Tuple[Tuple, ReplacementMatcher, float]]" = OrderedDict()
+        self._domains: frozenset = frozenset()
+        self._domains_checked_at: Optional[float] = None
+
+    def _available_domains(self, now: float) -> frozenset:
+        """Tên domain có file trong thư mục (liệt kê lại tối đa mỗi reload_interval giây)."""
+        if self._domains_checked_at is None or now - self._domains_checked_at >= self.reload_interval:
+            try:
+                names = os.listdir(self.directory)
+            except OSError:
+                names = []
+            domains = set()
+            for name in names:
+                parts = name.split(".")
+                if len(parts) == 3 and parts[0] in DICTIONARY_LANGUAGES and parts[2] == "tsv":
+                    domains.add(parts[1])
+            self._domains = frozenset(domains)
+            self._domains_checked_at = now
+        return self._domains
+
+    def resolve_domain(self, domain: Any, now: Optional[float] = None) -> Optional[str]:
+        """Domain hợp lệ (slug + có file từ điển) hoặc None; giá trị lạ / không hash được → None."""
+        if not isinstance(domain, str):
+            return None
+        domain = domain.strip().lower()
+        if not _DOMAIN_RE.match(domain):
+            return None
+        if domain not in self._available_domains(time.monotonic() if now is None else now):
+            return None
+        return domain
+
+    def _candidate_paths(self, domain: Optional[str]) -> List[str]:
+        names = [f"{lang}.tsv" for lang in DICTIONARY_LANGUAGES]
+        if domain:
+            names += [f"{lang}.{domain}.tsv" for lang in DICTIONARY_LANGUAGES]
+        return [os.path.join(self.directory, name) for name in names]
+
+    def _fingerprint(self, domain: Optional[str]) -> Tuple:
+        stamp = []
+        for path in self._candidate_paths(domain):
+            try:
+                st = os.stat(path)
+            except OSError:
+                continue
+            stamp.append((path, st.st_mtime_ns, st.st_size))
+        return tuple(stamp)
+
+    def _build(self, fingerprint: Tuple) -> ReplacementMatcher:
+        replacements: Dict[str, str] = {}
+        replacements.update(BASIC_REPLACEMENTS_EN)
+        replacements.update(BASIC_REPLACEMENTS_VI)
+        for path, _, _ in fingerprint:
+            try:
+                replacements.update(load_dictionary_file(path))
+            except (OSError, UnicodeDecodeError, ValueError) as exc:
+                logger.warning("Skip dictionary %s: %s", path, exc)
+        return get_matcher(replacements)
+
+    def matcher(self, domain: Optional[str] = None) -> ReplacementMatcher:
+        now = time.monotonic()
+        domain = self.resolve_domain(domain, now)
+        cached = self._entries.get(domain)
+        if cached is not None and now - cached[2] < self.reload_interval:
+            return cached[1]
+
+        with self._lock:
+            cached = self._entries.get(domain)
+            if cached is not None and now - cached[2] < self.reload_interval:
+                return cached[1]
+
+            fingerprint = self._fingerprint(domain)
+            if cached is not None and cached[0] == fingerprint:
+                matcher = cached[1]
+            else:
+                matcher = self._build(fingerprint)
+            self._entries[domain] = (fingerprint, matcher, now)
+            self._entries.move_to_end(domain)
+            while len(self._entries) > _MATCHER_CACHE_MAX:
+                self._entries.popitem(last=False)
+            return matcher
+
+    def version(self, domain: Optional[str] = None) -> str:
+        return self.matcher(domain).version
+
+
+dictionary_store = DictionaryStore()
+
+
+def get_normalizer_version(domain: Optional[str] = None) -> str:
+    """Version của matcher hiện hành (đổi khi file từ điển thay đổi)."""
+    return dictionary_store.version(domain)
+
+
+def _apply_basic_replacements(
+    text: str,
+    replacements: Union[Dict[str, str], ReplacementMatcher],
+) -> NormalizationResult:
     """
     Áp dụng rule thay thế cơ bản trên chuỗi `text`.
     Trả về NormalizationResult với:
-      - normalized_text: text sau khi thay
+      - normalized_text: text sau khi thay (dựng lại từ các span trong 1 lần join)
       - spelling_corrections / term_mappings / mappings: log các thay thế.
     """
-    original_text = text
-    normalized_text = text
+    matcher = replacements if isinstance(replacements, ReplacementMatcher) else get_matcher(replacements)
 
     spelling_corrections: List[Dict[str, Any]] = []
     term_mappings: List[Dict[str, Any]] = []
     mappings: List[Dict[str, Any]] = []
+    pieces: List[str] = []
+    cursor = 0
 
-    for wrong, correct in replacements.items():
-        # regex ignore-case, tìm vị trí để báo về FE
-        for m in re.finditer(re.escape(wrong), original_text, flags=re.IGNORECASE):
-            start = m.start()
-            end = m.end()
+    for start, end, correct in matcher.find(text):
+        record = {
+            "original": text[start:end],
+            "normalized": correct,
+            "start_pos": start,
+            "end_pos": end,
+            "reason": "basic_replacement",
+        }
 
-            record = {
-                "original": original_text[start:end],
-                "normalized": correct,
-                "start_pos": start,
-                "end_pos": end,
-                "reason": "basic_replacement",
-            }
+        # MVP: coi tất cả là spelling correction + term mapping
+        spelling_corrections.append(record)
+        term_mappings.append(record)
+        mappings.append(record)
 
-            # MVP: coi tất cả là spelling correction + term mapping
-            spelling_corrections.append(record)
-            term_mappings.append(record)
-            mappings.append(record)
+        pieces.append(text[cursor:start])
+        pieces.append(correct)
+        cursor = end
 
-        # Thực hiện thay trong normalized_text (case-sensitive để đơn giản)
-        normalized_text = normalized_text.replace(wrong, correct)
+    pieces.append(text[cursor:])
 
     return NormalizationResult(
-        original_text=original_text,
-        normalized_text=normalized_text,
+        original_text=text,
+        normalized_text="".join(pieces),
         spelling_corrections=spelling_corrections,
         term_mappings=term_mappings,
         mappings=mappings,
+        dictionary_version=matcher.version,
     )
 
 
-def normalize_text(text: str, language: str = "vi") -> NormalizationResult:
+def normalize_text(text: str, language: str = "vi", domain: Optional[str] = None) -> NormalizationResult:
     """
     Hàm gọi chính — dùng trong Analysis.py
 
+    - domain: nạp thêm từ điển chuyên ngành <language>.<domain>.tsv (nếu có).
+
     - KHÔNG còn bóp méo whitespace để giữ vị trí (start_pos / end_pos)
       khớp với CHUỖI GỐC mà user gửi.
     - Chủ yếu dùng để:
         + Gợi ý các lỗi chính tả / cụm sai phổ biến (EN + VI)
         + Log lại vị trí để FE có thể highlight nếu muốn.
     """
+    matcher = dictionary_store.matcher(domain)
+
     if not text:
         return NormalizationResult(
             original_text="",
@@ -145,6 +446,7 @@ def normalize_text(text: str, language: str = "vi") -> NormalizationResult:
             spelling_corrections=[],
             term_mappings=[],
             mappings=[],
+            dictionary_version=matcher.version,
         )
 
     original_text = text
@@ -153,11 +455,7 @@ def normalize_text(text: str, language: str = "vi") -> NormalizationResult:
     working = text
 
     # Dùng chung cả EN + VI, vì văn bản thường trộn 2 thứ tiếng
-    all_replacements: Dict[str, str] = {}
-    all_replacements.update(BASIC_REPLACEMENTS_EN)
-    all_replacements.update(BASIC_REPLACEMENTS_VI)
-
-    basic = _apply_basic_replacements(working, all_replacements)
+    basic = _apply_basic_replacements(working, matcher)
 
     # Trả về: original_text là đúng văn bản gốc, normalized_text là bản đã sửa nhẹ
     return NormalizationResult(
@@ -166,4 +464,5 @@ def normalize_text(text: str, language: str = "vi") -> NormalizationResult:
         spelling_corrections=basic.spelling_corrections,
         term_mappings=basic.term_mappings,
         mappings=basic.mappings,
+        dictionary_version=matcher.version,
     )
@@ -32,6 +32,7 @@ Subtask 2: Undefined Terms (Thuật ngữ chưa định nghĩa)
 
 import google.generativeai as genai
 import json
+import logging
 import os
 from typing import Dict, Any, List
 from datetime import datetime
@@ -40,19 +41,32 @@ from dotenv import load_dotenv
 # Import from same directory
 try:
     from .promptStore import prompt_undefined_terms
+    from .rate_limiter import estimated_request_tokens, governed_call
 except ImportError:
     from promptStore import prompt_undefined_terms
+    from rate_limiter import estimated_request_tokens, governed_call
 
 # Load environment variables
 load_dotenv()
 
 # Configure Gemini
+logger = logging.getLogger(__name__)
+
 GEMINI_API_KEY_UNDEFINED_TERMS = os.getenv("GEMINI_API_KEY_UNDEFINED_TERMS")
 GEMINI_MODEL = os.getenv("GEMINI_MODEL", "gemini-2.5-flash")
 
-if not GEMINI_API_KEY_UNDEFINED_TERMS:
-    raise ValueError("GEMINI_API_KEY_UNDEFINED_TERMS not found in environment variables")
-genai.configure(api_key=GEMINI_API_KEY_UNDEFINED_TERMS)
+_configured = False
+
+
+def _ensure_configured() -> None:
+    """Kiểm tra key + genai.configure lúc gọi lần đầu (import module không cần key)."""
+    global _configured
+    if _configured:
+        return
+    if not GEMINI_API_KEY_UNDEFINED_TERMS:
+        raise ValueError("GEMINI_API_KEY_UNDEFINED_TERMS not found in environment variables")
+    genai.configure(api_key=GEMINI_API_KEY_UNDEFINED_TERMS)
+    _configured = True
 
 
 def check_undefined_terms(context: Dict[str, Any], content: str) -> Dict[str, Any]:
@@ -130,10 +144,14 @@ def check_undefined_terms(context: Dict[str, Any], content: str) -> Dict[str, An
         prompt = prompt_undefined_terms(context, content)
         
         # Initialize Gemini model
+        _ensure_configured()
         model = genai.GenerativeModel(GEMINI_MODEL)
         
-        # Generate response from Gemini
-        response = model.generate_content(prompt)
+        # Generate response from Gemini (qua rate limiter dùng chung)
+        response = governed_call(
+            lambda: model.generate_content(prompt),
+            estimated_tokens=estimated_request_tokens(prompt),
+        )
         response_text = response.text.strip()
         
         # Clean up response (remove markdown code blocks if present)
@@ -167,11 +185,11 @@ def check_undefined_terms(context: Dict[str, Any], content: str) -> Dict[str, An
         
     except json.JSONDecodeError as e:
         result["metadata"]["error"] = f"Failed to parse LLM response as JSON: {str(e)}"
-        print(f"JSON Parse Error: {e}")
-        print(f"Response text: {response_text[:500]}...")  # Print first 500 chars for debugging
+        logger.warning("JSON Parse Error: %s", e)
+        logger.debug("Response text: %s", response_text[:500])  # 500 ký tự đầu để debug
         
     except Exception as e:
         result["metadata"]["error"] = f"Error during analysis: {str(e)}"
-        print(f"Error: {e}")
+        logger.exception("Error during analysis")
     
     return result
\ No newline at end of file
@@ -0,0 +1,130 @@
+"""
+ASGI middleware nén response (brotli / gzip)
+--------------------------------------------
+Kết quả phân tích và document (content_full) thường vài trăm KB JSON, nén được
+5-10 lần. Middleware chọn encoding theo Accept-Encoding của client:
+
+- "br" nếu có cài `brotli` và client chấp nhận, rồi đến "gzip"; không có → gửi nguyên.
+- Chỉ nén body >= `minimum_size` byte với content-type dạng text / JSON; body nhỏ
+  nén không lợi mà tốn CPU.
+- Response streaming (nhiều message body) và response đã có Content-Encoding
+  được chuyển nguyên, không buffer.
+- ETag mạnh của response được nén chuyển thành ETag yếu (W/"...").
+- response_compression_bytes_total{encoding, stage="in"|"out"}: byte trước / sau nén.
+"""
+
+import gzip
+from typing import Optional
+
+from app.core.metrics import counter
+
+try:
+    import brotli
+except ImportError:  # brotli là tuỳ chọn: chỉ dùng gzip
+    brotli = None
+
+COMPRESSION_BYTES = counter(
+    "response_compression_bytes_total", "Response body bytes before and after compression", ["encoding", "stage"]
+)
+
+COMPRESSIBLE_TYPES = ("application/json", "text/", "application/javascript", "application/xml")
+
+
+def _accepted_encodings(scope) -> set:
+    for name, value in scope.get("headers", []):
+        if name == b"accept-encoding":
+            encodings = set()
+            for part in value.decode("latin-1").lower().split(","):
+                token, _, params = part.partition(";")
+                quality = params.strip().removeprefix("q=")
+                try:
+                    if params and float(quality) <= 0:  # "gzip;q=0" = từ chối
+                        continue
+                except ValueError:
+                    pass
+                encodings.add(token.strip())
+            return encodings
+    return set()
+
+
+class CompressionMiddleware:
+    def __init__(self, app, minimum_size: int = 1024, gzip_level: int = 6, brotli_quality: int = 4):
+        self.app = app
+        self.minimum_size = minimum_size
+        self.gzip_level = gzip_level
+        self.brotli_quality = brotli_quality
+
+    def _choose_encoding(self, scope) -> Optional[str]:
+        accepted = _accepted_encodings(scope)
+        if brotli is not None and "br" in accepted:
+            return "br"
+        if "gzip" in accepted:
+            return "gzip"
+        return None
+
+    def compress(self, body: bytes, encoding: str) -> bytes:
+        if encoding == "br":
+            return brotli.compress(body, quality=self.brotli_quality)
+        return gzip.compress(body, compresslevel=self.gzip_level, mtime=0)
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+        encoding = self._choose_encoding(scope)
+        if encoding is None:
+            await self.app(scope, receive, send)
+            return
+
+        start_message = None
+        passthrough = False
+
+        async def _send(message):
+            nonlocal start_message, passthrough
+            if passthrough:
+                await send(message)
+                return
+
+            if message["type"] == "http.response.start":
+                headers = {name.lower(): value for name, value in message.get("headers", [])}
+                content_type = headers.get(b"content-type", b"").decode("latin-1")
+                if b"content-encoding" in headers or not content_type.startswith(COMPRESSIBLE_TYPES):
+                    passthrough = True
+                    await send(message)
+                else:
+                    start_message = message  # chờ body để biết kích thước
+                return
+
+            body = message.get("body", b"")
+            if message.get("more_body", False) or len(body) < self.minimum_size:
+                # streaming hoặc body nhỏ → gửi nguyên
+                passthrough = True
+                await send(start_message)
+                await send(message)
+                return
+
+            compressed = self.compress(body, encoding)
+            COMPRESSION_BYTES.labels(encoding=encoding, stage="in").inc(len(body))
+            COMPRESSION_BYTES.labels(encoding=encoding, stage="out").inc(len(compressed))
+            headers = [
+                (name, value)
+                for name, value in start_message.get("headers", [])
+                if name.lower() not in (b"content-length", b"vary", b"etag")
+            ]
+            etag = next((value for name, value in start_message.get("headers", []) if name.lower() == b"etag"), None)
+            if etag is not None:
+                # bản nén khác byte với bản gốc → ETag chỉ còn tương đương yếu
+                headers.append((b"etag", etag if etag.startswith(b"W/") else b"W/" + etag))
+            vary = [value for name, value in start_message.get("headers", []) if name.lower() == b"vary"]
+            vary_values = [v.strip() for v in b",".join(vary).split(b",") if v.strip()]
+            if b"accept-encoding" not in [v.lower() for v in vary_values]:
+                vary_values.append(b"Accept-Encoding")
+            headers += [
+                (b"content-encoding", encoding.encode()),
+                (b"content-length", str(len(compressed)).encode()),
+                (b"vary", b", ".join(vary_values)),
+            ]
+            await send({**start_message, "headers": headers})
+            await send({"type": "http.response.body", "body": compressed})
+
+        await self.app(scope, receive, _send)
@@ -7,21 +7,59 @@ class Settings(BaseSettings):
     
     # Database
     DATABASE_URL: str
+    # Connection pool (mỗi worker 2 pool sync + async: tổng kết nối ≈ 2 × workers × (POOL_SIZE + MAX_OVERFLOW))
+    DB_POOL_SIZE: int = 5
+    DB_MAX_OVERFLOW: int = 10
+    DB_POOL_TIMEOUT: float = 30  # giây chờ kết nối rảnh trước khi lỗi
+    DB_POOL_RECYCLE: int = 1800  # giây; đóng kết nối cũ hơn (tránh bị LB / PgBouncer cắt)
+    DB_CONNECT_TIMEOUT: int = 10
+    DB_STATEMENT_TIMEOUT_MS: int = 0  # 0 = không giới hạn
+    DB_PGBOUNCER: bool = False  # transaction pooling: không dùng startup options / prepared statements
     
     # Security
     SECRET_KEY: str
     ALGORITHM: str = "HS256"
     ACCESS_TOKEN_EXPIRE_MINUTES: int = 30
+    # Cache User theo `sub` của JWT (giây; 0 = tắt) → bỏ query USER mỗi request
+    AUTH_PRINCIPAL_CACHE_TTL: float = 30
+    AUTH_PRINCIPAL_CACHE_SIZE: int = 10000
+    # Route chỉ đọc tin claim `sub` đã ký, không lookup USER (xem security.get_current_principal)
+    AUTH_TRUST_TOKEN_CLAIMS: bool = False
+    # bcrypt: work factor (hash cũ với rounds khác vẫn verify được); process pool riêng
+    # (0 worker = chạy trong luồng gọi); quá PASSWORD_HASH_MAX_PENDING việc chờ → 503
+    BCRYPT_ROUNDS: int = 12
+    PASSWORD_HASH_WORKERS: int = 2
+    PASSWORD_HASH_MAX_PENDING: int = 64
     
     # CORS - Support multiple origins for flexible deployment
     FRONTEND_URL: str = "http://localhost:3000"
     # Comma-separated list of allowed origins (optional, defaults to FRONTEND_URL + localhost)
     ALLOWED_ORIGINS: str | None = None
     
-    # AI/LLM
-    GEMINI_API_KEY: str
+    # Document canvas sync: BeautifulSoup tree builder ("auto" prefers lxml, falls back to html.parser)
+    DOCUMENT_PARSER_BACKEND: str = "auto"
+    
+    # AI/LLM (key chỉ bắt buộc khi LLM_BACKEND=gemini, kiểm tra lúc gọi lần đầu)
+    GEMINI_API_KEY: str | None = None
     GEMINI_MODEL: str = "gemini-2.5-flash"  # có thể đổi sang phiên bản pro nếu cần chất lượng cao hơn
     
+    # Observability: GET /metrics (Prometheus text format) + đo latency từng route
+    METRICS_ENABLED: bool = True
+    
+    # Nén response (br nếu có cài brotli, không thì gzip) cho body >= RESPONSE_COMPRESSION_MIN_SIZE byte
+    RESPONSE_COMPRESSION_ENABLED: bool = True
+    RESPONSE_COMPRESSION_MIN_SIZE: int = 1024
+    RESPONSE_GZIP_LEVEL: int = 6
+    RESPONSE_BROTLI_QUALITY: int = 4
+    
+    # Logging: LOG_FORMAT "text" | "json"; sampling theo prefix logger ("app.routers=0.1,...");
+    # LOG_MAX_PER_SECOND=0 → không giới hạn. WARNING trở lên luôn được ghi.
+    LOG_LEVEL: str = "INFO"
+    LOG_FORMAT: str = "text"
+    LOG_SAMPLE_RATES: str | None = None
+    LOG_MAX_PER_SECOND: float = 0
+    SQL_ECHO: bool = False  # log mọi câu SQL (chỉ nên bật khi debug)
+    
     class Config:
         env_file = ".env"
         extra = "allow"
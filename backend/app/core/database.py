@@ -1,19 +1,163 @@
-from sqlalchemy import create_engine
+"""
+Engine + session của SQLAlchemy
+-------------------------------
+Kích thước pool cấu hình qua Settings (DB_POOL_SIZE, DB_MAX_OVERFLOW, ...): mỗi
+worker uvicorn/gunicorn có 2 pool riêng (sync + async) → tổng kết nối tối đa ≈
+2 × số worker × (DB_POOL_SIZE + DB_MAX_OVERFLOW), phải nhỏ hơn max_connections
+của Postgres (hoặc default_pool_size của PgBouncer).
+
+DB_PGBOUNCER=true: chạy sau PgBouncer ở transaction pooling — không gửi startup
+parameter `options` (PgBouncer từ chối), statement_timeout đặt ở role/database
+(ALTER ROLE ... SET statement_timeout) thay vì lúc connect; engine async
+(asyncpg) tắt cache prepared statement phía server.
+
+Engine async (asyncpg, cùng DATABASE_URL) cho các route nóng (documents, auth,
+logic-checks, get_current_user): chờ DB không chặn event loop, không chiếm
+slot threadpool. Route sync còn lại vẫn dùng get_db (psycopg2).
+
+Metrics: db_pool_size/checked_out/overflow (đọc lúc scrape), db_pool_checkout_seconds
+(thời gian chờ lấy kết nối), db_pool_timeouts_total (hết DB_POOL_TIMEOUT),
+db_connections_opened_total.
+"""
+
+import time
+from typing import Any, Dict
+from uuid import uuid4
+
+from sqlalchemy import create_engine, event
+from sqlalchemy.engine import make_url
+from sqlalchemy.exc import TimeoutError as PoolTimeoutError
+from sqlalchemy.ext.asyncio import AsyncSession, async_sessionmaker, create_async_engine
 from sqlalchemy.ext.declarative import declarative_base
 from sqlalchemy.orm import sessionmaker
+from sqlalchemy.pool import AsyncAdaptedQueuePool, QueuePool
 from app.core.config import get_settings
+from app.core.metrics import REGISTRY, counter, gauge, histogram
 
 settings = get_settings()
 
-# Create database engine
-engine = create_engine(
-    settings.DATABASE_URL,
-    echo=True,  # Set to False in production
-    pool_pre_ping=True,
+# Pool metrics: đọc trạng thái pool lúc scrape /metrics (không tốn gì mỗi request)
+POOL_SIZE = gauge("db_pool_size", "Configured size of the DB connection pool")
+POOL_CHECKED_OUT = gauge("db_pool_checked_out", "DB connections currently checked out")
+POOL_OVERFLOW = gauge("db_pool_overflow", "DB connections opened beyond pool_size (overflow)")
+ASYNC_POOL_CHECKED_OUT = gauge("db_async_pool_checked_out", "Async (asyncpg) DB connections currently checked out")
+ASYNC_POOL_OVERFLOW = gauge("db_async_pool_overflow", "Async DB connections opened beyond pool_size (overflow)")
+POOL_CHECKOUT_SECONDS = histogram(
+    "db_pool_checkout_seconds",
+    "Time spent waiting for a pooled DB connection",
+    buckets=(0.0005, 0.001, 0.005, 0.01, 0.05, 0.1, 0.5, 1.0, 5.0, 30.0),
 )
+POOL_TIMEOUTS = counter("db_pool_timeouts_total", "Checkouts that gave up after DB_POOL_TIMEOUT")
+CONNECTIONS_OPENED = counter("db_connections_opened_total", "New DBAPI connections opened by the pool")
+
+
+class _CheckoutTimingMixin:
+    """Đo thời gian chờ checkout và số lần timeout (overflow đã hết)."""
+
+    def _do_get(self):
+        started = time.perf_counter()
+        try:
+            return super()._do_get()
+        except PoolTimeoutError:
+            POOL_TIMEOUTS.inc()
+            raise
+        finally:
+            POOL_CHECKOUT_SECONDS.observe(time.perf_counter() - started)
+
+
+class InstrumentedQueuePool(_CheckoutTimingMixin, QueuePool):
+    pass
+
+
+class InstrumentedAsyncQueuePool(_CheckoutTimingMixin, AsyncAdaptedQueuePool):
+    pass
+
+
+def engine_options(settings) -> Dict[str, Any]:
+    """kwargs cho create_engine() từ Settings (tách riêng để test / tái dùng cho engine async)."""
+    options: Dict[str, Any] = {
+        "echo": False,  # log SQL qua settings.SQL_ECHO (core/logging_config.py)
+        "pool_pre_ping": True,
+        "poolclass": InstrumentedQueuePool,
+        "pool_size": settings.DB_POOL_SIZE,
+        "max_overflow": settings.DB_MAX_OVERFLOW,
+        "pool_timeout": settings.DB_POOL_TIMEOUT,
+        "pool_recycle": settings.DB_POOL_RECYCLE,
+    }
+    connect_args: Dict[str, Any] = {}
+    if settings.DATABASE_URL.startswith("postgresql"):
+        connect_args["connect_timeout"] = settings.DB_CONNECT_TIMEOUT
+        if settings.DB_STATEMENT_TIMEOUT_MS > 0 and not settings.DB_PGBOUNCER:
+            connect_args["options"] = f"-c statement_timeout={settings.DB_STATEMENT_TIMEOUT_MS}"
+    if connect_args:
+        options["connect_args"] = connect_args
+    return options
+
+
+def async_database_url(url: str) -> str:
+    """postgresql:// hoặc postgresql+psycopg2:// → postgresql+asyncpg://"""
+    parsed = make_url(url)
+    if parsed.get_backend_name() == "postgresql":
+        parsed = parsed.set(drivername="postgresql+asyncpg")
+    return parsed.render_as_string(hide_password=False)
+
+
+def async_engine_options(settings) -> Dict[str, Any]:
+    """Như engine_options() nhưng connect_args theo asyncpg."""
+    options = engine_options(settings)
+    options["poolclass"] = InstrumentedAsyncQueuePool
+    options.pop("connect_args", None)
+    connect_args: Dict[str, Any] = {}
+    if settings.DATABASE_URL.startswith("postgresql"):
+        connect_args["timeout"] = settings.DB_CONNECT_TIMEOUT
+        if settings.DB_PGBOUNCER:
+            # Transaction pooling: prepared statement có tên không sống qua các transaction
+            connect_args["statement_cache_size"] = 0
+            connect_args["prepared_statement_cache_size"] = 0
+            # asyncpg vẫn prepare mỗi câu (tên __asyncpg_stmt_N__ theo từng kết nối) → 2 client
+            # dùng chung 1 server connection qua PgBouncer có thể trùng tên; tên ngẫu nhiên tránh va chạm
+            connect_args["prepared_statement_name_func"] = lambda: f"__asyncpg_{uuid4()}__"
+        elif settings.DB_STATEMENT_TIMEOUT_MS > 0:
+            connect_args["server_settings"] = {"statement_timeout": str(settings.DB_STATEMENT_TIMEOUT_MS)}
+    if connect_args:
+        options["connect_args"] = connect_args
+    return options
+
+
+def build_engine(url: str, settings):
+    db_engine = create_engine(url, **engine_options(settings))
+    event.listen(db_engine.pool, "connect", lambda *_: CONNECTIONS_OPENED.inc())
+    return db_engine
+
+
+def build_async_engine(url: str, settings):
+    db_engine = create_async_engine(async_database_url(url), **async_engine_options(settings))
+    event.listen(db_engine.sync_engine.pool, "connect", lambda *_: CONNECTIONS_OPENED.inc())
+    return db_engine
+
+
+# Create database engine
+engine = build_engine(settings.DATABASE_URL, settings)
+async_engine = build_async_engine(settings.DATABASE_URL, settings)
+
+
+@REGISTRY.add_collector
+def _collect_pool_stats() -> None:
+    pool = engine.pool
+    if hasattr(pool, "checkedout"):  # QueuePool; NullPool/StaticPool không có số liệu
+        POOL_SIZE.set(pool.size())
+        POOL_CHECKED_OUT.set(pool.checkedout())
+        POOL_OVERFLOW.set(max(0, pool.overflow()))
+    async_pool = async_engine.sync_engine.pool
+    if hasattr(async_pool, "checkedout"):
+        ASYNC_POOL_CHECKED_OUT.set(async_pool.checkedout())
+        ASYNC_POOL_OVERFLOW.set(max(0, async_pool.overflow()))
+
 
 # Create session factory
 SessionLocal = sessionmaker(autocommit=False, autoflush=False, bind=engine)
+# expire_on_commit=False: object đã load vẫn đọc được sau commit (lazy load không chạy được trong async)
+AsyncSessionLocal = async_sessionmaker(async_engine, autoflush=False, expire_on_commit=False)
 
 # Base class for models
 Base = declarative_base()
@@ -26,3 +170,9 @@ def get_db():
         yield db
     finally:
         db.close()
+
+
+async def get_async_db():
+    """Dependency for getting an async database session"""
+    async with AsyncSessionLocal() as db:
+        yield db
@@ -0,0 +1,207 @@
+"""
+Logging có cấu trúc cho app
+---------------------------
+- configure_logging(settings): 1 handler stdout cho root logger, format
+  "text" (dev, dễ đọc) hoặc "json" (prod, 1 dòng / event, field từ `extra=`).
+- request id: RequestIdMiddleware đọc header X-Request-ID (hoặc sinh mới),
+  lưu vào contextvar → mọi log trong request (kể cả route sync chạy ở
+  threadpool) có request_id; response trả lại header X-Request-ID.
+- Sampling: LOG_SAMPLE_RATES="app.ai.models.Analysis=0.1,app.routers=0.5" giữ
+  ngẫu nhiên 1 phần log < WARNING theo prefix tên logger (prefix dài nhất thắng);
+  LOG_MAX_PER_SECOND chặn tổng số log < WARNING mỗi giây. WARNING trở lên luôn
+  được ghi. Log bị bỏ được đếm ở metric logs_dropped_total{reason}.
+- SQL_ECHO: bật log câu SQL (logger sqlalchemy.engine) thay cho echo=True cứng.
+"""
+
+import contextvars
+import json
+import logging
+import random
+import sys
+import threading
+import time
+import uuid
+from datetime import datetime, timezone
+from typing import Dict, Optional
+
+from app.core.metrics import counter
+
+request_id_var: contextvars.ContextVar[Optional[str]] = contextvars.ContextVar("request_id", default=None)
+
+LOGS_DROPPED = counter("logs_dropped_total", "Log records dropped by sampling / rate limiting", ["reason"])
+
+REQUEST_ID_HEADER = "x-request-id"
+
+# Thuộc tính chuẩn của LogRecord; phần còn lại là field truyền qua `extra=`
+_RESERVED = set(vars(logging.LogRecord("", 0, "", 0, "", (), None))) | {"message", "asctime", "request_id"}
+
+
+def get_request_id() -> Optional[str]:
+    return request_id_var.get()
+
+
+def parse_sample_rates(raw: Optional[str]) -> Dict[str, float]:
+    """'a.b=0.1, c=0.5' → {'a.b': 0.1, 'c': 0.5} (bỏ qua mục sai định dạng)."""
+    rates: Dict[str, float] = {}
+    for part in (raw or "").split(","):
+        name, sep, value = part.partition("=")
+        if not sep or not name.strip():
+            continue
+        try:
+            rates[name.strip()] = min(1.0, max(0.0, float(value)))
+        except ValueError:
+            continue
+    return rates
+
+
+class RequestIdFilter(logging.Filter):
+    def filter(self, record: logging.LogRecord) -> bool:
+        record.request_id = request_id_var.get()
+        return True
+
+
+class SamplingFilter(logging.Filter):
+    """Giữ log < WARNING theo tỉ lệ của prefix logger dài nhất khớp; >= WARNING giữ hết."""
+
+    def __init__(self, rates: Dict[str, float], rng: Optional[random.Random] = None):
+        super().__init__()
+        self.rates = dict(rates)
+        self.rng = rng or random.Random()
+        self._cache: Dict[str, float] = {}
+
+    def _rate_for(self, name: str) -> float:
+        rate = self._cache.get(name)
+        if rate is None:
+            rate = 1.0
+            best = -1
+            for prefix, value in self.rates.items():
+                if (name == prefix or name.startswith(prefix + ".")) and len(prefix) > best:
+                    rate, best = value, len(prefix)
+            self._cache[name] = rate
+        return rate
+
+    def filter(self, record: logging.LogRecord) -> bool:
+        if record.levelno >= logging.WARNING:
+            return True
+        rate = self._rate_for(record.name)
+        if rate >= 1.0 or self.rng.random() < rate:
+            return True
+        LOGS_DROPPED.labels(reason="sampled").inc()
+        return False
+
+
+class RateLimitFilter(logging.Filter):
+    """Token bucket: tối đa `per_second` log < WARNING mỗi giây (burst = 1 giây)."""
+
+    def __init__(self, per_second: float, clock=time.monotonic):
+        super().__init__()
+        self.per_second = per_second
+        self.clock = clock
+        self._tokens = per_second
+        self._updated = clock()
+        self._lock = threading.Lock()
+
+    def filter(self, record: logging.LogRecord) -> bool:
+        if record.levelno >= logging.WARNING or self.per_second <= 0:
+            return True
+        with self._lock:
+            now = self.clock()
+            self._tokens = min(self.per_second, self._tokens + (now - self._updated) * self.per_second)
+            self._updated = now
+            if self._tokens >= 1.0:
+                self._tokens -= 1.0
+                return True
+        LOGS_DROPPED.labels(reason="rate_limited").inc()
+        return False
+
+
+class JsonFormatter(logging.Formatter):
+    """1 dòng JSON / record: ts, level, logger, msg, request_id + field `extra=`."""
+
+    def format(self, record: logging.LogRecord) -> str:
+        payload = {
+            "ts": datetime.fromtimestamp(record.created, tz=timezone.utc).isoformat(timespec="milliseconds"),
+            "level": record.levelname,
+            "logger": record.name,
+            "msg": record.getMessage(),
+        }
+        request_id = getattr(record, "request_id", None)
+        if request_id:
+            payload["request_id"] = request_id
+        for key, value in record.__dict__.items():
+            if key not in _RESERVED and not key.startswith("_"):
+                payload[key] = value
+        if record.exc_info:
+            payload["exc_info"] = self.formatException(record.exc_info)
+        return json.dumps(payload, ensure_ascii=False, default=str)
+
+
+class TextFormatter(logging.Formatter):
+    def __init__(self):
+        super().__init__("%(asctime)s %(levelname)-7s %(name)s [%(request_id)s] %(message)s")
+
+    def format(self, record: logging.LogRecord) -> str:
+        if getattr(record, "request_id", None) is None:
+            record.request_id = "-"
+        return super().format(record)
+
+
+_HANDLER_NAME = "logicguard"
+
+
+def configure_logging(settings) -> logging.Handler:
+    """Cài handler stdout cho root logger theo Settings (gọi lại được, thay handler cũ)."""
+    root = logging.getLogger()
+    for handler in list(root.handlers):
+        if handler.get_name() == _HANDLER_NAME:
+            root.removeHandler(handler)
+
+    handler = logging.StreamHandler(sys.stdout)
+    handler.set_name(_HANDLER_NAME)
+    handler.setFormatter(JsonFormatter() if settings.LOG_FORMAT.lower() == "json" else TextFormatter())
+    handler.addFilter(RequestIdFilter())
+    rates = parse_sample_rates(settings.LOG_SAMPLE_RATES)
+    if rates:
+        handler.addFilter(SamplingFilter(rates))
+    if settings.LOG_MAX_PER_SECOND > 0:
+        handler.addFilter(RateLimitFilter(settings.LOG_MAX_PER_SECOND))
+
+    root.addHandler(handler)
+    root.setLevel(settings.LOG_LEVEL.upper())
+    # SQL echo qua logger (không dùng create_engine(echo=True) → tránh handler trùng);
+    # không đặt level thì sqlalchemy.engine kế thừa INFO của root và log mọi câu SQL
+    logging.getLogger("sqlalchemy.engine").setLevel(logging.INFO if settings.SQL_ECHO else logging.WARNING)
+    return handler
+
+
+class RequestIdMiddleware:
+    """ASGI: gán request id cho mỗi request HTTP + trả về header X-Request-ID."""
+
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+
+        request_id = None
+        for name, value in scope.get("headers", []):
+            if name == REQUEST_ID_HEADER.encode():
+                request_id = value.decode("latin-1")[:128]
+                break
+        request_id = request_id or uuid.uuid4().hex
+        token = request_id_var.set(request_id)
+
+        async def _send(message):
+            if message["type"] == "http.response.start":
+                message.setdefault("headers", [])
+                message["headers"] = list(message["headers"]) + [
+                    (REQUEST_ID_HEADER.encode(), request_id.encode("latin-1"))
+                ]
+            await send(message)
+
+        try:
+            await self.app(scope, receive, _send)
+        finally:
+            request_id_var.reset(token)
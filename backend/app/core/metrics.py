@@ -0,0 +1,392 @@
+"""
+In-process metrics (Counter / Gauge / Histogram)
+
+API gần giống prometheus_client (labels(...).inc() / set() / observe()) nhưng
+không cần thêm dependency. Mọi metric tạo ra được đăng ký vào REGISTRY;
+render_text() xuất theo Prometheus text format (GET /metrics). Collector
+(add_collector) cập nhật gauge lúc scrape (RSS, pool DB...) thay vì mỗi request.
+StageTimer: thời gian từng stage của 1 pipeline → metadata kết quả + histogram.
+"""
+
+import bisect
+import logging
+import os
+import threading
+import time
+from contextlib import contextmanager
+from typing import Callable, Dict, Iterable, Iterator, List, Optional, Sequence, Tuple
+
+logger = logging.getLogger(__name__)
+
+LabelValues = Tuple[str, ...]
+
+DEFAULT_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0)
+
+
+class MetricsRegistry:
+    def __init__(self) -> None:
+        self._metrics: Dict[str, "_Metric"] = {}
+        self._collectors: List[Callable[[], None]] = []
+        self._lock = threading.Lock()
+
+    def add_collector(self, collector: Callable[[], None]) -> Callable[[], None]:
+        """collector() chạy trước mỗi lần scrape để set các gauge tính theo yêu cầu."""
+        with self._lock:
+            if collector not in self._collectors:
+                self._collectors.append(collector)
+        return collector
+
+    def run_collectors(self) -> None:
+        with self._lock:
+            collectors = list(self._collectors)
+        for collector in collectors:
+            try:
+                collector()
+            except Exception as exc:  # noqa: BLE001 - 1 collector lỗi không làm hỏng /metrics
+                logger.warning("Metrics collector %s failed: %s", getattr(collector, "__name__", collector), exc)
+
+    def register(self, metric: "_Metric") -> "_Metric":
+        with self._lock:
+            if metric.name in self._metrics:
+                raise ValueError(f"Metric '{metric.name}' already registered")
+            self._metrics[metric.name] = metric
+            return metric
+
+    def get(self, name: str) -> Optional["_Metric"]:
+        return self._metrics.get(name)
+
+    def collect(self) -> List["_Metric"]:
+        with self._lock:
+            return list(self._metrics.values())
+
+
+REGISTRY = MetricsRegistry()
+
+
+class _Metric:
+    type_name = ""
+
+    def __init__(
+        self,
+        name: str,
+        documentation: str,
+        labelnames: Sequence[str] = (),
+        registry: Optional[MetricsRegistry] = REGISTRY,
+    ) -> None:
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self._lock = threading.Lock()
+        self._children: Dict[LabelValues, object] = {}
+        if registry is not None:
+            registry.register(self)
+
+    def _label_values(self, labels: Dict[str, object]) -> LabelValues:
+        if set(labels) != set(self.labelnames):
+            raise ValueError(f"{self.name}: expected labels {self.labelnames}, got {sorted(labels)}")
+        return tuple(str(labels[name]) for name in self.labelnames)
+
+    def labels(self, **labels: object):
+        key = self._label_values(labels)
+        with self._lock:
+            child = self._children.get(key)
+            if child is None:
+                child = self._new_child()
+                self._children[key] = child
+            return child
+
+    def _default(self):
+        if self.labelnames:
+            raise ValueError(f"{self.name} has labels {self.labelnames}; use .labels(...)")
+        return self.labels()
+
+    def samples(self) -> Iterable[Tuple[LabelValues, object]]:
+        with self._lock:
+            return list(self._children.items())
+
+    def _new_child(self):
+        raise NotImplementedError
+
+
+class _CounterValue:
+    def __init__(self) -> None:
+        self.value = 0.0
+        self._lock = threading.Lock()
+
+    def inc(self, amount: float = 1.0) -> None:
+        if amount < 0:
+            raise ValueError("Counter can only increase")
+        with self._lock:
+            self.value += amount
+
+
+class _GaugeValue:
+    def __init__(self) -> None:
+        self.value = 0.0
+        self._lock = threading.Lock()
+
+    def set(self, value: float) -> None:
+        with self._lock:
+            self.value = float(value)
+
+    def inc(self, amount: float = 1.0) -> None:
+        with self._lock:
+            self.value += amount
+
+    def dec(self, amount: float = 1.0) -> None:
+        with self._lock:
+            self.value -= amount
+
+
+class _HistogramValue:
+    def __init__(self, buckets: Sequence[float]) -> None:
+        self.buckets = tuple(buckets)
+        self.counts = [0] * (len(self.buckets) + 1)  # bucket cuối = +Inf
+        self.sum = 0.0
+        self.count = 0
+        self._lock = threading.Lock()
+
+    def observe(self, value: float) -> None:
+        index = bisect.bisect_left(self.buckets, value)
+        with self._lock:
+            self.counts[index] += 1
+            self.sum += value
+            self.count += 1
+
+    def cumulative(self) -> List[Tuple[float, int]]:
+        """[(upper_bound, số quan sát <= upper_bound)], bound cuối = +Inf"""
+        with self._lock:
+            counts = list(self.counts)
+        total = 0
+        result = []
+        for bound, count in zip(self.buckets + (float("inf"),), counts):
+            total += count
+            result.append((bound, total))
+        return result
+
+
+class Counter(_Metric):
+    type_name = "counter"
+
+    def _new_child(self):
+        return _CounterValue()
+
+    def inc(self, amount: float = 1.0) -> None:
+        self._default().inc(amount)
+
+
+class Gauge(_Metric):
+    type_name = "gauge"
+
+    def _new_child(self):
+        return _GaugeValue()
+
+    def set(self, value: float) -> None:
+        self._default().set(value)
+
+    def inc(self, amount: float = 1.0) -> None:
+        self._default().inc(amount)
+
+    def dec(self, amount: float = 1.0) -> None:
+        self._default().dec(amount)
+
+
+class Histogram(_Metric):
+    type_name = "histogram"
+
+    def __init__(
+        self,
+        name: str,
+        documentation: str,
+        labelnames: Sequence[str] = (),
+        buckets: Sequence[float] = DEFAULT_BUCKETS,
+        registry: Optional[MetricsRegistry] = REGISTRY,
+    ) -> None:
+        self.buckets = tuple(sorted(buckets))
+        super().__init__(name, documentation, labelnames, registry=registry)
+
+    def _new_child(self):
+        return _HistogramValue(self.buckets)
+
+    def observe(self, value: float) -> None:
+        self._default().observe(value)
+
+
+_FACTORY_LOCK = threading.Lock()
+
+
+def _get_or_create(cls, name: str, *args, **kwargs):
+    with _FACTORY_LOCK:
+        existing = REGISTRY.get(name)
+        if existing is None:
+            return cls(name, *args, **kwargs)
+    if type(existing) is not cls:
+        raise ValueError(f"Metric '{name}' already registered as {existing.type_name}")
+    return existing
+
+
+def counter(name: str, documentation: str, labelnames: Sequence[str] = ()) -> Counter:
+    """
+    Lấy metric đã đăng ký hoặc tạo mới — dùng ở module level để import lại module
+    (vd. qua 2 đường sys.path trong test) không tạo trùng tên.
+    """
+    return _get_or_create(Counter, name, documentation, labelnames)
+
+
+def gauge(name: str, documentation: str, labelnames: Sequence[str] = ()) -> Gauge:
+    return _get_or_create(Gauge, name, documentation, labelnames)
+
+
+def histogram(
+    name: str,
+    documentation: str,
+    labelnames: Sequence[str] = (),
+    buckets: Sequence[float] = DEFAULT_BUCKETS,
+) -> Histogram:
+    return _get_or_create(Histogram, name, documentation, labelnames, buckets)
+
+
+# ====== PROMETHEUS TEXT FORMAT ======
+
+CONTENT_TYPE_LATEST = "text/plain; version=0.0.4; charset=utf-8"
+
+
+def _escape_label(value: str) -> str:
+    return value.replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+
+def _format_value(value: float) -> str:
+    if value == float("inf"):
+        return "+Inf"
+    if value == float("-inf"):
+        return "-Inf"
+    if float(value).is_integer():
+        return str(int(value))
+    return repr(float(value))
+
+
+def _format_labels(names: Sequence[str], values: Sequence[str]) -> str:
+    if not names:
+        return ""
+    pairs = ",".join(f'{name}="{_escape_label(value)}"' for name, value in zip(names, values))
+    return "{" + pairs + "}"
+
+
+def render_text(registry: MetricsRegistry = REGISTRY) -> str:
+    """Toàn bộ metric theo Prometheus exposition format 0.0.4."""
+    registry.run_collectors()
+    lines: List[str] = []
+    for metric in sorted(registry.collect(), key=lambda item: item.name):
+        doc = metric.documentation.replace("\\", "\\\\").replace("\n", "\\n")
+        lines.append(f"# HELP {metric.name} {doc}")
+        lines.append(f"# TYPE {metric.name} {metric.type_name}")
+        for label_values, child in sorted(metric.samples(), key=lambda item: item[0]):
+            if isinstance(child, _HistogramValue):
+                bucket_names = metric.labelnames + ("le",)
+                for bound, count in child.cumulative():
+                    labels = _format_labels(bucket_names, label_values + (_format_value(bound),))
+                    lines.append(f"{metric.name}_bucket{labels} {count}")
+                labels = _format_labels(metric.labelnames, label_values)
+                lines.append(f"{metric.name}_sum{labels} {_format_value(child.sum)}")
+                lines.append(f"{metric.name}_count{labels} {child.count}")
+            else:
+                labels = _format_labels(metric.labelnames, label_values)
+                lines.append(f"{metric.name}{labels} {_format_value(child.value)}")
+    return "\n".join(lines) + "\n"
+
+
+# ====== PROCESS METRICS ======
+
+PROCESS_RSS = gauge("process_resident_memory_bytes", "Resident memory size in bytes")
+PROCESS_CPU = gauge("process_cpu_seconds_total", "Total user and system CPU time spent in seconds")
+PROCESS_START = gauge("process_start_time_seconds", "Start time of the process since unix epoch in seconds")
+PROCESS_START.set(time.time())  # ≈ lúc import (module được import khi app khởi động)
+
+
+def _resident_memory_bytes() -> float:
+    try:
+        with open("/proc/self/statm") as statm:
+            return float(statm.read().split()[1]) * os.sysconf("SC_PAGE_SIZE")
+    except (OSError, ValueError, IndexError):
+        import resource  # không có /proc (macOS): ru_maxrss là peak, đơn vị bytes trên macOS
+
+        return float(resource.getrusage(resource.RUSAGE_SELF).ru_maxrss)
+
+
+def _collect_process() -> None:
+    PROCESS_RSS.set(_resident_memory_bytes())
+    PROCESS_CPU.set(time.process_time())
+
+
+REGISTRY.add_collector(_collect_process)
+
+
+# ====== PER-STAGE TIMING ======
+
+STAGE_SECONDS = histogram(
+    "pipeline_stage_seconds", "Duration of each stage of an analysis pipeline", ["pipeline", "stage"]
+)
+PIPELINE_SECONDS = histogram("pipeline_seconds", "End-to-end duration of an analysis pipeline", ["pipeline"])
+PIPELINE_ITEMS = counter(
+    "pipeline_items_total", "Items processed by analysis pipelines (tokens, pairs, cache hits...)", ["pipeline", "item"]
+)
+
+
+class StageTimer:
+    """
+    Đo thời gian từng stage của 1 lần chạy pipeline.
+    - stage(name): context manager; lap(name): thời gian từ mốc trước (stage
+      tuần tự không cần thụt lề lại code); add(name, seconds): cộng dồn trực tiếp.
+    - count(name, n): số đếm đi kèm (token in/out, cặp câu, cache hit...).
+    finish() export 1 lần vào STAGE_SECONDS / PIPELINE_ITEMS và trả dict cho
+    metadata: {"total_ms", "stages_ms": {...}, "counts": {...}}.
+    """
+
+    def __init__(self, pipeline: str, clock: Callable[[], float] = time.perf_counter) -> None:
+        self.pipeline = pipeline
+        self.clock = clock
+        self.stages: Dict[str, float] = {}
+        self.counts: Dict[str, float] = {}
+        self._started = self._mark = clock()
+        self._finished: Optional[Dict[str, object]] = None
+
+    def add(self, name: str, seconds: float) -> None:
+        self.stages[name] = self.stages.get(name, 0.0) + max(0.0, seconds)
+
+    def lap(self, name: str) -> None:
+        now = self.clock()
+        self.add(name, now - self._mark)
+        self._mark = now
+
+    def checkpoint(self) -> None:
+        """Đặt lại mốc cho lap() (bỏ qua khoảng đã được add() riêng)."""
+        self._mark = self.clock()
+
+    @contextmanager
+    def stage(self, name: str) -> Iterator[None]:
+        started = self.clock()
+        try:
+            yield
+        finally:
+            self._mark = self.clock()
+            self.add(name, self._mark - started)
+
+    def count(self, name: str, value: float = 1) -> None:
+        self.counts[name] = self.counts.get(name, 0) + value
+
+    def finish(self) -> Dict[str, object]:
+        if self._finished is not None:
+            return self._finished
+        total = self.clock() - self._started
+        for name, seconds in self.stages.items():
+            STAGE_SECONDS.labels(pipeline=self.pipeline, stage=name).observe(seconds)
+        for name, value in self.counts.items():
+            if value > 0:
+                PIPELINE_ITEMS.labels(pipeline=self.pipeline, item=name).inc(value)
+        PIPELINE_SECONDS.labels(pipeline=self.pipeline).observe(total)
+        self._finished = {
+            "total_ms": round(total * 1000, 2),
+            "stages_ms": {name: round(seconds * 1000, 2) for name, seconds in self.stages.items()},
+            "counts": dict(self.counts),
+        }
+        return self._finished
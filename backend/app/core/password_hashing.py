@@ -0,0 +1,150 @@
+"""
+Băm / kiểm tra mật khẩu bcrypt ngoài luồng request
+--------------------------------------------------
+bcrypt tốn 100-300ms CPU / lần (tuỳ BCRYPT_ROUNDS). Chạy trong threadpool của
+route thì 1 đợt login chiếm hết slot threadpool + GIL → request phân tích bị
+chậm theo. PasswordHasher đẩy việc sang process pool riêng (mỗi process 1 core):
+
+- Hàng đợi có giới hạn: tối đa `max_pending` việc (đang chạy + chờ); vượt quá →
+  PasswordHasherBusy ngay (route trả 503 + Retry-After) thay vì xếp hàng vô hạn.
+- workers=0 → chạy ngay trong luồng gọi (dev / test, không tạo process).
+- Worker chết (OOM kill, segfault) làm pool BrokenProcessPool vĩnh viễn → bỏ
+  pool hỏng, tạo pool mới và gửi lại 1 lần; vẫn lỗi → PasswordHasherBusy (503).
+- Process dùng start method "spawn" (fork từ process đã có thread của uvicorn dễ
+  deadlock); module này chỉ import bcrypt + core.metrics (không Settings / DB)
+  nên worker khởi động nhanh.
+"""
+
+import asyncio
+import multiprocessing
+import threading
+import time
+from concurrent.futures import Future, ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+from typing import Callable, Optional
+
+import bcrypt
+
+from app.core.metrics import counter, gauge, histogram
+
+HASH_SECONDS = histogram(
+    "password_hash_seconds",
+    "bcrypt hash / verify duration including queueing",
+    ["op"],
+    buckets=(0.01, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0),
+)
+HASH_PENDING = gauge("password_hash_pending", "bcrypt jobs queued or running in the password hasher")
+HASH_REJECTED = counter("password_hash_rejected_total", "bcrypt jobs rejected because the queue was full")
+HASH_POOL_RESTARTS = counter("password_hash_pool_restarts_total", "Broken bcrypt process pools replaced")
+
+
+# ====== WORKER FUNCTIONS (chạy trong process con) ======
+
+def hash_password(password: str, rounds: int = 12) -> str:
+    """Hash a password using bcrypt"""
+    # bcrypt has a 72 byte limit, truncate if needed
+    password_bytes = password.encode('utf-8')[:72]
+    return bcrypt.hashpw(password_bytes, bcrypt.gensalt(rounds=rounds)).decode('utf-8')
+
+
+def check_password(plain_password: str, hashed_password: str) -> bool:
+    """Verify a password against its hash"""
+    return bcrypt.checkpw(plain_password.encode('utf-8')[:72], hashed_password.encode('utf-8'))
+
+
+class PasswordHasherBusy(RuntimeError):
+    """Hàng đợi bcrypt đã đầy."""
+
+
+class PasswordHasher:
+    def __init__(self, workers: int, max_pending: int = 64, rounds: int = 12):
+        self.workers = workers
+        self.max_pending = max_pending
+        self.rounds = rounds
+        self._executor: Optional[ProcessPoolExecutor] = None
+        self._pending = 0
+        self._lock = threading.Lock()
+
+    def _get_executor(self) -> ProcessPoolExecutor:
+        with self._lock:
+            if self._executor is None:
+                self._executor = ProcessPoolExecutor(
+                    max_workers=self.workers, mp_context=multiprocessing.get_context("spawn")
+                )
+            return self._executor
+
+    def _discard_executor(self, broken: ProcessPoolExecutor) -> None:
+        with self._lock:
+            if self._executor is not broken:  # request khác đã thay pool
+                return
+            self._executor = None
+        HASH_POOL_RESTARTS.inc()
+        broken.shutdown(wait=False, cancel_futures=True)
+
+    def _submit_to_pool(self, fn: Callable, *args) -> Future:
+        for _ in range(2):
+            executor = self._get_executor()
+            try:
+                return executor.submit(fn, *args)
+            except BrokenProcessPool:
+                self._discard_executor(executor)
+        raise PasswordHasherBusy("password hashing process pool is broken")
+
+    def _admit(self) -> None:
+        with self._lock:
+            if self._pending >= self.max_pending:
+                HASH_REJECTED.inc()
+                raise PasswordHasherBusy(f"{self._pending} password hashing jobs pending")
+            self._pending += 1
+        HASH_PENDING.inc()
+
+    def _release(self, op: str, started: float) -> None:
+        with self._lock:
+            self._pending -= 1
+        HASH_PENDING.dec()
+        HASH_SECONDS.labels(op=op).observe(time.perf_counter() - started)
+
+    def _submit(self, op: str, fn: Callable, *args) -> Future:
+        self._admit()
+        started = time.perf_counter()
+        if self.workers <= 0:
+            future: Future = Future()
+            try:
+                future.set_result(fn(*args))
+            except Exception as exc:
+                future.set_exception(exc)
+            self._release(op, started)
+            return future
+        try:
+            future = self._submit_to_pool(fn, *args)
+        except Exception:
+            self._release(op, started)
+            raise
+        future.add_done_callback(lambda _: self._release(op, started))
+        return future
+
+    # ---- async (route async) ----
+
+    async def hash(self, password: str) -> str:
+        return await asyncio.wrap_future(self._submit("hash", hash_password, password, self.rounds))
+
+    async def verify(self, plain_password: str, hashed_password: str) -> bool:
+        return await asyncio.wrap_future(self._submit("verify", check_password, plain_password, hashed_password))
+
+    # ---- sync (route sync: luồng chờ kết quả, CPU nằm ở process pool) ----
+
+    def hash_blocking(self, password: str) -> str:
+        return self._submit("hash", hash_password, password, self.rounds).result()
+
+    def verify_blocking(self, plain_password: str, hashed_password: str) -> bool:
+        return self._submit("verify", check_password, plain_password, hashed_password).result()
+
+    @property
+    def pending(self) -> int:
+        return self._pending
+
+    def shutdown(self) -> None:
+        with self._lock:
+            executor, self._executor = self._executor, None
+        if executor is not None:
+            executor.shutdown(wait=False, cancel_futures=True)
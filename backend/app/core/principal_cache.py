@@ -0,0 +1,78 @@
+"""
+Cache principal (User) theo `sub` của JWT
+-----------------------------------------
+get_current_user chỉ query bảng USER khi cache miss; hit → trả User đã detach
+(chỉ đọc: id, email, created_at). TTL ngắn (AUTH_PRINCIPAL_CACHE_TTL) giới hạn
+độ trễ khi tài khoản đổi ở worker khác; trong cùng process routers/users.py gọi
+invalidate() ngay sau update / delete.
+
+Token vẫn được verify chữ ký + exp mỗi request; cache chỉ bỏ round trip DB.
+"""
+
+import threading
+import time
+from collections import OrderedDict
+from typing import Any, Optional, Tuple
+
+from app.core.config import get_settings
+from app.core.metrics import counter
+
+PRINCIPAL_CACHE_REQUESTS = counter(
+    "auth_principal_cache_requests_total", "Principal cache lookups by result", ["result"]
+)
+
+
+class PrincipalCache:
+    """LRU + TTL, thread-safe; ttl_seconds <= 0 → tắt cache."""
+
+    def __init__(self, max_entries: int = 10000, ttl_seconds: float = 30.0, clock=time.monotonic):
+        self.max_entries = max_entries
+        self.ttl_seconds = ttl_seconds
+        self.clock = clock
+        self._entries: "OrderedDict[str, Tuple[float, Any]]" = OrderedDict()
+        self._lock = threading.Lock()
+
+    @property
+    def enabled(self) -> bool:
+        return self.ttl_seconds > 0 and self.max_entries > 0
+
+    def get(self, subject: str) -> Optional[Any]:
+        if not self.enabled:
+            return None
+        with self._lock:
+            entry = self._entries.get(subject)
+            if entry is None or entry[0] < self.clock():
+                if entry is not None:
+                    del self._entries[subject]
+                PRINCIPAL_CACHE_REQUESTS.labels(result="miss").inc()
+                return None
+            self._entries.move_to_end(subject)
+        PRINCIPAL_CACHE_REQUESTS.labels(result="hit").inc()
+        return entry[1]
+
+    def put(self, subject: str, principal: Any) -> None:
+        if not self.enabled:
+            return
+        with self._lock:
+            self._entries[subject] = (self.clock() + self.ttl_seconds, principal)
+            self._entries.move_to_end(subject)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+
+    def invalidate(self, subject: Any) -> None:
+        with self._lock:
+            self._entries.pop(str(subject), None)
+
+    def clear(self) -> None:
+        with self._lock:
+            self._entries.clear()
+
+    def __len__(self) -> int:
+        return len(self._entries)
+
+
+_settings = get_settings()
+principal_cache = PrincipalCache(
+    max_entries=_settings.AUTH_PRINCIPAL_CACHE_SIZE,
+    ttl_seconds=_settings.AUTH_PRINCIPAL_CACHE_TTL,
+)
@@ -0,0 +1,67 @@
+"""
+ASGI middleware đo request HTTP
+-------------------------------
+- http_request_seconds{method, route, status}: latency theo route template
+  (vd. /api/documents/{document_id}, không phải path thật → cardinality cố định).
+- http_requests_in_flight: số request đang xử lý.
+
+Middleware ASGI thuần (không qua BaseHTTPMiddleware) nên mỗi request chỉ tốn vài
+thao tác cộng / bisect; /metrics không tự đo chính nó.
+"""
+
+import time
+from typing import Any, Callable, Dict, Optional
+
+from app.core.metrics import gauge, histogram
+
+REQUEST_SECONDS = histogram(
+    "http_request_seconds", "HTTP request latency by route template", ["method", "route", "status"]
+)
+IN_FLIGHT = gauge("http_requests_in_flight", "HTTP requests currently being served")
+
+UNMATCHED_ROUTE = "unmatched"
+
+
+class RequestMetricsMiddleware:
+    def __init__(self, app, skip_paths=("/metrics",)):
+        self.app = app
+        self.skip_paths = set(skip_paths)
+        self._routes: Optional[Dict[Callable[..., Any], str]] = None
+
+    def _route_template(self, scope) -> str:
+        """Router của Starlette ghi endpoint vào scope; map ngược endpoint → path template."""
+        endpoint = scope.get("endpoint")
+        if endpoint is None:
+            return UNMATCHED_ROUTE
+        if self._routes is None or endpoint not in self._routes:
+            app = scope.get("app")
+            routes = getattr(getattr(app, "router", None), "routes", [])
+            self._routes = {
+                getattr(route, "endpoint", None): getattr(route, "path", UNMATCHED_ROUTE) for route in routes
+            }
+        return self._routes.get(endpoint, UNMATCHED_ROUTE)
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http" or scope.get("path") in self.skip_paths:
+            await self.app(scope, receive, send)
+            return
+
+        status_code = 500
+        started = time.perf_counter()
+
+        async def _send(message):
+            nonlocal status_code
+            if message["type"] == "http.response.start":
+                status_code = message["status"]
+            await send(message)
+
+        IN_FLIGHT.inc()
+        try:
+            await self.app(scope, receive, _send)
+        finally:
+            IN_FLIGHT.dec()
+            REQUEST_SECONDS.labels(
+                method=scope.get("method", ""),
+                route=self._route_template(scope),
+                status=status_code,
+            ).observe(time.perf_counter() - started)
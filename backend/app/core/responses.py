@@ -0,0 +1,50 @@
+"""
+JSON response nhanh cho payload phân tích lớn
+---------------------------------------------
+Route trả dict không có response_model (vd. /logic-checks/analyze) bị FastAPI
+chạy jsonable_encoder duyệt từng phần tử rồi json.dumps lần nữa; với kết quả
+phân tích (content 5k từ + hàng trăm item) bước này tốn hơn cả render.
+
+- `dumps(obj)`: orjson (C, ra bytes, hiểu sẵn UUID / datetime / numpy) nếu có
+  cài; nếu không → json.dumps gọn (không khoảng trắng). Kiểu lạ (pydantic
+  model, numpy scalar khi không có orjson, set...) đi qua `_default`.
+- `FastJSONResponse`: dùng làm `response_class` của route; route trả thẳng
+  `FastJSONResponse(dict)` thì bỏ qua luôn jsonable_encoder.
+"""
+
+import json
+from typing import Any
+
+from fastapi.encoders import jsonable_encoder
+from fastapi.responses import JSONResponse
+
+try:
+    import orjson
+except ImportError:  # orjson là tuỳ chọn: fallback json chuẩn
+    orjson = None
+
+ORJSON_OPTIONS = (orjson.OPT_SERIALIZE_NUMPY | orjson.OPT_NON_STR_KEYS) if orjson is not None else 0
+
+
+def _default(obj: Any) -> Any:
+    """Kiểu mà encoder không tự hiểu."""
+    if hasattr(obj, "model_dump"):
+        return obj.model_dump(mode="json")
+    if hasattr(obj, "item") and getattr(obj, "shape", None) == ():  # numpy scalar
+        return obj.item()
+    if hasattr(obj, "tolist"):  # numpy array
+        return obj.tolist()
+    if isinstance(obj, (set, frozenset)):
+        return list(obj)
+    return jsonable_encoder(obj)
+
+
+def dumps(obj: Any) -> bytes:
+    if orjson is not None:
+        return orjson.dumps(obj, default=_default, option=ORJSON_OPTIONS)
+    return json.dumps(obj, default=_default, ensure_ascii=False, separators=(",", ":")).encode("utf-8")
+
+
+class FastJSONResponse(JSONResponse):
+    def render(self, content: Any) -> bytes:
+        return dumps(content)
@@ -1,13 +1,16 @@
+from dataclasses import dataclass
 from datetime import datetime, timedelta
-from typing import Optional
+from typing import Optional, Union
 from jose import JWTError, jwt
-import bcrypt
 from fastapi import Depends, HTTPException, status
 from fastapi.security import HTTPBearer, HTTPAuthorizationCredentials
-from sqlalchemy.orm import Session
-from app.core.database import get_db
+from uuid import UUID
+from sqlalchemy.ext.asyncio import AsyncSession
+from app.core.database import get_async_db
 from app.models.user import User
 from app.core.config import get_settings
+from app.core.password_hashing import PasswordHasher, PasswordHasherBusy
+from app.core.principal_cache import principal_cache
 
 settings = get_settings()
 
@@ -15,18 +18,52 @@ settings = get_settings()
 security = HTTPBearer()
 
 
+# bcrypt chạy ở process pool riêng (core/password_hashing.py), hàng đợi có giới hạn
+password_hasher = PasswordHasher(
+    workers=settings.PASSWORD_HASH_WORKERS,
+    max_pending=settings.PASSWORD_HASH_MAX_PENDING,
+    rounds=settings.BCRYPT_ROUNDS,
+)
+
+
+def _hasher_busy() -> HTTPException:
+    return HTTPException(
+        status_code=status.HTTP_503_SERVICE_UNAVAILABLE,
+        detail="Too many login requests, please retry shortly",
+        headers={"Retry-After": "1"},
+    )
+
+
 def verify_password(plain_password: str, hashed_password: str) -> bool:
-    """Verify a password against its hash"""
-    return bcrypt.checkpw(plain_password.encode('utf-8'), hashed_password.encode('utf-8'))
+    """Verify a password against its hash (blocking: dùng trong route sync)"""
+    try:
+        return password_hasher.verify_blocking(plain_password, hashed_password)
+    except PasswordHasherBusy:
+        raise _hasher_busy()
 
 
 def get_password_hash(password: str) -> str:
-    """Hash a password using bcrypt"""
-    # bcrypt has a 72 byte limit, truncate if needed
-    password_bytes = password.encode('utf-8')[:72]
-    salt = bcrypt.gensalt()
-    hashed = bcrypt.hashpw(password_bytes, salt)
-    return hashed.decode('utf-8')
+    """Hash a password using bcrypt (blocking: dùng trong route sync)"""
+    try:
+        return password_hasher.hash_blocking(password)
+    except PasswordHasherBusy:
+        raise _hasher_busy()
+
+
+async def verify_password_async(plain_password: str, hashed_password: str) -> bool:
+    """Verify a password against its hash without blocking the event loop"""
+    try:
+        return await password_hasher.verify(plain_password, hashed_password)
+    except PasswordHasherBusy:
+        raise _hasher_busy()
+
+
+async def get_password_hash_async(password: str) -> str:
+    """Hash a password using bcrypt without blocking the event loop"""
+    try:
+        return await password_hasher.hash(password)
+    except PasswordHasherBusy:
+        raise _hasher_busy()
 
 
 def create_access_token(data: dict, expires_delta: Optional[timedelta] = None) -> str:
@@ -55,11 +92,18 @@ def decode_access_token(token: str) -> dict:
         )
 
 
-def get_current_user(
+async def get_current_user(
     credentials: HTTPAuthorizationCredentials = Depends(security),
-    db: Session = Depends(get_db)
+    db: AsyncSession = Depends(get_async_db)
 ) -> User:
-    """Get the current authenticated user from the JWT token"""
+    """
+    Get the current authenticated user from the JWT token.
+
+    Async (asyncpg) nên không chặn event loop / không chiếm threadpool kể cả với
+    route sync. User trả về đã detach (có thể lấy từ principal_cache, dùng chung
+    giữa các request): chỉ đọc; route cần sửa User thì load lại bằng Session của
+    mình (xem routers/users.py).
+    """
     token = credentials.credentials
     payload = decode_access_token(token)
     
@@ -71,7 +115,22 @@ def get_current_user(
             headers={"WWW-Authenticate": "Bearer"},
         )
     
-    user = db.query(User).filter(User.id == user_id).first()
+    try:
+        user_uuid = UUID(str(user_id))
+    except ValueError:
+        raise HTTPException(
+            status_code=status.HTTP_401_UNAUTHORIZED,
+            detail="Could not validate credentials",
+            headers={"WWW-Authenticate": "Bearer"},
+        )
+
+    cached = principal_cache.get(str(user_uuid))
+    if cached is not None:
+        return cached
+
+    user = await db.get(User, user_uuid)
+    # Kết thúc transaction ngay → trả kết nối về pool trong lúc route chạy (LLM có thể mất vài giây)
+    await db.commit()
     if user is None:
         raise HTTPException(
             status_code=status.HTTP_401_UNAUTHORIZED,
@@ -79,4 +138,37 @@ def get_current_user(
             headers={"WWW-Authenticate": "Bearer"},
         )
     
+    db.expunge(user)
+    principal_cache.put(str(user_uuid), user)
     return user
+
+
+@dataclass(frozen=True)
+class TokenPrincipal:
+    """Principal dựng từ claim đã ký của JWT (không query DB) — chỉ có id."""
+    id: UUID
+
+
+async def get_current_principal(
+    credentials: HTTPAuthorizationCredentials = Depends(security),
+    db: AsyncSession = Depends(get_async_db)
+) -> Union[User, TokenPrincipal]:
+    """
+    Principal cho route chỉ đọc, chỉ cần current_user.id (mọi query đã lọc theo user_id).
+
+    AUTH_TRUST_TOKEN_CLAIMS=true: tin `sub` của token đã verify, bỏ hẳn lookup USER
+    (tài khoản vừa xoá vẫn đọc được tới khi token hết hạn — dữ liệu đã bị xoá theo).
+    Mặc định: như get_current_user.
+    """
+    if not settings.AUTH_TRUST_TOKEN_CLAIMS:
+        return await get_current_user(credentials, db)
+
+    payload = decode_access_token(credentials.credentials)
+    try:
+        return TokenPrincipal(id=UUID(str(payload.get("sub"))))
+    except ValueError:
+        raise HTTPException(
+            status_code=status.HTTP_401_UNAUTHORIZED,
+            detail="Could not validate credentials",
+            headers={"WWW-Authenticate": "Bearer"},
+        )
@@ -1,10 +1,17 @@
+import logging
 from contextlib import asynccontextmanager
 
 from fastapi import FastAPI
 from fastapi.middleware.cors import CORSMiddleware
+from fastapi.responses import PlainTextResponse
 
-from app.core.database import Base, engine
+from app.core.compression import CompressionMiddleware
+from app.core.database import Base, async_engine, engine
 from app.core.config import get_settings
+from app.core.logging_config import RequestIdMiddleware, configure_logging
+from app.core.metrics import CONTENT_TYPE_LATEST, render_text
+from app.core.request_metrics import RequestMetricsMiddleware
+from app.core.security import password_hasher
 from app.routers import (
     analysis,
     auth,
@@ -19,6 +26,8 @@ from app.routers import (
 )
 
 settings = get_settings()
+configure_logging(settings)
+logger = logging.getLogger(__name__)
 
 # Configure CORS origins dynamically
 def get_allowed_origins():
@@ -47,11 +56,13 @@ def get_allowed_origins():
 # Lifespan event handler (thay cho on_event startup)
 @asynccontextmanager
 async def lifespan(app: FastAPI):
-    print("📌 Creating tables on startup...")
-    print(f"🌐 Allowed CORS origins: {get_allowed_origins()}")
+    logger.info("Creating tables on startup...")
+    logger.info("Allowed CORS origins: %s", get_allowed_origins())
     Base.metadata.create_all(bind=engine)
     yield
-    print("🧹 Shutdown complete.")
+    await async_engine.dispose()
+    password_hasher.shutdown()
+    logger.info("Shutdown complete.")
 
 
 # FastAPI app
@@ -69,8 +80,25 @@ app.add_middleware(
     allow_credentials=True,
     allow_methods=["*"],
     allow_headers=["*"],
+    expose_headers=["X-Next-Cursor", "X-Request-ID"],
 )
 
+# Nén body lớn (kết quả phân tích, content_full); nằm trong metrics → latency tính cả thời gian nén
+if settings.RESPONSE_COMPRESSION_ENABLED:
+    app.add_middleware(
+        CompressionMiddleware,
+        minimum_size=settings.RESPONSE_COMPRESSION_MIN_SIZE,
+        gzip_level=settings.RESPONSE_GZIP_LEVEL,
+        brotli_quality=settings.RESPONSE_BROTLI_QUALITY,
+    )
+
+# Latency theo route + in-flight (ngoài cùng → tính cả CORS)
+if settings.METRICS_ENABLED:
+    app.add_middleware(RequestMetricsMiddleware)
+
+# Request id cho log (X-Request-ID), bọc ngoài cùng
+app.add_middleware(RequestIdMiddleware)
+
 # Routers
 app.include_router(auth.router, prefix="/api/auth", tags=["Authentication"])
 app.include_router(users.router, prefix="/api/users", tags=["Users"])
@@ -114,6 +142,14 @@ def health_check():
     return {"status": "healthy"}
 
 
+if settings.METRICS_ENABLED:
+
+    @app.get("/metrics", include_in_schema=False)
+    def metrics():
+        """Prometheus scrape endpoint (request, LLM, NLI, pool DB, bộ nhớ process...)"""
+        return PlainTextResponse(render_text(), media_type=CONTENT_TYPE_LATEST)
+
+
 # Optional: local dev mode
 if __name__ == "__main__":
     import uvicorn
@@ -1,7 +1,7 @@
 """
 SQLAlchemy models package
 """
-from app.models.user import User
+from app.models.user import User, UserStats
 from app.models.goal import Goal, WritingType, RubricCriterion, CriterionCoverage
 from app.models.document import Document, DocumentSection, Paragraph, Sentence
 from app.models.analysis import AnalysisRun, WritingSession
@@ -10,6 +10,7 @@ from app.models.feedback import Feedback, UserErrorPattern
 
 __all__ = [
     "User",
+    "UserStats",
     "Goal",
     "WritingType",
     "RubricCriterion",
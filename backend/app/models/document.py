@@ -30,6 +30,7 @@ class Document(Base):
     goal_id = Column(UUID(as_uuid=True), ForeignKey("GOAL.id", ondelete="SET NULL"))
     title = Column(Text, nullable=False, default='Untitled')
     content_full = Column(Text, nullable=False, default='')
+    content_hash = Column(Text)  # sha256 of content_full, used to skip no-op saves
     structure_json = Column(JSONB, nullable=False, server_default='{}')
     version = Column(Integer, nullable=False, default=1)
     word_count = Column(Integer, nullable=False, default=0)
@@ -37,7 +38,7 @@ class Document(Base):
     updated_at = Column(DateTime(timezone=True), server_default=func.now(), onupdate=func.now(), nullable=False)
 
     __table_args__ = (
-        Index('ix_document_user_updated', 'user_id', 'updated_at'),
+        Index('ix_document_user_updated', 'user_id', 'updated_at', 'id'),  # keyset pagination
     )
 
     # Relationships
@@ -81,6 +82,7 @@ class Paragraph(Base):
     emb = Column(ARRAY(REAL))  # pgvector compatible
     word_count = Column(Integer, nullable=False, default=0)
     last_analyzed_version = Column(Integer)
+    changed_version = Column(Integer)  # Document.version lúc nội dung đoạn đổi lần cuối (delta fetch)
     updated_at = Column(DateTime(timezone=True), server_default=func.now(), onupdate=func.now(), nullable=False)
 
     __table_args__ = (
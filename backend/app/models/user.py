@@ -1,4 +1,4 @@
-from sqlalchemy import Column, Text, DateTime
+from sqlalchemy import BigInteger, Column, DateTime, ForeignKey, Integer, Text
 from sqlalchemy.dialects.postgresql import UUID
 from sqlalchemy.sql import func
 from sqlalchemy.orm import relationship
@@ -19,3 +19,17 @@ class User(Base):
     goals = relationship("Goal", back_populates="user", cascade="all, delete-orphan")
     writing_sessions = relationship("WritingSession", back_populates="user", cascade="all, delete-orphan")
     error_patterns = relationship("UserErrorPattern", back_populates="user", cascade="all, delete-orphan")
+
+
+class UserStats(Base):
+    """Rollup thống kê cho GET /api/users/me; trigger DB cập nhật theo DOCUMENT / WRITING_SESSION
+    (xem app/services/user_stats.py)."""
+    __tablename__ = "USER_STATS"
+
+    user_id = Column(UUID(as_uuid=True), ForeignKey("USER.id", ondelete="CASCADE"), primary_key=True)
+    total_documents = Column(Integer, nullable=False, default=0, server_default="0")
+    total_words = Column(BigInteger, nullable=False, default=0, server_default="0")
+    total_errors_found = Column(BigInteger, nullable=False, default=0, server_default="0")
+    total_errors_fixed = Column(BigInteger, nullable=False, default=0, server_default="0")
+    active_time_seconds = Column(BigInteger, nullable=False, default=0, server_default="0")
+    updated_at = Column(DateTime(timezone=True), server_default=func.now(), nullable=False)
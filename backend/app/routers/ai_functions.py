@@ -1,8 +1,9 @@
-from typing import Any, Dict, Optional
+from typing import Any, Dict, List, Optional
 
 from fastapi import APIRouter, Depends, HTTPException, status
 from pydantic import BaseModel, Field
 
+from app.core.responses import FastJSONResponse
 from app.core.security import get_current_user
 from app.models.user import User
 from app.services.ai_analysis_service import ai_analysis_service
@@ -12,6 +13,12 @@ router = APIRouter(
     tags=["AI Functions"],
 )
 
+# function_name → subtask duy nhất cần phân tích
+SINGLE_SUBTASK_FUNCTIONS = {
+    "logicguard.unsupported_claims_only": ["unsupported_claims"],
+    "logicguard.undefined_terms_only": ["undefined_terms"],
+}
+
 
 # ======================
 # 📦 1. SCHEMAS
@@ -41,6 +48,13 @@ class RunAIFunctionRequest(BaseModel):
         default="fast",
         description="Flag log lại. Hiện tại luôn dùng Gemini 2.5 (model trong .env GEMINI_MODEL).",
     )
+    subtasks: Optional[List[str]] = Field(
+        default=None,
+        description=(
+            "Tập con của contradictions | undefined_terms | unsupported_claims | "
+            "logical_jumps | spelling_errors. Bỏ trống = cả 5."
+        ),
+    )
 
 
 class RunAIFunctionResponse(BaseModel):
@@ -57,6 +71,7 @@ class RunAIFunctionResponse(BaseModel):
 @router.post(
     "/run",
     response_model=RunAIFunctionResponse,
+    response_class=FastJSONResponse,
     status_code=status.HTTP_200_OK,
 )
 async def run_ai_function(
@@ -66,33 +81,32 @@ async def run_ai_function(
     """
     Gateway duy nhất cho FE gọi các "AI Functions" liên quan đến phân tích logic.
 
-    Giai đoạn 1:
-    - Hỗ trợ function_name:
-        + "logicguard.unified_analysis"
+    Hỗ trợ function_name:
+        + "logicguard.unified_analysis" (payload.subtasks để chọn tập con)
         + "logicguard.analyze_full" (alias của unified_analysis)
-
-    Sau này có thể mở rộng thêm:
         + "logicguard.unsupported_claims_only"
         + "logicguard.undefined_terms_only"
-        + ...
     """
 
     fn = payload.function_name.strip()
 
-    # ===== 1) Unified analysis (5 subtasks) =====
-    if fn in ("logicguard.unified_analysis", "logicguard.analyze_full"):
+    # ===== 1) Unified analysis (mặc định 5 subtasks) =====
+    if fn in ("logicguard.unified_analysis", "logicguard.analyze_full") or fn in SINGLE_SUBTASK_FUNCTIONS:
         result = await ai_analysis_service.analyze_unified(
             content=payload.content,
             context=payload.context,
             language=payload.language,
             mode=payload.mode or "fast",
+            subtasks=SINGLE_SUBTASK_FUNCTIONS.get(fn, payload.subtasks),
+            user_key=str(current_user.id),
         )
 
-        return RunAIFunctionResponse(
-            success=bool(result.get("success", False)),
-            function_name=fn,
-            data=result,
-        )
+        # data là dict tự do → trả thẳng, không validate / jsonable_encoder lại cả kết quả
+        return FastJSONResponse({
+            "success": bool(result.get("success", False)),
+            "function_name": fn,
+            "data": result,
+        })
 
     # ===== 2) Function name không support =====
     raise HTTPException(
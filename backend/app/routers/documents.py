@@ -1,37 +1,198 @@
-from fastapi import APIRouter, Depends, HTTPException, status
-from sqlalchemy.orm import Session
-from typing import List
+import base64
+import json
+from datetime import datetime
+from fastapi import APIRouter, Depends, HTTPException, Query, Request, Response, status
+from sqlalchemy import Select, func, or_, select, tuple_, update
+from sqlalchemy.ext.asyncio import AsyncSession
+from typing import List, Optional, Sequence, Tuple
 from uuid import UUID
-from app.core.database import get_db
-from app.core.security import get_current_user
+from app.core.database import get_async_db
+from app.core.security import get_current_principal, get_current_user
 from app.models.user import User
 from app.models.document import Document, DocumentSection, Paragraph, Sentence
 from app.schemas.document import (
     DocumentCreate, DocumentUpdate, DocumentResponse, DocumentListResponse,
     SectionResponse, SectionUpdateStatus,
-    ParagraphResponse, ParagraphUpdate,
+    ParagraphResponse, ParagraphUpdate, ParagraphDeltaResponse,
     SentenceResponse
 )
 from app.services.document_sync import DocumentCanvasSyncService
 
 router = APIRouter()
 
+# Cột cho phép trong list (?fields=); content_full / structure_json không bao giờ load ở đây
+LIST_FIELDS = ("id", "title", "word_count", "version", "goal_id", "created_at", "updated_at")
+DEFAULT_LIST_FIELDS = ("id", "title", "word_count", "created_at", "updated_at")
+NEXT_CURSOR_HEADER = "X-Next-Cursor"
+DEFAULT_PAGE_SIZE = 50
+MAX_PAGE_SIZE = 200
 
-@router.get("/", response_model=List[DocumentListResponse])
-def list_documents(
-    current_user: User = Depends(get_current_user),
-    db: Session = Depends(get_db)
+
+def encode_cursor(updated_at: datetime, document_id: UUID) -> str:
+    raw = json.dumps([updated_at.isoformat(), str(document_id)]).encode()
+    return base64.urlsafe_b64encode(raw).decode().rstrip("=")
+
+
+def decode_cursor(cursor: str) -> Tuple[datetime, UUID]:
+    try:
+        raw = base64.urlsafe_b64decode(cursor + "=" * (-len(cursor) % 4))
+        updated_at, document_id = json.loads(raw)
+        return datetime.fromisoformat(updated_at), UUID(document_id)
+    except (ValueError, TypeError):
+        raise HTTPException(
+            status_code=status.HTTP_400_BAD_REQUEST,
+            detail="Invalid cursor"
+        )
+
+
+def parse_list_fields(fields: Optional[str]) -> Sequence[str]:
+    if not fields:
+        return DEFAULT_LIST_FIELDS
+    requested = [name.strip() for name in fields.split(",") if name.strip()]
+    unknown = sorted(set(requested) - set(LIST_FIELDS))
+    if unknown:
+        raise HTTPException(
+            status_code=status.HTTP_400_BAD_REQUEST,
+            detail=f"Unknown fields: {', '.join(unknown)} (allowed: {', '.join(LIST_FIELDS)})"
+        )
+    return tuple(name for name in LIST_FIELDS if name == "id" or name in requested)
+
+
+def document_list_statement(
+    user_id: UUID,
+    fields: Sequence[str],
+    limit: Optional[int],
+    after: Optional[Tuple[datetime, UUID]] = None,
+) -> Select:
+    """
+    Keyset pagination trên (updated_at, id) giảm dần — dùng index
+    ix_document_user_updated (user_id, updated_at, id): chi phí mỗi trang không
+    phụ thuộc số document của user (khác OFFSET). Lấy limit + 1 dòng để biết còn trang sau;
+    limit=None → không LIMIT (toàn bộ danh sách).
+    """
+    columns = {name: getattr(Document, name) for name in fields}
+    columns.setdefault("updated_at", Document.updated_at)  # cần cho cursor
+    statement = select(*columns.values()).where(Document.user_id == user_id)
+    if after is not None:
+        statement = statement.where(tuple_(Document.updated_at, Document.id) < tuple_(*after))
+    statement = statement.order_by(Document.updated_at.desc(), Document.id.desc())
+    return statement if limit is None else statement.limit(limit + 1)
+
+
+# ====== CONDITIONAL GET (ETag / If-None-Match) ======
+# Client luôn revalidate (no-cache); không đổi → 304 rỗng, không load / serialize
+# content_full hay HTML từng đoạn.
+CACHE_CONTROL = "private, no-cache"
+
+
+def _timestamp_us(value: Optional[datetime]) -> int:
+    return int(value.timestamp() * 1_000_000) if value else 0
+
+
+def document_etag(version: int, updated_at: Optional[datetime]) -> str:
+    """Strong ETag: version (nội dung) + updated_at (title / goal đổi không tăng version)."""
+    return f'"d{version}-{_timestamp_us(updated_at)}"'
+
+
+def paragraphs_etag(version: int, count: int, last_updated: Optional[datetime]) -> str:
+    """Sync / PUT paragraph đều tăng version hoặc updated_at của đoạn → đổi ETag."""
+    return f'"p{version}-{count}-{_timestamp_us(last_updated)}"'
+
+
+def _matches_if_none_match(request: Request, etag: str) -> bool:
+    header = request.headers.get("if-none-match")
+    if not header:
+        return False
+    candidates = {candidate.strip() for candidate in header.split(",")}
+    return "*" in candidates or etag in candidates or f"W/{etag}" in candidates
+
+
+def _not_modified(etag: str) -> Response:
+    return Response(status_code=status.HTTP_304_NOT_MODIFIED, headers={"ETag": etag, "Cache-Control": CACHE_CONTROL})
+
+
+def _set_etag(response: Response, etag: str) -> None:
+    response.headers["ETag"] = etag
+    response.headers["Cache-Control"] = CACHE_CONTROL
+
+
+async def _ensure_document_owner(db: AsyncSession, document_id: UUID, user_id: UUID) -> None:
+    """Kiểm tra quyền sở hữu chỉ bằng cột id (không load content_full / structure_json)."""
+    result = await db.execute(
+        select(Document.id).where(Document.id == document_id, Document.user_id == user_id)
+    )
+    if result.first() is None:
+        raise HTTPException(
+            status_code=status.HTTP_404_NOT_FOUND,
+            detail="Document not found"
+        )
+
+
+async def _get_owned_document(db: AsyncSession, document_id: UUID, user_id: UUID) -> Document:
+    result = await db.execute(
+        select(Document).where(Document.id == document_id, Document.user_id == user_id)
+    )
+    document = result.scalar_one_or_none()
+    if not document:
+        raise HTTPException(
+            status_code=status.HTTP_404_NOT_FOUND,
+            detail="Document not found"
+        )
+    return document
+
+
+async def _get_owned_paragraph(db: AsyncSession, paragraph_id: UUID, user_id: UUID) -> Paragraph:
+    result = await db.execute(
+        select(Paragraph).join(Document).where(
+            Paragraph.id == paragraph_id,
+            Document.user_id == user_id
+        )
+    )
+    paragraph = result.scalar_one_or_none()
+    if not paragraph:
+        raise HTTPException(
+            status_code=status.HTTP_404_NOT_FOUND,
+            detail="Paragraph not found"
+        )
+    return paragraph
+
+
+@router.get("/", response_model=List[DocumentListResponse], response_model_exclude_unset=True)
+async def list_documents(
+    response: Response,
+    limit: Optional[int] = Query(None, ge=1, le=MAX_PAGE_SIZE, description="Bật phân trang; bỏ trống → toàn bộ danh sách"),
+    cursor: Optional[str] = Query(None, description=f"Giá trị header {NEXT_CURSOR_HEADER} của trang trước"),
+    fields: Optional[str] = Query(None, description=f"Cột trả về, phân tách bằng dấu phẩy: {', '.join(LIST_FIELDS)}"),
+    current_user: User = Depends(get_current_principal),
+    db: AsyncSession = Depends(get_async_db)
 ):
-    """Get all documents for the current user"""
-    documents = db.query(Document).filter(Document.user_id == current_user.id).all()
-    return documents
+    """
+    Get the current user's documents, most recently updated first.
+
+    Không có `limit` / `cursor` → toàn bộ document (như trước khi có phân trang).
+    Có `limit` (hoặc `cursor`, mặc định DEFAULT_PAGE_SIZE) → trả tối đa `limit`
+    document; nếu còn trang sau, header X-Next-Cursor chứa cursor cho request
+    tiếp theo (?cursor=...).
+    """
+    selected = parse_list_fields(fields)
+    after = decode_cursor(cursor) if cursor else None
+    if limit is None and after is not None:
+        limit = DEFAULT_PAGE_SIZE
+    result = await db.execute(document_list_statement(current_user.id, selected, limit, after))
+    rows = [row._mapping for row in result.all()]
+
+    if limit is not None and len(rows) > limit:
+        rows = rows[:limit]
+        response.headers[NEXT_CURSOR_HEADER] = encode_cursor(rows[-1]["updated_at"], rows[-1]["id"])
+    return [{name: row[name] for name in selected} for row in rows]
 
 
 @router.post("/", response_model=DocumentResponse, status_code=status.HTTP_201_CREATED)
-def create_document(
+async def create_document(
     document_data: DocumentCreate,
+    response: Response,
     current_user: User = Depends(get_current_user),
-    db: Session = Depends(get_db)
+    db: AsyncSession = Depends(get_async_db)
 ):
     """Create a new document"""
     new_document = Document(
@@ -41,145 +202,135 @@ def create_document(
         goal_id=document_data.goal_id,
     )
     db.add(new_document)
-    db.flush()
-
-    DocumentCanvasSyncService(db).sync(new_document, document_data.content_full)
+    # Canvas sync dùng Session sync (parse HTML + flush nhiều bảng) → chạy qua run_sync
+    await db.run_sync(
+        lambda session: DocumentCanvasSyncService(session).sync(new_document, document_data.content_full)
+    )
 
-    db.commit()
-    db.refresh(new_document)
+    await db.commit()
+    await db.refresh(new_document)
+    _set_etag(response, document_etag(new_document.version, new_document.updated_at))
     return new_document
 
 
 @router.get("/{document_id}", response_model=DocumentResponse)
-def get_document(
+async def get_document(
     document_id: UUID,
-    current_user: User = Depends(get_current_user),
-    db: Session = Depends(get_db)
+    request: Request,
+    response: Response,
+    current_user: User = Depends(get_current_principal),
+    db: AsyncSession = Depends(get_async_db)
 ):
-    """Get a specific document"""
-    document = db.query(Document).filter(
-        Document.id == document_id,
-        Document.user_id == current_user.id
-    ).first()
-    
-    if not document:
-        raise HTTPException(
-            status_code=status.HTTP_404_NOT_FOUND,
-            detail="Document not found"
-        )
-    
+    """Get a specific document (ETag; If-None-Match khớp → 304)"""
+    if request.headers.get("if-none-match"):
+        # Chỉ đọc version + updated_at để so ETag, chưa load content_full
+        row = (
+            await db.execute(
+                select(Document.version, Document.updated_at).where(
+                    Document.id == document_id,
+                    Document.user_id == current_user.id
+                )
+            )
+        ).first()
+        if row is None:
+            raise HTTPException(
+                status_code=status.HTTP_404_NOT_FOUND,
+                detail="Document not found"
+            )
+        etag = document_etag(row.version, row.updated_at)
+        if _matches_if_none_match(request, etag):
+            return _not_modified(etag)
+
+    document = await _get_owned_document(db, document_id, current_user.id)
+    _set_etag(response, document_etag(document.version, document.updated_at))
     return document
 
 
 @router.put("/{document_id}", response_model=DocumentResponse)
-def update_document(
+async def update_document(
     document_id: UUID,
     document_data: DocumentUpdate,
+    response: Response,
     current_user: User = Depends(get_current_user),
-    db: Session = Depends(get_db)
+    db: AsyncSession = Depends(get_async_db)
 ):
     """Update a document"""
-    document = db.query(Document).filter(
-        Document.id == document_id,
-        Document.user_id == current_user.id
-    ).first()
-    
-    if not document:
-        raise HTTPException(
-            status_code=status.HTTP_404_NOT_FOUND,
-            detail="Document not found"
-        )
+    document = await _get_owned_document(db, document_id, current_user.id)
     
     # Update fields
     if document_data.title is not None:
         document.title = document_data.title
     if document_data.content_full is not None:
-        document.content_full = document_data.content_full
-        document.version += 1
-        DocumentCanvasSyncService(db).sync(document, document.content_full)
+        # Autosave often resends identical content: skip version bump + structure sync
+        def _sync_content(session):
+            sync_service = DocumentCanvasSyncService(session)
+            if not sync_service.is_unchanged(document, document_data.content_full):
+                document.content_full = document_data.content_full
+                document.version += 1
+                sync_service.sync(document, document.content_full)
+
+        await db.run_sync(_sync_content)
     if document_data.goal_id is not None:
         document.goal_id = document_data.goal_id
     
-    db.commit()
-    db.refresh(document)
+    await db.commit()
+    await db.refresh(document)
+    _set_etag(response, document_etag(document.version, document.updated_at))
     return document
 
 
 @router.delete("/{document_id}", status_code=status.HTTP_204_NO_CONTENT)
-def delete_document(
+async def delete_document(
     document_id: UUID,
     current_user: User = Depends(get_current_user),
-    db: Session = Depends(get_db)
+    db: AsyncSession = Depends(get_async_db)
 ):
     """Delete a document"""
-    document = db.query(Document).filter(
-        Document.id == document_id,
-        Document.user_id == current_user.id
-    ).first()
+    document = await _get_owned_document(db, document_id, current_user.id)
     
-    if not document:
-        raise HTTPException(
-            status_code=status.HTTP_404_NOT_FOUND,
-            detail="Document not found"
-        )
-    
-    db.delete(document)
-    db.commit()
+    await db.delete(document)
+    await db.commit()
     return None
 
 
 # Section endpoints
 @router.get("/{document_id}/sections", response_model=List[SectionResponse])
-def list_document_sections(
+async def list_document_sections(
     document_id: UUID,
-    current_user: User = Depends(get_current_user),
-    db: Session = Depends(get_db)
+    current_user: User = Depends(get_current_principal),
+    db: AsyncSession = Depends(get_async_db)
 ):
     """Retrieve sections and completion state for a document"""
     # Verify document ownership
-    document = db.query(Document).filter(
-        Document.id == document_id,
-        Document.user_id == current_user.id
-    ).first()
-    
-    if not document:
-        raise HTTPException(
-            status_code=status.HTTP_404_NOT_FOUND,
-            detail="Document not found"
-        )
+    await _ensure_document_owner(db, document_id, current_user.id)
     
-    sections = db.query(DocumentSection).filter(
-        DocumentSection.document_id == document_id
-    ).order_by(DocumentSection.order_index).all()
-    
-    return sections
+    result = await db.execute(
+        select(DocumentSection).where(
+            DocumentSection.document_id == document_id
+        ).order_by(DocumentSection.order_index)
+    )
+    return result.scalars().all()
 
 
 @router.put("/{document_id}/sections/{section_id}", response_model=SectionResponse)
-def update_section_status(
+async def update_section_status(
     document_id: UUID,
     section_id: UUID,
     section_data: SectionUpdateStatus,
     current_user: User = Depends(get_current_user),
-    db: Session = Depends(get_db)
+    db: AsyncSession = Depends(get_async_db)
 ):
     """Mark section as complete/incomplete"""
     # Verify document ownership
-    document = db.query(Document).filter(
-        Document.id == document_id,
-        Document.user_id == current_user.id
-    ).first()
+    await _ensure_document_owner(db, document_id, current_user.id)
     
-    if not document:
-        raise HTTPException(
-            status_code=status.HTTP_404_NOT_FOUND,
-            detail="Document not found"
+    result = await db.execute(
+        select(DocumentSection).where(
+            DocumentSection.id == section_id,
+            DocumentSection.document_id == document_id
         )
-    
-    section = db.query(DocumentSection).filter(
-        DocumentSection.id == section_id,
-        DocumentSection.document_id == document_id
-    ).first()
+    )
+    section = result.scalar_one_or_none()
     
     if not section:
         raise HTTPException(
@@ -188,56 +339,109 @@ def update_section_status(
         )
     
     section.is_complete = section_data.is_complete
-    db.commit()
-    db.refresh(section)
+    await db.commit()
+    await db.refresh(section)
     return section
 
 
 # Paragraph endpoints
 @router.get("/{document_id}/paragraphs", response_model=List[ParagraphResponse])
-def get_document_paragraphs(
+async def get_document_paragraphs(
     document_id: UUID,
-    current_user: User = Depends(get_current_user),
-    db: Session = Depends(get_db)
+    request: Request,
+    response: Response,
+    current_user: User = Depends(get_current_principal),
+    db: AsyncSession = Depends(get_async_db)
 ):
-    """Retrieve structured paragraphs with text and roles"""
-    # Verify document ownership
-    document = db.query(Document).filter(
-        Document.id == document_id,
-        Document.user_id == current_user.id
+    """Retrieve structured paragraphs with text and roles (ETag; If-None-Match khớp → 304)"""
+    # Verify document ownership + ETag trong 1 query (không đọc text của đoạn)
+    stats = (
+        await db.execute(
+            select(Document.version, func.count(Paragraph.id), func.max(Paragraph.updated_at))
+            .outerjoin(Paragraph, Paragraph.document_id == Document.id)
+            .where(Document.id == document_id, Document.user_id == current_user.id)
+            .group_by(Document.id, Document.version)
+        )
     ).first()
-    
-    if not document:
+    if stats is None:
         raise HTTPException(
             status_code=status.HTTP_404_NOT_FOUND,
             detail="Document not found"
         )
+    etag = paragraphs_etag(*stats)
+    if _matches_if_none_match(request, etag):
+        return _not_modified(etag)
     
-    paragraphs = db.query(Paragraph).filter(
-        Paragraph.document_id == document_id
-    ).order_by(Paragraph.p_index).all()
-    
-    return paragraphs
+    result = await db.execute(
+        select(Paragraph).where(
+            Paragraph.document_id == document_id
+        ).order_by(Paragraph.p_index)
+    )
+    _set_etag(response, etag)
+    return result.scalars().all()
+
+
+@router.get("/{document_id}/paragraphs/delta", response_model=ParagraphDeltaResponse)
+async def get_document_paragraph_delta(
+    document_id: UUID,
+    since_version: int = Query(..., ge=0, description="Document.version client đang có"),
+    current_user: User = Depends(get_current_principal),
+    db: AsyncSession = Depends(get_async_db)
+):
+    """
+    Chỉ trả các đoạn có nội dung đổi sau `since_version` (Paragraph.changed_version).
+
+    paragraph_ids: id mọi đoạn theo thứ tự hiện tại (id đổi sau mỗi lần sync) →
+    client giữ nội dung cũ cho đoạn không nằm trong `changed`, cắt bớt đoạn thừa.
+    """
+    version = (
+        await db.execute(
+            select(Document.version).where(
+                Document.id == document_id,
+                Document.user_id == current_user.id
+            )
+        )
+    ).scalar_one_or_none()
+    if version is None:
+        raise HTTPException(
+            status_code=status.HTTP_404_NOT_FOUND,
+            detail="Document not found"
+        )
+
+    paragraph_ids = (
+        await db.execute(
+            select(Paragraph.id).where(Paragraph.document_id == document_id).order_by(Paragraph.p_index)
+        )
+    ).scalars().all()
+    changed = []
+    if since_version < version:
+        changed = (
+            await db.execute(
+                select(Paragraph).where(
+                    Paragraph.document_id == document_id,
+                    # changed_version NULL: đoạn tạo trước khi có cột → coi như đã đổi
+                    or_(Paragraph.changed_version.is_(None), Paragraph.changed_version > since_version)
+                ).order_by(Paragraph.p_index)
+            )
+        ).scalars().all()
+    return {
+        "document_id": document_id,
+        "version": version,
+        "since_version": since_version,
+        "paragraph_ids": paragraph_ids,
+        "changed": changed,
+    }
 
 
 @router.put("/paragraphs/{paragraph_id}", response_model=ParagraphResponse)
-def update_paragraph(
+async def update_paragraph(
     paragraph_id: UUID,
     paragraph_data: ParagraphUpdate,
     current_user: User = Depends(get_current_user),
-    db: Session = Depends(get_db)
+    db: AsyncSession = Depends(get_async_db)
 ):
     """Update paragraph text, embedding, or structure"""
-    paragraph = db.query(Paragraph).join(Document).filter(
-        Paragraph.id == paragraph_id,
-        Document.user_id == current_user.id
-    ).first()
-    
-    if not paragraph:
-        raise HTTPException(
-            status_code=status.HTTP_404_NOT_FOUND,
-            detail="Paragraph not found"
-        )
+    paragraph = await _get_owned_paragraph(db, paragraph_id, current_user.id)
     
     # Update fields
     if paragraph_data.text is not None:
@@ -245,36 +449,38 @@ def update_paragraph(
         paragraph.word_count = len(paragraph_data.text.split())
         import hashlib
         paragraph.hash = hashlib.md5(paragraph_data.text.encode()).hexdigest()
+        # Nội dung đổi → tăng Document.version để ETag / delta fetch thấy thay đổi;
+        # content_hash = None: content_full giờ lệch với đoạn → lần save document kế tiếp phải sync lại
+        paragraph.changed_version = (
+            await db.execute(
+                update(Document)
+                .where(Document.id == paragraph.document_id)
+                .values(version=Document.version + 1, content_hash=None)
+                .returning(Document.version)
+            )
+        ).scalar_one()
     if paragraph_data.emb is not None:
         paragraph.emb = paragraph_data.emb
     
-    db.commit()
-    db.refresh(paragraph)
+    await db.commit()
+    await db.refresh(paragraph)
     return paragraph
 
 
 # Sentence endpoints
 @router.get("/paragraphs/{paragraph_id}/sentences", response_model=List[SentenceResponse])
-def get_paragraph_sentences(
+async def get_paragraph_sentences(
     paragraph_id: UUID,
-    current_user: User = Depends(get_current_user),
-    db: Session = Depends(get_db)
+    current_user: User = Depends(get_current_principal),
+    db: AsyncSession = Depends(get_async_db)
 ):
     """Fetch sentences for paragraph-level analysis"""
     # Verify paragraph ownership through document
-    paragraph = db.query(Paragraph).join(Document).filter(
-        Paragraph.id == paragraph_id,
-        Document.user_id == current_user.id
-    ).first()
+    paragraph = await _get_owned_paragraph(db, paragraph_id, current_user.id)
     
-    if not paragraph:
-        raise HTTPException(
-            status_code=status.HTTP_404_NOT_FOUND,
-            detail="Paragraph not found"
-        )
-    
-    sentences = db.query(Sentence).filter(
-        Sentence.paragraph_id == paragraph_id
-    ).order_by(Sentence.s_index).all()
-    
-    return sentences
+    result = await db.execute(
+        select(Sentence).where(
+            Sentence.paragraph_id == paragraph_id
+        ).order_by(Sentence.s_index)
+    )
+    return result.scalars().all()
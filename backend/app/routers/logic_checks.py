@@ -1,8 +1,17 @@
+import logging
 from typing import Any, Dict, Optional, List
+from uuid import UUID
 
 from fastapi import APIRouter, Depends, HTTPException, status
+from fastapi.concurrency import run_in_threadpool
+from pydantic import TypeAdapter, ValidationError
+from sqlalchemy import select
+from sqlalchemy.ext.asyncio import AsyncSession
 
+from app.core.database import get_async_db
+from app.core.responses import FastJSONResponse
 from app.core.security import get_current_user
+from app.models.document import Document, Paragraph, Sentence
 from app.models.user import User
 from app.schemas.logic_checks import (
     ContradictionCheckRequest,
@@ -16,6 +25,11 @@ from app.ai.models.contradictions import check_contradictions
 from app.ai.models.Analysis import analyze_document
 
 router = APIRouter(prefix="/logic-checks", tags=["Logic Checks"])
+logger = logging.getLogger(__name__)
+
+# Subtask mà từng endpoint thật sự trả về → prompt / schema / cache chỉ cho phần đó
+UNSUPPORTED_CLAIMS_SUBTASKS = ("unsupported_claims",)
+LOGIC_ISSUE_SUBTASKS = ("undefined_terms", "unsupported_claims", "logical_jumps", "contradictions")
 
 
 def _wrap_analysis_call(func, *args, error_message: str, **kwargs):
@@ -69,7 +83,28 @@ def _build_context_dict(raw_context: Any, fallback_main_goal: str = "") -> Dict[
         "constraints": [],
     }
 
-@router.post("/analyze")
+_BOOL = TypeAdapter(bool)
+
+
+def _parse_include_content(value: Any) -> bool:
+    """Payload /analyze là dict thô: parse giống field bool của pydantic ("false" / "0" / 0 → False)."""
+    try:
+        return _BOOL.validate_python(value)
+    except ValidationError:
+        raise HTTPException(
+            status_code=status.HTTP_422_UNPROCESSABLE_ENTITY,
+            detail="include_content must be a boolean"
+        )
+
+
+def _echo_fields(include_content: bool, content: Any, context_dict: Dict[str, Any]) -> Dict[str, Any]:
+    """content / context gửi lên được trả lại nguyên văn; FE đã có sẵn thì bỏ để nhẹ payload."""
+    if not include_content:
+        return {}
+    return {"content": content, "context": context_dict}
+
+
+@router.post("/analyze", response_class=FastJSONResponse)
 def analyze_unified(
     payload: Dict[str, Any],
     current_user: User = Depends(get_current_user),
@@ -79,12 +114,16 @@ def analyze_unified(
     POST /api/logic-checks/analyze
 
     Gọi analyze_document() 1 lần và trả về đúng format FE mong muốn.
+    payload.subtasks (tuỳ chọn) giới hạn các block cần phân tích;
+    payload.include_content=false → không echo content / context.
     """
 
     content = payload.get("content") or ""
     raw_context = payload.get("context") or {}
     language = payload.get("language") or "vi"
     mode = payload.get("mode") or "fast"
+    subtasks = payload.get("subtasks") or None
+    include_content = _parse_include_content(payload.get("include_content", True))
 
     context_dict = _build_context_dict(
         raw_context,
@@ -97,28 +136,27 @@ def analyze_unified(
             content=content,
             language=language,
             mode=mode,
+            subtasks=subtasks,
+            user_key=str(current_user.id),
         )
     except Exception as exc:
-        import traceback
-        traceback.print_exc()
+        logger.exception("analyze_document crashed in /analyze")
 
-        return {
+        return FastJSONResponse({
             "success": False,
-            "content": content,
-            "context": context_dict,
+            **_echo_fields(include_content, content, context_dict),
             "contradictions": {"items": []},
             "undefined_terms": {"items": []},
             "unsupported_claims": {"items": []},
             "logical_jumps": {"items": []},
             "spelling_errors": {"items": []},
             "metadata": {"error": str(exc)},
-        }
+        })
 
-    # Build unified structure FE expects:
-    return {
+    # Build unified structure FE expects (trả thẳng Response → bỏ qua jsonable_encoder):
+    return FastJSONResponse({
         "success": True,
-        "content": content,
-        "context": context_dict,
+        **_echo_fields(include_content, content, context_dict),
         "contradictions": full_result.get("contradictions") or {"items": []},
         "undefined_terms": full_result.get("undefined_terms") or {"items": []},
         "unsupported_claims": full_result.get("unsupported_claims") or {"items": []},
@@ -126,9 +164,14 @@ def analyze_unified(
         "spelling_errors": full_result.get("spelling_errors") or {"items": []},
         "summary": full_result.get("summary") or {},
         "metadata": full_result.get("metadata") or {},
-    }
+    })
 
-@router.post("/unsupported-claims", response_model=UnsupportedClaimsResponse)
+@router.post(
+    "/unsupported-claims",
+    response_model=UnsupportedClaimsResponse,
+    response_model_exclude_unset=True,  # include_content=false → không có key content / context
+    response_class=FastJSONResponse,
+)
 def analyze_unsupported_claims(
     payload: UnsupportedClaimsRequest,
     current_user: User = Depends(get_current_user),
@@ -152,6 +195,8 @@ def analyze_unsupported_claims(
         payload.content,
         language=language,
         mode=analysis_mode,
+        subtasks=UNSUPPORTED_CLAIMS_SUBTASKS,
+        user_key=str(current_user.id),
         error_message="Unsupported claims analysis failed",
     )
 
@@ -201,8 +246,7 @@ def analyze_unsupported_claims(
 
     return {
         "success": True,
-        "content": payload.content,
-        "context": context_dict,
+        **_echo_fields(payload.include_content, payload.content, context_dict),
         "total_claims_found": total_claims_found,
         "total_unsupported": total_unsupported,
         "unsupported_claims": unsupported_list,
@@ -211,7 +255,7 @@ def analyze_unsupported_claims(
     }
 
 
-@router.post("/undefined-terms")
+@router.post("/undefined-terms", response_class=FastJSONResponse)
 def analyze_undefined_terms(
     payload: UndefinedTermsRequest,
     current_user: User = Depends(get_current_user),
@@ -223,9 +267,6 @@ def analyze_undefined_terms(
       logical_jumps, contradictions) vào 1 list `issues` cho frontend.
     """
 
-    print("=== [logic-checks] /undefined-terms called ===")
-    print("Content length:", len(payload.content or ""))
-
     context_dict = _build_context_dict(
         payload.context,
         fallback_main_goal=(
@@ -234,10 +275,11 @@ def analyze_undefined_terms(
         ),
     )
     language = _detect_language(payload.content, payload.context)
-    print("Detected language:", language)
-
     analysis_mode = getattr(payload, "mode", None) or "fast"
-    print("Analysis mode:", analysis_mode)
+    logger.info(
+        "/undefined-terms called",
+        extra={"content_length": len(payload.content or ""), "language": language, "mode": analysis_mode},
+    )
 
     # 👉 Không dùng _wrap_analysis_call cho endpoint unified
     try:
@@ -246,18 +288,16 @@ def analyze_undefined_terms(
             payload.content,
             language=language,
             mode=analysis_mode,
+            subtasks=LOGIC_ISSUE_SUBTASKS,
+            user_key=str(current_user.id),
         )
     except Exception as exc:
         # Nếu Gemini/phân tích lỗi nặng → log + trả về success=False nhưng vẫn 200
-        import traceback
+        logger.exception("analyze_document crashed in /undefined-terms")
 
-        print("❌ analyze_document crashed in /undefined-terms:", repr(exc))
-        traceback.print_exc()
-
-        return {
+        return FastJSONResponse({
             "success": False,
-            "content": payload.content,
-            "context": context_dict,
+            **_echo_fields(payload.include_content, payload.content, context_dict),
             "total_terms_found": 0,
             "total_undefined": 0,
             "metadata": {
@@ -269,7 +309,7 @@ def analyze_undefined_terms(
             },
             "issues": [],
             "items": [],
-        }
+        })
 
     aggregated_items: List[Dict[str, Any]] = []
 
@@ -365,8 +405,7 @@ def analyze_undefined_terms(
 
     response: Dict[str, Any] = {
         "success": full_result.get("success", False),
-        "content": payload.content,
-        "context": context_dict,
+        **_echo_fields(payload.include_content, payload.content, context_dict),
         "total_terms_found": total_undefined,
         "total_undefined": total_undefined,
         "metadata": {
@@ -380,17 +419,68 @@ def analyze_undefined_terms(
         "items": aggregated_items,
     }
 
-    print(f"✅ Unified analysis done. Total items: {len(aggregated_items)}")
-    return response
+    logger.info("Unified analysis done", extra={"total_items": len(aggregated_items)})
+    return FastJSONResponse(response)
+
+
+async def _attach_sentence_ids(
+    db: AsyncSession,
+    document_id: UUID,
+    user_id: UUID,
+    result: Dict[str, Any],
+) -> None:
+    """
+    Map sentence1_hash / sentence2_hash của mỗi contradiction về Sentence.id
+    của document (Sentence.hash do canvas sync ghi, cùng bộ tách câu).
+    """
+    document = (
+        await db.execute(
+            select(Document.id).where(Document.id == document_id, Document.user_id == user_id)
+        )
+    ).first()
+    if not document:
+        raise HTTPException(
+            status_code=status.HTTP_404_NOT_FOUND,
+            detail="Document not found",
+        )
+
+    items = result.get("contradictions") or []
+    hashes = {
+        item.get(key)
+        for item in items
+        for key in ("sentence1_hash", "sentence2_hash")
+        if item.get(key)
+    }
+    if not hashes:
+        return
+
+    rows = (
+        await db.execute(
+            select(Sentence.id, Sentence.hash)
+            .join(Paragraph, Sentence.paragraph_id == Paragraph.id)
+            .where(Paragraph.document_id == document_id, Sentence.hash.in_(hashes))
+            .order_by(Paragraph.p_index, Sentence.s_index)
+        )
+    ).all()
+    sentence_ids: Dict[str, UUID] = {}
+    for sentence_id, sentence_hash in rows:
+        sentence_ids.setdefault(sentence_hash, sentence_id)  # câu lặp lại → lần xuất hiện đầu
+
+    for item in items:
+        item["sentence1_id"] = sentence_ids.get(item.get("sentence1_hash"))
+        item["sentence2_id"] = sentence_ids.get(item.get("sentence2_hash"))
 
 
-@router.post("/contradictions", response_model=ContradictionCheckResponse)
-def analyze_contradictions(
+@router.post("/contradictions", response_model=ContradictionCheckResponse, response_class=FastJSONResponse)
+async def analyze_contradictions(
     payload: ContradictionCheckRequest,
     current_user: User = Depends(get_current_user),
+    db: AsyncSession = Depends(get_async_db),
 ):
     """Expose contradiction detection to the frontend."""
-    return _wrap_analysis_call(
+    # NLI chạy trên CPU/GPU → threadpool; phần DB (map sentence id) chạy async
+    result = await run_in_threadpool(
+        _wrap_analysis_call,
         check_contradictions,
         payload.text,
         mode=payload.mode,
@@ -404,3 +494,6 @@ def analyze_contradictions(
         max_length=payload.max_length,
         error_message="Contradiction analysis failed",
     )
+    if payload.document_id and result.get("success"):
+        await _attach_sentence_ids(db, payload.document_id, current_user.id, result)
+    return result
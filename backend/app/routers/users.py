@@ -1,25 +1,34 @@
 from fastapi import APIRouter, Depends, HTTPException, status
+from sqlalchemy.ext.asyncio import AsyncSession
 from sqlalchemy.orm import Session
-from sqlalchemy import func
 from typing import List
 from datetime import datetime
-from app.core.database import get_db
+from app.core.database import get_async_db, get_db
+from app.core.principal_cache import principal_cache
 from app.core.security import get_current_user, get_password_hash, verify_password
-from app.models.user import User
-from app.models.document import Document
+from app.models.user import User, UserStats
 from app.models.error import LogicError
 from app.models.feedback import UserErrorPattern
-from app.models.analysis import WritingSession
 from app.schemas.user import UserResponse
 from app.schemas.user_extended import UserUpdate, UserProfileResponse, ErrorPatternResponse
+from app.services.user_stats import USER_STATS_REPAIRED, reconcile_statement
 
 router = APIRouter()
 
 
+def _load_user(db: Session, current_user: User) -> User:
+    """Bản User trong Session sync của request; đã bị xoá (request khác / admin) → 404."""
+    user = db.get(User, current_user.id)
+    if user is None:
+        principal_cache.invalidate(current_user.id)
+        raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail="User not found")
+    return user
+
+
 @router.get("/me", response_model=UserProfileResponse)
-def get_user_profile(
+async def get_user_profile(
     current_user: User = Depends(get_current_user),
-    db: Session = Depends(get_db)
+    db: AsyncSession = Depends(get_async_db)
 ):
     """
     Get authenticated user's profile and usage statistics.
@@ -30,38 +39,28 @@ def get_user_profile(
     - Total words written
     - Total errors found and fixed
     - Active writing time
-    """
-    # Get document statistics
-    total_documents = db.query(func.count(Document.id)).filter(
-        Document.user_id == current_user.id
-    ).scalar() or 0
     
-    total_words = db.query(func.sum(Document.word_count)).filter(
-        Document.user_id == current_user.id
-    ).scalar() or 0
-    
-    # Get error statistics from writing sessions
-    error_stats = db.query(
-        func.sum(WritingSession.errors_introduced).label('errors_found'),
-        func.sum(WritingSession.errors_fixed).label('errors_fixed'),
-        func.sum(WritingSession.active_time_seconds).label('active_time')
-    ).filter(
-        WritingSession.user_id == current_user.id
-    ).first()
-    
-    errors_found = error_stats.errors_found if error_stats and error_stats.errors_found else 0
-    errors_fixed = error_stats.errors_fixed if error_stats and error_stats.errors_fixed else 0
-    active_time_seconds = error_stats.active_time if error_stats and error_stats.active_time else 0
+    Thống kê đọc từ rollup USER_STATS (1 lần đọc theo khoá chính, trigger DB cập nhật).
+    """
+    stats = await db.get(UserStats, current_user.id)
+    if stats is None:
+        # user tạo trước khi có USER_STATS và chưa được job reconcile backfill → tính 1 lần từ bảng gốc
+        await db.execute(reconcile_statement([current_user.id]))
+        await db.commit()
+        USER_STATS_REPAIRED.labels(source="profile").inc()
+        stats = await db.get(UserStats, current_user.id)
+        if stats is None:
+            raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail="User not found")
     
     return UserProfileResponse(
         id=str(current_user.id),
         email=current_user.email,
         created_at=current_user.created_at.isoformat(),
-        total_documents=total_documents,
-        total_words_written=total_words,
-        total_errors_found=errors_found,
-        total_errors_fixed=errors_fixed,
-        active_writing_time_minutes=active_time_seconds // 60
+        total_documents=stats.total_documents,
+        total_words_written=stats.total_words,
+        total_errors_found=stats.total_errors_found,
+        total_errors_fixed=stats.total_errors_fixed,
+        active_writing_time_minutes=stats.active_time_seconds // 60
     )
 
 
@@ -80,6 +79,9 @@ def update_user_profile(
     
     Returns updated user information.
     """
+    # current_user thuộc AsyncSession của get_current_user → sửa qua bản load bằng Session này
+    current_user = _load_user(db, current_user)
+
     # If no updates provided
     if not user_update.email and not user_update.password:
         raise HTTPException(
@@ -123,6 +125,7 @@ def update_user_profile(
     
     db.commit()
     db.refresh(current_user)
+    principal_cache.invalidate(current_user.id)
     
     return UserResponse.from_orm(current_user)
 
@@ -173,6 +176,7 @@ def delete_user_account(
     ⚠️ WARNING: This action is irreversible!
     All user data including documents, goals, and analysis will be deleted.
     """
-    db.delete(current_user)
+    db.delete(_load_user(db, current_user))
     db.commit()
+    principal_cache.invalidate(current_user.id)
     return None
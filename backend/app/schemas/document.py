@@ -33,11 +33,14 @@ class DocumentResponse(BaseModel):
 
 
 class DocumentListResponse(BaseModel):
+    # Chỉ id bắt buộc: ?fields= chọn cột trả về (mặc định id, title, word_count, created_at, updated_at)
     id: UUID
-    title: str
-    word_count: int
-    created_at: datetime
-    updated_at: datetime
+    title: Optional[str] = None
+    word_count: Optional[int] = None
+    version: Optional[int] = None
+    goal_id: Optional[UUID] = None
+    created_at: Optional[datetime] = None
+    updated_at: Optional[datetime] = None
 
     class Config:
         from_attributes = True
@@ -85,6 +88,14 @@ class ParagraphUpdate(BaseModel):
     emb: Optional[List[float]] = None
 
 
+class ParagraphDeltaResponse(BaseModel):
+    document_id: UUID
+    version: int
+    since_version: int
+    paragraph_ids: List[UUID]  # mọi đoạn, theo p_index hiện tại
+    changed: List[ParagraphResponse]  # chỉ đoạn đổi sau since_version
+
+
 # Sentence schemas
 class SentenceResponse(BaseModel):
     id: UUID
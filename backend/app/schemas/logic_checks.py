@@ -1,4 +1,6 @@
 from typing import Any, Dict, List, Literal, Optional
+from uuid import UUID
+
 from pydantic import BaseModel, Field
 
 
@@ -9,6 +11,10 @@ class ContextPayload(BaseModel):
         ..., description="Arbitrary context metadata supplied by the editor"
     )
     content: str = Field(..., min_length=1, description="Raw text that needs analysing")
+    include_content: bool = Field(
+        default=True,
+        description="Echo `content` / `context` back in the response (false = smaller payload).",
+    )
 
 
 class UnsupportedClaimsRequest(ContextPayload):
@@ -49,8 +55,8 @@ class UnsupportedClaimItem(BaseModel):
 
 class UnsupportedClaimsResponse(BaseModel):
     success: bool
-    content: str
-    context: Dict[str, Any]
+    content: Optional[str] = None  # bỏ khi request include_content=false
+    context: Optional[Dict[str, Any]] = None
     total_claims_found: int
     total_unsupported: int
     unsupported_claims: List[UnsupportedClaimItem] = Field(default_factory=list)
@@ -69,8 +75,8 @@ class UndefinedTermItem(BaseModel):
 
 class UndefinedTermsResponse(BaseModel):
     success: bool
-    content: str
-    context: Dict[str, Any]
+    content: Optional[str] = None  # bỏ khi request include_content=false
+    context: Optional[Dict[str, Any]] = None
     total_terms_found: int
     total_undefined: int
     undefined_terms: List[UndefinedTermItem] = Field(default_factory=list)
@@ -91,6 +97,15 @@ class ContradictionCheckRequest(BaseModel):
     sim_max: float = 0.98
     batch_size: int = 8
     max_length: int = 128
+    # Nếu có: map câu mâu thuẫn về Sentence.id của document (qua Sentence.hash)
+    document_id: Optional[UUID] = None
+
+
+class SentenceSpanItem(BaseModel):
+    text: str
+    start: int
+    end: int
+    hash: str
 
 
 class ContradictionItem(BaseModel):
@@ -101,6 +116,14 @@ class ContradictionItem(BaseModel):
     sentence2: Optional[str] = None
     confidence: Optional[float] = None
     boosted: Optional[bool] = None
+    sentence1_start: Optional[int] = None
+    sentence1_end: Optional[int] = None
+    sentence2_start: Optional[int] = None
+    sentence2_end: Optional[int] = None
+    sentence1_hash: Optional[str] = None
+    sentence2_hash: Optional[str] = None
+    sentence1_id: Optional[UUID] = None
+    sentence2_id: Optional[UUID] = None
 
 
 class ContradictionCheckResponse(BaseModel):
@@ -110,6 +133,7 @@ class ContradictionCheckResponse(BaseModel):
     text: str
     total_sentences: int
     sentences: List[str]
+    sentence_spans: List[SentenceSpanItem] = Field(default_factory=list)
     total_contradictions: int
     contradictions: List[ContradictionItem]
     metadata: Metadata
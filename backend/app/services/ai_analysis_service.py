@@ -1,4 +1,4 @@
-from typing import Any, Dict, Optional
+from typing import Any, Dict, Iterable, Optional
 
 from app.ai.models.Analysis import analyze_document as _analyze_document
 
@@ -71,9 +71,11 @@ class AIAnalysisService:
         context: Optional[Any] = None,
         language: Optional[str] = None,
         mode: str = "fast",
+        subtasks: Optional[Iterable[str]] = None,
+        user_key: Optional[str] = None,
     ) -> Dict[str, Any]:
         """
-        Gọi unified analysis (5 subtasks):
+        Gọi unified analysis (mặc định 5 subtasks, `subtasks` để chọn tập con):
           1) contradictions
           2) undefined_terms
           3) unsupported_claims
@@ -81,7 +83,8 @@ class AIAnalysisService:
           5) spelling_errors
 
         Trả về đúng structure của app.ai.models.Analysis.analyze_document
-        để FE có thể tái sử dụng luôn.
+        để FE có thể tái sử dụng luôn. user_key: id user cho hàng đợi công bằng
+        của rate limiter Gemini.
         """
 
         # 1) Chuẩn hóa context
@@ -103,6 +106,8 @@ class AIAnalysisService:
             content=content,
             language=lang,
             mode=mode or "fast",
+            subtasks=subtasks,
+            user_key=user_key,
         )
 
         # 4) Bọc thêm metadata nhẹ cho AI Function
@@ -1,16 +1,39 @@
 from __future__ import annotations
 
 import hashlib
-import re
 from datetime import datetime
 from typing import Dict, List, Optional
 
 from bs4 import BeautifulSoup, NavigableString, Tag
+from bs4.builder import builder_registry
 from sqlalchemy.orm import Session
 
 from sqlalchemy import select
 
+from app.core.config import get_settings
 from app.models.document import Document, DocumentSection, Paragraph, Sentence, SectionType
+from app.utils.helpers import generate_text_hash
+from app.utils.nlp import split_sentences
+
+
+# Preferred BeautifulSoup tree builders for "auto", fastest first.
+# Any feature name registered with bs4 ("lxml", "html.parser", "html5lib", ...)
+# can be selected explicitly through DOCUMENT_PARSER_BACKEND.
+AUTO_PARSER_BACKENDS = ("lxml", "html.parser")
+
+
+def resolve_parser_backend(backend: Optional[str] = None) -> str:
+    """Map a configured backend name to an installed BeautifulSoup tree builder."""
+    name = (backend or "auto").strip().lower()
+    if name == "auto":
+        for candidate in AUTO_PARSER_BACKENDS:
+            if builder_registry.lookup(candidate) is not None:
+                return candidate
+        return "html.parser"
+
+    if builder_registry.lookup(name) is None:
+        raise ValueError(f"HTML parser backend '{name}' is not installed")
+    return name
 
 
 class DocumentCanvasSyncService:
@@ -29,14 +52,36 @@ class DocumentCanvasSyncService:
         "summary": SectionType.CONCLUSION.value,
     }
 
-    def __init__(self, db: Session) -> None:
+    def __init__(self, db: Session, parser_backend: Optional[str] = None) -> None:
         self.db = db
+        self.parser_backend = resolve_parser_backend(
+            parser_backend or get_settings().DOCUMENT_PARSER_BACKEND
+        )
+
+    @staticmethod
+    def content_hash(html_content: Optional[str]) -> str:
+        """Hash of the raw canvas HTML, stored on Document.content_hash."""
+        return generate_text_hash(html_content or "")
+
+    def is_unchanged(self, document: Document, html_content: Optional[str]) -> bool:
+        """True when html_content is identical to what was last synchronized."""
+        return document.content_hash is not None and document.content_hash == self.content_hash(html_content)
 
     def sync(self, document: Document, html_content: Optional[str]) -> None:
         """Synchronize DocumentSection/Paragraph/Sentence tables with canvas content."""
         normalized_html = (html_content or "").strip()
         sections = self._parse_sections(normalized_html)
 
+        # Paragraph giữ nguyên (cùng p_index + hash) giữ changed_version cũ → delta fetch
+        # (GET /documents/{id}/paragraphs/delta) chỉ trả đoạn thực sự đổi
+        previous_versions = {
+            p_index: (paragraph_hash, changed_version)
+            for p_index, paragraph_hash, changed_version in self.db.query(
+                Paragraph.p_index, Paragraph.hash, Paragraph.changed_version
+            ).filter(Paragraph.document_id == document.id)
+        }
+        current_version = document.version or 1
+
         # Remove previous structure (respect FK constraints by deleting child sentences first)
         paragraph_subquery = select(Paragraph.id).where(Paragraph.document_id == document.id)
         self.db.query(Sentence).filter(Sentence.paragraph_id.in_(paragraph_subquery)).delete(synchronize_session=False)
@@ -62,6 +107,7 @@ class DocumentCanvasSyncService:
 
             for paragraph in section["paragraphs"]:
                 paragraph_index += 1
+                previous_hash, previous_version = previous_versions.get(paragraph_index, (None, None))
                 para_model = Paragraph(
                     document_id=document.id,
                     section_id=section_model.id,
@@ -69,6 +115,11 @@ class DocumentCanvasSyncService:
                     text=paragraph["html"],
                     hash=paragraph["hash"],
                     word_count=paragraph["word_count"],
+                    changed_version=(
+                        previous_version
+                        if previous_hash == paragraph["hash"] and previous_version is not None
+                        else current_version
+                    ),
                 )
                 self.db.add(para_model)
                 self.db.flush()
@@ -96,6 +147,7 @@ class DocumentCanvasSyncService:
             )
 
         document.word_count = total_word_count
+        document.content_hash = self.content_hash(html_content)
         document.structure_json = {
             "sections": summary,
             "synchronized_at": datetime.utcnow().isoformat(),
@@ -105,7 +157,7 @@ class DocumentCanvasSyncService:
     # Parsing helpers
     # ---------------------------------------------------------------------
     def _parse_sections(self, html: str) -> List[Dict[str, object]]:
-        soup = BeautifulSoup(html or "", "html.parser")
+        soup = BeautifulSoup(html or "", self.parser_backend)
         container = soup.body or soup
 
         sections: List[Dict[str, object]] = []
@@ -164,15 +216,22 @@ class DocumentCanvasSyncService:
                     )
             return paragraphs
 
+        # Text is extracted once and reused for both the emptiness check and the payload
         text = node.get_text(" ", strip=True)
         if text:
-            return [self._build_paragraph_from_node(node)]
+            return [self._build_paragraph_from_node(node, plain_text=text)]
 
         return []
 
-    def _build_paragraph_from_node(self, node: Tag, list_type: Optional[str] = None) -> Dict[str, object]:
-        html_repr = self._node_to_html(node, list_type)
-        plain_text = node.get_text(" ", strip=True)
+    def _build_paragraph_from_node(
+        self,
+        node: Tag,
+        list_type: Optional[str] = None,
+        plain_text: Optional[str] = None,
+    ) -> Dict[str, object]:
+        if plain_text is None:
+            plain_text = node.get_text(" ", strip=True)
+        html_repr = self._node_to_html(node, list_type, plain_text)
         return self._build_paragraph_data(html_repr, plain_text)
 
     def _paragraph_from_text(self, text: NavigableString | str) -> List[Dict[str, object]]:
@@ -183,14 +242,14 @@ class DocumentCanvasSyncService:
         return [self._build_paragraph_data(html_repr, text, metadata=metadata)]
 
     def _build_paragraph_data(self, html_repr: str, plain_text: str, metadata: Optional[Dict[str, object]] = None) -> Dict[str, object]:
-        sentences = self._split_sentences(plain_text)
+        # Same segmenter as the NLI path, so Sentence.hash can be matched against its findings
         sentence_payload = [
             {
-                "text": sentence,
-                "hash": hashlib.md5(sentence.encode("utf-8")).hexdigest(),
+                "text": span.text,
+                "hash": span.hash,
                 "role": None,
             }
-            for sentence in sentences
+            for span in split_sentences(plain_text)
         ]
         payload: Dict[str, object] = {
             "html": html_repr,
@@ -204,13 +263,9 @@ class DocumentCanvasSyncService:
         return payload
 
     def _split_sentences(self, text: str) -> List[str]:
-        clean = text.strip()
-        if not clean:
-            return []
-        parts = re.split(r"(?<=[.!?])\s+", clean)
-        return [part.strip() for part in parts if part.strip()]
+        return [span.text for span in split_sentences(text)]
 
-    def _node_to_html(self, node: Tag, list_type: Optional[str]) -> str:
+    def _node_to_html(self, node: Tag, list_type: Optional[str], plain_text: str) -> str:
         if list_type:
             inner = node.decode_contents().strip()
             return f"<p data-list-type=\"{list_type}\">{inner}</p>"
@@ -218,7 +273,7 @@ class DocumentCanvasSyncService:
         if node.name in {"p", "blockquote", "li"}:
             return str(node)
 
-        inner_html = node.decode_contents().strip() or node.get_text(" ", strip=True)
+        inner_html = node.decode_contents().strip() or plain_text
         return f"<p>{inner_html}</p>"
 
     def _infer_section_type(self, label: str) -> str:
@@ -232,4 +287,4 @@ class DocumentCanvasSyncService:
         return {"label": label, "type": section_type, "paragraphs": []}
 
 
-__all__ = ["DocumentCanvasSyncService"]
+__all__ = ["DocumentCanvasSyncService", "resolve_parser_backend"]
@@ -0,0 +1,230 @@
+"""
+USER_STATS: rollup thống kê cho GET /api/users/me
+-------------------------------------------------
+Trước đây mỗi lần gọi /me chạy count(DOCUMENT) + sum(word_count) + 3 sum trên
+WRITING_SESSION của user — chi phí tăng theo số document / session. Giờ /me chỉ
+đọc 1 dòng USER_STATS theo khoá chính.
+
+- Cập nhật tăng dần bằng trigger Postgres trên DOCUMENT (insert / delete / đổi
+  word_count, user_id) và WRITING_SESSION, trong cùng transaction với thay đổi
+  gốc → mọi đường ghi (router, job, SQL tay) đều được tính. Trigger chỉ UPDATE
+  dòng đã có; dòng được tạo khi insert USER, bởi backfill (`reconcile_user_stats`)
+  hoặc lần đầu user gọi /me (`reconcile_statement` cho 1 user).
+- Deploy bằng infra/db/init/030_triggers.sql; môi trường chỉ chạy
+  Base.metadata.create_all (dev) được cài qua `install_user_stats_triggers`
+  (chỉ tạo trigger khi chưa có → không khoá bảng mỗi lần khởi động).
+- Reconcile: tính lại từ bảng gốc theo lô USER.id, chỉ ghi dòng lệch
+  (IS DISTINCT FROM). Dòng USER_STATS của lô bị khoá (FOR UPDATE) trước khi tính
+  để delta của transaction đang chạy không bị ghi đè. Chạy định kỳ (cron):
+      cd backend && python -m app.services.user_stats
+"""
+
+import logging
+import uuid
+from typing import Iterator, List, Optional, Sequence
+
+from sqlalchemy import DDL, event, func, select, true, tuple_
+from sqlalchemy.dialects.postgresql import insert
+from sqlalchemy.orm import Session
+
+from app.core.database import Base
+from app.core.metrics import counter
+from app.models.analysis import WritingSession
+from app.models.document import Document
+from app.models.user import User, UserStats
+
+logger = logging.getLogger(__name__)
+
+USER_STATS_REPAIRED = counter(
+    "user_stats_repaired_total", "USER_STATS rows rewritten from source tables", ["source"]
+)
+
+STAT_COLUMNS = ("total_documents", "total_words", "total_errors_found", "total_errors_fixed", "active_time_seconds")
+
+# Giữ đồng bộ với infra/db/init/030_triggers.sql
+USER_STATS_FUNCTIONS = (
+    """
+CREATE OR REPLACE FUNCTION user_stats_on_user_insert()
+RETURNS trigger AS $$
+BEGIN
+  INSERT INTO "USER_STATS" (user_id) VALUES (NEW.id) ON CONFLICT DO NOTHING;
+  RETURN NULL;
+END;
+$$ LANGUAGE plpgsql
+""",
+    """
+CREATE OR REPLACE FUNCTION user_stats_on_document_change()
+RETURNS trigger AS $$
+BEGIN
+  IF TG_OP = 'UPDATE' AND OLD.user_id = NEW.user_id THEN
+    IF OLD.word_count IS DISTINCT FROM NEW.word_count THEN
+      UPDATE "USER_STATS"
+         SET total_words = total_words + NEW.word_count - OLD.word_count, updated_at = now()
+       WHERE user_id = NEW.user_id;
+    END IF;
+    RETURN NULL;
+  END IF;
+
+  IF TG_OP IN ('UPDATE', 'DELETE') THEN
+    UPDATE "USER_STATS"
+       SET total_documents = total_documents - 1, total_words = total_words - OLD.word_count, updated_at = now()
+     WHERE user_id = OLD.user_id;
+  END IF;
+  IF TG_OP IN ('INSERT', 'UPDATE') THEN
+    UPDATE "USER_STATS"
+       SET total_documents = total_documents + 1, total_words = total_words + NEW.word_count, updated_at = now()
+     WHERE user_id = NEW.user_id;
+  END IF;
+  RETURN NULL;
+END;
+$$ LANGUAGE plpgsql
+""",
+    """
+CREATE OR REPLACE FUNCTION user_stats_on_session_change()
+RETURNS trigger AS $$
+BEGIN
+  IF TG_OP IN ('UPDATE', 'DELETE') THEN
+    UPDATE "USER_STATS"
+       SET total_errors_found = total_errors_found - OLD.errors_introduced,
+           total_errors_fixed = total_errors_fixed - OLD.errors_fixed,
+           active_time_seconds = active_time_seconds - OLD.active_time_seconds,
+           updated_at = now()
+     WHERE user_id = OLD.user_id;
+  END IF;
+  IF TG_OP IN ('INSERT', 'UPDATE') THEN
+    UPDATE "USER_STATS"
+       SET total_errors_found = total_errors_found + NEW.errors_introduced,
+           total_errors_fixed = total_errors_fixed + NEW.errors_fixed,
+           active_time_seconds = active_time_seconds + NEW.active_time_seconds,
+           updated_at = now()
+     WHERE user_id = NEW.user_id;
+  END IF;
+  RETURN NULL;
+END;
+$$ LANGUAGE plpgsql
+""",
+)
+
+# (tên trigger, bảng, sự kiện, function)
+USER_STATS_TRIGGERS = (
+    ("trg_user_stats_user", "USER", "INSERT", "user_stats_on_user_insert"),
+    ("trg_user_stats_document", "DOCUMENT", "INSERT OR DELETE OR UPDATE OF word_count, user_id",
+     "user_stats_on_document_change"),
+    ("trg_user_stats_session", "WRITING_SESSION",
+     "INSERT OR DELETE OR UPDATE OF errors_introduced, errors_fixed, active_time_seconds, user_id",
+     "user_stats_on_session_change"),
+)
+
+
+def user_stats_ddl() -> List[str]:
+    """Function (CREATE OR REPLACE) + trigger (chỉ tạo khi chưa có)."""
+    statements = [sql.strip() for sql in USER_STATS_FUNCTIONS]
+    for name, table, events, function in USER_STATS_TRIGGERS:
+        statements.append(
+            f"""DO $$
+BEGIN
+  IF NOT EXISTS (SELECT 1 FROM pg_trigger WHERE tgname = '{name}') THEN
+    CREATE TRIGGER {name} AFTER {events} ON "{table}"
+    FOR EACH ROW EXECUTE FUNCTION {function}();
+  END IF;
+END
+$$"""
+        )
+    return statements
+
+
+def install_user_stats_triggers() -> None:
+    """Gắn DDL trigger vào Base.metadata.create_all (chỉ Postgres)."""
+    for statement in user_stats_ddl():
+        event.listen(Base.metadata, "after_create", DDL(statement).execute_if(dialect="postgresql"))
+
+
+def reconcile_statement(user_ids: Sequence[uuid.UUID]):
+    """INSERT ... SELECT tổng từ bảng gốc ... ON CONFLICT DO UPDATE chỉ khi lệch; RETURNING user_id đã ghi."""
+    document_totals = (
+        select(
+            func.count(Document.id).label("total_documents"),
+            func.coalesce(func.sum(Document.word_count), 0).label("total_words"),
+        )
+        .where(Document.user_id == User.id)
+        .lateral("document_totals")
+    )
+    session_totals = (
+        select(
+            func.coalesce(func.sum(WritingSession.errors_introduced), 0).label("total_errors_found"),
+            func.coalesce(func.sum(WritingSession.errors_fixed), 0).label("total_errors_fixed"),
+            func.coalesce(func.sum(WritingSession.active_time_seconds), 0).label("active_time_seconds"),
+        )
+        .where(WritingSession.user_id == User.id)
+        .lateral("session_totals")
+    )
+    source = (
+        select(
+            User.id,
+            document_totals.c.total_documents,
+            document_totals.c.total_words,
+            session_totals.c.total_errors_found,
+            session_totals.c.total_errors_fixed,
+            session_totals.c.active_time_seconds,
+        )
+        .select_from(User)
+        .join(document_totals, true())
+        .join(session_totals, true())
+        .where(User.id.in_(list(user_ids)))
+    )
+    statement = insert(UserStats).from_select(["user_id", *STAT_COLUMNS], source)
+    current = tuple_(*(getattr(UserStats, name) for name in STAT_COLUMNS))
+    expected = tuple_(*(getattr(statement.excluded, name) for name in STAT_COLUMNS))
+    return statement.on_conflict_do_update(
+        index_elements=[UserStats.user_id],
+        set_={**{name: getattr(statement.excluded, name) for name in STAT_COLUMNS}, "updated_at": func.now()},
+        where=current.is_distinct_from(expected),
+    ).returning(UserStats.user_id)
+
+
+def _user_id_batches(db: Session, batch_size: int, user_ids: Optional[Sequence[uuid.UUID]]) -> Iterator[List[uuid.UUID]]:
+    if user_ids is not None:
+        ids = list(user_ids)
+        for start in range(0, len(ids), batch_size):
+            yield ids[start : start + batch_size]
+        return
+    last_id = None
+    while True:  # keyset theo USER.id
+        query = select(User.id).order_by(User.id).limit(batch_size)
+        if last_id is not None:
+            query = query.where(User.id > last_id)
+        batch = list(db.execute(query).scalars().all())
+        if batch:
+            yield batch
+        if len(batch) < batch_size:
+            return
+        last_id = batch[-1]
+
+
+def reconcile_user_stats(db: Session, batch_size: int = 1000, user_ids: Optional[Sequence[uuid.UUID]] = None) -> int:
+    """Sửa drift / backfill USER_STATS cho mọi user (hoặc `user_ids`), mỗi lô 1 transaction. Trả số dòng đã ghi."""
+    repaired = 0
+    for batch in _user_id_batches(db, batch_size, user_ids):
+        # khoá dòng hiện có: trigger của transaction khác chờ tới khi lô này commit
+        db.execute(select(UserStats.user_id).where(UserStats.user_id.in_(batch)).with_for_update())
+        repaired += len(db.execute(reconcile_statement(batch)).scalars().all())
+        db.commit()
+
+    if repaired:
+        USER_STATS_REPAIRED.labels(source="reconcile").inc(repaired)
+        logger.warning("USER_STATS reconcile rewrote %d rows", repaired)
+    return repaired
+
+
+install_user_stats_triggers()
+
+
+if __name__ == "__main__":
+    from app.core.config import get_settings
+    from app.core.database import SessionLocal
+    from app.core.logging_config import configure_logging
+
+    configure_logging(get_settings())
+    with SessionLocal() as session:
+        count = reconcile_user_stats(session)
+    logger.info("USER_STATS reconcile done: %d rows rewritten", count)
@@ -1,7 +1,131 @@
 """
 Placeholder for NLP and logic analysis utilities
 """
+import hashlib
 import re
+from dataclasses import dataclass
+from typing import List
+
+
+# ====== SENTENCE SEGMENTATION ======
+# Một bộ tách câu dùng chung cho NLI (contradictions) và canvas sync, trả về
+# offset trên chuỗi gốc để map kết quả về đúng Sentence row / vị trí ký tự.
+
+# Từ viết tắt (lowercase, bỏ dấu chấm cuối) — dấu "." sau chúng không kết thúc câu
+ABBREVIATIONS = frozenset({
+    # Tiếng Việt
+    "tp", "ths", "ts", "pgs", "gs", "bs", "ks", "cn", "kts", "ls", "nxb", "tt", "q", "p",
+    "v.v", "vd", "tr", "th.s", "pgs.ts", "gs.ts",
+    # English
+    "dr", "mr", "mrs", "ms", "prof", "sr", "jr", "st", "vs", "etc", "e.g", "i.e",
+    "fig", "figs", "eq", "vol", "inc", "ltd", "co", "corp",
+    "jan", "feb", "mar", "apr", "jun", "jul", "aug", "sep", "sept", "oct", "nov", "dec",
+    "u.s", "u.k", "a.m", "p.m", "ph.d",
+})
+
+# Viết tắt có thể đứng cuối câu: chỉ kết thúc câu khi câu sau viết hoa
+_SENTENCE_FINAL_ABBREVIATIONS = frozenset({"etc", "v.v", "inc", "ltd", "co", "corp", "st", "a.m", "p.m"})
+
+# Trùng với từ thường ("no", "pp"): chỉ là viết tắt khi theo sau là số ("No. 5", "pp. 12-15")
+_NUMERIC_ABBREVIATIONS = frozenset({"no", "pp"})
+
+# Dấu kết câu (+ ngoặc / nháy đóng) theo sau là khoảng trắng hoặc hết chuỗi
+_TERMINATOR_RE = re.compile(r"(?:[.!?…]+)[\"'”’)\]]*(?=\s|$)")
+_PARAGRAPH_BREAK_RE = re.compile(r"\n\s*\n")
+_LAST_TOKEN_RE = re.compile(r"\S*\Z")
+_WHITESPACE_RE = re.compile(r"\s+")
+_NEXT_CHAR_RE = re.compile(r"\s*(\S)")
+_TRAILING_PUNCT_RE = re.compile(r"[.!?]+$")
+
+
+def sentence_hash(text: str) -> str:
+    """Hash của câu, cùng công thức với Sentence.hash do canvas sync ghi."""
+    return hashlib.md5(text.encode("utf-8")).hexdigest()
+
+
+@dataclass(frozen=True)
+class SentenceSpan:
+    """
+    1 câu trên chuỗi gốc: source[start:end] là đoạn gốc,
+    `text` là câu đã gộp khoảng trắng (dùng để hiển thị / hash).
+    """
+    text: str
+    start: int
+    end: int
+
+    @property
+    def hash(self) -> str:
+        return sentence_hash(self.text)
+
+    @property
+    def word_count(self) -> int:
+        return len(self.text.split())
+
+
+def _is_abbreviation(text: str, dot_index: int, next_char: str) -> bool:
+    """Dấu "." tại dot_index có thuộc từ viết tắt / chữ cái tắt (A. B.) không."""
+    token = _LAST_TOKEN_RE.search(text, max(0, dot_index - 16), dot_index).group()
+    token = token.lstrip("(\"'“‘").lower()
+    if not token:
+        return False
+    if token in _NUMERIC_ABBREVIATIONS:
+        return next_char.isdigit()
+    if token == "al" and text[max(0, dot_index - 6):dot_index].lower().endswith(" et al"):
+        return not next_char.isupper()  # "et al. (2020)" / "et al., 2020"
+    if token in ABBREVIATIONS:
+        return not (token in _SENTENCE_FINAL_ABBREVIATIONS and next_char.isupper())
+    # Chữ cái viết tắt tên người: "Nguyễn V. An", "J. Smith"
+    return len(token) == 1 and token.isalpha() and next_char.isupper()
+
+
+def split_sentences(text: str) -> List[SentenceSpan]:
+    """
+    Tách câu, giữ offset trên chuỗi gốc.
+
+    - Kết câu: . ! ? … (kèm nháy / ngoặc đóng) rồi tới khoảng trắng, và câu sau
+      KHÔNG bắt đầu bằng chữ thường; dòng trống luôn kết thúc câu.
+    - Bỏ qua dấu chấm của từ viết tắt (TP., ThS., PGS.TS., v.v., Dr., e.g. ...).
+    """
+    spans: List[SentenceSpan] = []
+    if not text:
+        return spans
+
+    boundaries = set()
+    for match in _TERMINATOR_RE.finditer(text):
+        end = match.end()
+        following = _NEXT_CHAR_RE.match(text, end)
+        next_char = following.group(1) if following else ""
+        if next_char and next_char.islower():
+            continue
+        terminator = match.group()
+        if terminator.rstrip("\"'”’)]") == "." and _is_abbreviation(text, match.start(), next_char):
+            continue
+        boundaries.add(end)
+    for match in _PARAGRAPH_BREAK_RE.finditer(text):
+        boundaries.add(match.start())
+    boundaries.add(len(text))
+
+    cursor = 0
+    for boundary in sorted(boundaries):
+        chunk = text[cursor:boundary]
+        stripped = chunk.strip()
+        if stripped:
+            start = cursor + (len(chunk) - len(chunk.lstrip()))
+            end = start + len(stripped)
+            if "  " in stripped or "\n" in stripped or "\t" in stripped:
+                stripped = _WHITESPACE_RE.sub(" ", stripped)
+            spans.append(SentenceSpan(stripped, start, end))
+        cursor = boundary
+    return spans
+
+
+def extract_sentence_spans(text: str, min_words: int = 3) -> List[SentenceSpan]:
+    """split_sentences() + bỏ câu quá ngắn (heading, mảnh câu)."""
+    return [span for span in split_sentences(text) if span.word_count >= min_words]
+
+
+def strip_terminal_punctuation(sentence: str) -> str:
+    return _TRAILING_PUNCT_RE.sub("", sentence).strip()
 
 
 def extract_criteria_from_rubric(rubric_text: str) -> dict:
@@ -87,27 +211,15 @@ def extract_sentences(text: str) -> list:
     """
     Extract sentences from text using improved sentence splitting
     Works better for Vietnamese and English text
+
+    Giữ các câu >= 3 từ, bỏ dấu kết câu cuối. Cần offset thì dùng
+    extract_sentence_spans().
     """
-    import re
-    
-    # Normalize whitespace
-    text = re.sub(r'\s+', ' ', text.strip())
-    
-    # Split by sentence endings: . ! ? followed by space and capital letter or quote
-    # Also handles Vietnamese specific patterns
-    sentences = re.split(r'(?<=[.!?])\s+(?=[A-ZÀÁẠẢÃÂẦẤẬẨẪĂẰẮẶẲẴÈÉẸẺẼÊỀẾỆỂỄÌÍỊỈĨÒÓỌỎÕÔỒỐỘỔỖƠỜỚỢỞỠÙÚỤỦŨƯỪỨỰỬỮỲÝỴỶỸĐ"\'])', text)
-    
-    # Clean and filter
     result = []
-    for s in sentences:
-        s = s.strip()
-        # Keep sentences with at least 3 words
-        if s and len(s.split()) >= 3:
-            # Remove trailing punctuation for consistency
-            s = re.sub(r'[.!?]+$', '', s).strip()
-            if s:
-                result.append(s)
-    
+    for span in extract_sentence_spans(text):
+        sentence = strip_terminal_punctuation(span.text)
+        if sentence:
+            result.append(sentence)
     return result
 
 
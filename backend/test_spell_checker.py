@@ -0,0 +1,187 @@
+"""
+Test Local Spell Checker - SymSpell EN + bigram VI
+===================================================
+Kiểm tra check_spelling() (vị trí khớp chuỗi gốc, lỗi dấu tiếng Việt, lỗi
+edit-distance tiếng Anh, không báo nhầm từ đúng) và prompt unified khi bỏ
+subtask spelling_errors. Có benchmark thời gian build index / check.
+
+Chạy test:
+    cd backend
+    python -m pytest test_spell_checker.py -q
+    python test_spell_checker.py          # test + benchmark
+"""
+
+import os
+import sys
+import tempfile
+import time
+
+# Import trực tiếp module (tránh app.ai.models.__init__ kéo theo Gemini)
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), 'app', 'ai', 'models'))
+
+from promptStore import UNIFIED_SUBTASKS, prompt_analysis, prompt_analysis_vi
+from spell_checker import (
+    SpellChecker,
+    SymSpellIndex,
+    check_spelling,
+    damerau_levenshtein,
+    phonetic_key,
+)
+
+
+def _pairs(items):
+    return [(it["original"], it["suggested"]) for it in items]
+
+
+def test_vietnamese_diacritic_confusions():
+    """Nhầm dấu thanh / dấu phụ được sửa ở mức cụm, vị trí khớp chuỗi gốc"""
+    text = "Sản phẩm giúp sức khẻ tốt hơn, theo nghiên cú mới. Cơ thễ cần khả nằng hồi phục."
+    items = check_spelling(text, language="vi")
+
+    assert _pairs(items) == [
+        ("sức khẻ", "sức khỏe"),
+        ("nghiên cú", "nghiên cứu"),
+        ("Cơ thễ", "Cơ thể"),
+        ("khả nằng", "khả năng"),
+    ]
+    for it in items:
+        assert text[it["start_pos"]:it["end_pos"]] == it["original"]
+        assert it["language"] == "vi"
+
+
+def test_vietnamese_correct_text_not_flagged():
+    """Văn bản đúng (kể cả kiểu bỏ dấu cũ "khoẻ") không bị gắn cờ"""
+    text = (
+        "Có thể nói sức khoẻ cộng đồng đang cải thiện. Có thế lực lớn trong xã hội. "
+        "Cơ cấu kinh tế thay đổi, giảm tư duy cũ; kết quả nghiên cứu cho thấy điều đó."
+    )
+    assert check_spelling(text, language="vi") == []
+
+
+def test_english_edit_distance():
+    text = "The algoritm is eficient and we recieve data from the platfomr."
+    items = check_spelling(text, language="en")
+    assert _pairs(items) == [
+        ("algoritm", "algorithm"),
+        ("eficient", "efficient"),
+        ("recieve", "receive"),
+        ("platfomr", "platform"),
+    ]
+    for it in items:
+        assert text[it["start_pos"]:it["end_pos"]] == it["original"]
+
+
+def test_english_skips_names_urls_and_jargon():
+    """Tên riêng, URL / email, từ lạ lặp lại (thuật ngữ cố ý) không bị báo"""
+    text = (
+        "Zindra uses NeuroLearn-X. See https://example.com/platfomr or mail bob@exampel.org. "
+        "The fooquux layer wraps another fooquux layer. Our dataset was pretrained."
+    )
+    assert check_spelling(text, language="en") == []
+
+
+def test_english_words_inside_vietnamese_text():
+    """Âm tiết không dấu trong văn bản tiếng Việt không bị coi là lỗi tiếng Anh"""
+    items = check_spelling("Ngành cong nghe phát triển nhờ algoritm mới.", language="vi")
+    assert _pairs(items) == [("algoritm", "algorithm")]
+
+
+def test_symspell_index_lookup():
+    index = SymSpellIndex(max_edit_distance=2)
+    index.update({"receive": 100, "recipe": 50, "deceive": 10})
+    suggestions = index.lookup("recieve")
+    assert suggestions[0].term == "receive" and suggestions[0].distance == 1
+    assert index.lookup("receive")[0].distance == 0
+    assert index.lookup("xyzxyzxyz") == []
+
+
+def test_edit_distance_and_phonetic_key():
+    assert damerau_levenshtein("recieve", "receive", 2) == 1  # đổi chỗ
+    assert damerau_levenshtein("abc", "abcdef", 1) == 2  # vượt ngưỡng
+    assert phonetic_key("nướt") == phonetic_key("nước")
+    assert phonetic_key("trứng") == phonetic_key("chứng")
+
+
+def test_custom_lexicon_directory():
+    """Lexicon đọc từ thư mục cấu hình, <lang>.<domain>.tsv được nạp cùng"""
+    with tempfile.TemporaryDirectory() as tmp:
+        with open(os.path.join(tmp, "en.tsv"), "w", encoding="utf-8") as fh:
+            fh.write("# header\nreceive\t10\n")
+        with open(os.path.join(tmp, "vi.medical.tsv"), "w", encoding="utf-8") as fh:
+            fh.write("huyết áp\t10\n")
+        checker = SpellChecker(lexicon_dir=tmp)
+        items = checker.check("Đo huyết ap rồi recieve kết quả.", language="vi")
+        assert _pairs(items) == [("huyết ap", "huyết áp"), ("recieve", "receive")]
+
+
+def test_prompt_without_spelling_subtask():
+    """Bỏ spelling_errors: không còn section, block JSON hay luật vị trí"""
+    context = {"writing_type": "Essay"}
+    logic = [name for name in UNIFIED_SUBTASKS if name != "spelling_errors"]
+
+    for build in (prompt_analysis, prompt_analysis_vi):
+        full = build(context, "Body", subtasks=None)
+        trimmed = build(context, "Body", subtasks=logic)
+        assert '"spelling_errors"' in full and '"spelling_errors"' not in trimmed
+        assert "start_pos" not in trimmed
+        assert "spelling_errors.total_found" not in trimmed
+        assert len(trimmed) < len(full)
+
+    try:
+        prompt_analysis(context, "Body", subtasks=["typos"])
+    except ValueError:
+        pass
+    else:
+        raise AssertionError("Unknown subtask must raise ValueError")
+
+
+# ------------------------------------------------------------------
+# Benchmark
+# ------------------------------------------------------------------
+
+def benchmark_spell_checker(paragraphs=200):
+    print("\n" + "=" * 80)
+    print("BENCHMARK: local spell checker")
+    print("=" * 80)
+
+    started = time.perf_counter()
+    checker = SpellChecker()
+    checker.check("warm up", language="en")
+    print(f"build index       {(time.perf_counter() - started) * 1000:9.1f} ms")
+
+    # 1 câu có lỗi + N câu đúng (từ sai lặp lại nhiều lần sẽ bị coi là thuật ngữ cố ý)
+    samples = {
+        "en": ("The algoritm is eficient. ", "The platform scales to large datasets quickly. "),
+        "vi": ("Sản phẩm giúp sức khẻ tốt hơn. ", "Theo nghiên cứu mới về trí tuệ nhân tạo. "),
+    }
+    for language, (typo, clean) in samples.items():
+        text = typo + clean * paragraphs
+        started = time.perf_counter()
+        items = checker.check(text, language=language)
+        elapsed = (time.perf_counter() - started) * 1000
+        print(f"check {language} {len(text) / 1024:6.1f} KB  {elapsed:9.1f} ms   hits={len(items)}")
+
+
+if __name__ == "__main__":
+    tests = [
+        test_vietnamese_diacritic_confusions,
+        test_vietnamese_correct_text_not_flagged,
+        test_english_edit_distance,
+        test_english_skips_names_urls_and_jargon,
+        test_english_words_inside_vietnamese_text,
+        test_symspell_index_lookup,
+        test_edit_distance_and_phonetic_key,
+        test_custom_lexicon_directory,
+        test_prompt_without_spelling_subtask,
+    ]
+    failed = 0
+    for test in tests:
+        try:
+            test()
+            print(f"✅ PASS - {test.__name__}")
+        except AssertionError as exc:
+            failed += 1
+            print(f"❌ FAIL - {test.__name__}: {exc}")
+
+    benchmark_spell_checker()
+    sys.exit(1 if failed else 0)
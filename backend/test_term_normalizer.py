@@ -0,0 +1,222 @@
+"""
+Test Term Normalizer - Multi-pattern matcher
+=============================================
+Kiểm tra normalize_text() với Aho-Corasick matcher (leftmost-longest, case-fold,
+offset khớp chuỗi gốc) và benchmark ở 10 / 1k / 50k entries.
+
+Chạy test:
+    cd backend
+    python -m pytest test_term_normalizer.py -q
+    python test_term_normalizer.py        # test + benchmark
+"""
+
+import os
+import random
+import re
+import string
+import sys
+import tempfile
+import time
+
+# Import trực tiếp module (tránh app.ai.models.__init__ kéo theo Gemini)
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), 'app', 'ai', 'models'))
+
+from term_normalizer import (
+    DictionaryStore,
+    ReplacementMatcher,
+    _apply_basic_replacements,
+    get_matcher,
+    load_dictionary_file,
+    normalize_text,
+)
+
+
+def test_offsets_match_original_text():
+    """start_pos / end_pos phải cắt đúng chuỗi gốc"""
+    text = "Sản phẩm giúp sức khẻ tốt hơn, theo nghiên cứ mới về deeplearnnig."
+    result = normalize_text(text, language="vi")
+
+    originals = [c["original"] for c in result.spelling_corrections]
+    assert originals == ["sức khẻ", "nghiên cứ", "deeplearnnig"]
+    for corr in result.spelling_corrections:
+        assert text[corr["start_pos"]:corr["end_pos"]] == corr["original"]
+
+    assert result.normalized_text == (
+        "Sản phẩm giúp sức khỏe tốt hơn, theo nghiên cứu mới về deep learning."
+    )
+
+
+def test_leftmost_longest():
+    """Cụm dài nhất được ưu tiên, không báo trùng cụm con"""
+    text = "Uống nướt tăng lực để kích hoặt năng lượng não bộ."
+    result = normalize_text(text, language="vi")
+
+    assert [c["original"] for c in result.spelling_corrections] == [
+        "nướt tăng lực",
+        "kích hoặt năng lượng não bộ",
+    ]
+    assert result.normalized_text == "Uống nước tăng lực để kích hoạt năng lượng não bộ."
+
+
+def test_case_insensitive_with_exact_variant():
+    """Match không phân biệt hoa/thường, nhưng ưu tiên biến thể khớp đúng chữ"""
+    result = normalize_text("Aritificial Inteligence and aritificial inteligence", language="en")
+    assert result.normalized_text == "Artificial Intelligence and artificial intelligence"
+
+    result = normalize_text("SAMSUNGG phones", language="en")
+    assert result.spelling_corrections[0]["original"] == "SAMSUNGG"
+    assert result.normalized_text == "Samsung phones"
+
+
+def test_matcher_is_cached_per_version():
+    """Cùng bộ từ điển → cùng matcher; đổi nội dung → version mới"""
+    first = get_matcher({"teh": "the"})
+    assert get_matcher({"teh": "the"}) is first
+    second = get_matcher({"teh": "the", "recieve": "receive"})
+    assert second is not first and second.version != first.version
+
+
+def test_empty_text():
+    result = normalize_text("", language="en")
+    assert result.normalized_text == "" and result.spelling_corrections == []
+    assert result.dictionary_version
+
+
+def test_shipped_dictionary_files():
+    """File en.tsv / vi.tsv đi kèm repo được nạp cùng seed trong code"""
+    result = normalize_text("Thuật toán algoritm có khả nằng cao.", language="vi")
+    assert result.normalized_text == "Thuật toán algorithm có khả năng cao."
+
+
+def _write(path, lines):
+    with open(path, "w", encoding="utf-8") as fh:
+        fh.write("\n".join(lines) + "\n")
+
+
+def test_domain_dictionary_and_hot_reload():
+    """Từ điển domain được nạp riêng; sửa file thì matcher + version đổi, không cần restart"""
+    with tempfile.TemporaryDirectory() as tmp:
+        _write(os.path.join(tmp, "en.tsv"), ["# comment", "recieve\treceive"])
+        _write(os.path.join(tmp, "vi.medical.tsv"), ["huyết ap\thuyết áp"])
+        store = DictionaryStore(directory=tmp, reload_interval=0)
+
+        base = store.matcher()
+        medical = store.matcher("medical")
+        assert base.version != medical.version
+        assert [m[2] for m in medical.find("đo huyết ap")] == ["huyết áp"]
+        assert base.find("đo huyết ap") == []
+        assert store.matcher() is base  # không đổi file → dùng lại matcher
+
+        path = os.path.join(tmp, "en.tsv")
+        _write(path, ["recieve\treceive", "occured\toccurred"])
+        os.utime(path, ns=(time.time_ns(), time.time_ns() + 1_000_000))
+
+        reloaded = store.matcher()
+        assert reloaded.version != base.version
+        assert [m[2] for m in reloaded.find("it occured")] == ["occurred"]
+
+
+def test_untrusted_domain_values_fall_back_to_base():
+    """domain đến từ client: không phải slug / không có file / không hash được → từ điển gốc, không thêm entry"""
+    with tempfile.TemporaryDirectory() as tmp:
+        _write(os.path.join(tmp, "en.tsv"), ["recieve\treceive"])
+        _write(os.path.join(tmp, "vi.medical.tsv"), ["huyết ap\thuyết áp"])
+        store = DictionaryStore(directory=tmp, reload_interval=60)
+
+        base = store.matcher()
+        for domain in ("../en", "legal", ["medical"], {"a": 1}, 42, "x" * 200):
+            assert store.matcher(domain) is base
+        assert store.matcher(" Medical ") is store.matcher("medical") is not base
+        assert set(store._entries) == {None, "medical"}
+
+
+def test_load_dictionary_file_skips_malformed_lines():
+    with tempfile.TemporaryDirectory() as tmp:
+        path = os.path.join(tmp, "en.tsv")
+        _write(path, ["# header", "", "no-tab-here", "teh\tthe"])
+        assert load_dictionary_file(path) == {"teh": "the"}
+
+
+# ------------------------------------------------------------------
+# Benchmark
+# ------------------------------------------------------------------
+
+def _naive_scan(text, replacements):
+    """Cách cũ: 1 lần re.finditer + 1 lần str.replace cho MỖI entry"""
+    found = 0
+    normalized = text
+    for wrong, correct in replacements.items():
+        found += sum(1 for _ in re.finditer(re.escape(wrong), text, flags=re.IGNORECASE))
+        normalized = normalized.replace(wrong, correct)
+    return found, normalized
+
+
+def _random_dictionary(size, seed=7):
+    rng = random.Random(seed)
+    entries = {}
+    while len(entries) < size:
+        word = "".join(rng.choice(string.ascii_lowercase) for _ in range(rng.randint(5, 12)))
+        entries[word] = word.upper()
+    return entries
+
+
+def benchmark_matcher(sizes=(10, 1_000, 50_000), words=5_000):
+    print("\n" + "=" * 80)
+    print(f"BENCHMARK: normalize over a {words}-word text")
+    print("=" * 80)
+    rng = random.Random(11)
+
+    for size in sizes:
+        replacements = _random_dictionary(size)
+        keys = list(replacements)
+        tokens = [
+            rng.choice(keys) if rng.random() < 0.02 else "lorem"
+            for _ in range(words)
+        ]
+        text = " ".join(tokens)
+
+        started = time.perf_counter()
+        matcher = ReplacementMatcher(replacements)
+        build_ms = (time.perf_counter() - started) * 1000
+
+        started = time.perf_counter()
+        result = _apply_basic_replacements(text, matcher)
+        match_ms = (time.perf_counter() - started) * 1000
+
+        if size <= 1_000:
+            started = time.perf_counter()
+            _naive_scan(text, replacements)
+            naive = f"{(time.perf_counter() - started) * 1000:9.1f} ms"
+        else:
+            naive = "  (skipped)"
+
+        print(
+            f"entries={size:>6}  build={build_ms:8.1f} ms  "
+            f"match={match_ms:7.1f} ms  naive={naive}  "
+            f"hits={len(result.spelling_corrections)}"
+        )
+
+
+if __name__ == "__main__":
+    tests = [
+        test_offsets_match_original_text,
+        test_leftmost_longest,
+        test_case_insensitive_with_exact_variant,
+        test_matcher_is_cached_per_version,
+        test_empty_text,
+        test_shipped_dictionary_files,
+        test_domain_dictionary_and_hot_reload,
+        test_untrusted_domain_values_fall_back_to_base,
+        test_load_dictionary_file_skips_malformed_lines,
+    ]
+    failed = 0
+    for test in tests:
+        try:
+            test()
+            print(f"✅ PASS - {test.__name__}")
+        except AssertionError as exc:
+            failed += 1
+            print(f"❌ FAIL - {test.__name__}: {exc}")
+
+    benchmark_matcher()
+    sys.exit(1 if failed else 0)
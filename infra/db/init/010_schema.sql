@@ -102,6 +102,16 @@ CREATE TABLE "USER" (
   "created_at" timestamptz NOT NULL DEFAULT (now())
 );
 
+CREATE TABLE "USER_STATS" (
+  "user_id" uuid PRIMARY KEY,
+  "total_documents" int NOT NULL DEFAULT 0,
+  "total_words" bigint NOT NULL DEFAULT 0,
+  "total_errors_found" bigint NOT NULL DEFAULT 0,
+  "total_errors_fixed" bigint NOT NULL DEFAULT 0,
+  "active_time_seconds" bigint NOT NULL DEFAULT 0,
+  "updated_at" timestamptz NOT NULL DEFAULT (now())
+);
+
 CREATE TABLE "WRITING_TYPE" (
   "id" uuid PRIMARY KEY DEFAULT gen_random_uuid(),
   "name" "WRITING_TYPE_NAME" UNIQUE NOT NULL,
@@ -139,6 +149,7 @@ CREATE TABLE "DOCUMENT" (
   "goal_id" uuid,
   "title" text NOT NULL DEFAULT 'Untitled',
   "content_full" text NOT NULL DEFAULT '',
+  "content_hash" text,
   "structure_json" jsonb NOT NULL DEFAULT '{}'::jsonb,
   "version" int NOT NULL DEFAULT 1,
   "word_count" int NOT NULL DEFAULT 0,
@@ -165,6 +176,7 @@ CREATE TABLE "PARAGRAPH" (
   "emb" real[],
   "word_count" int NOT NULL DEFAULT 0,
   "last_analyzed_version" int,
+  "changed_version" int,
   "updated_at" timestamptz NOT NULL DEFAULT (now())
 );
 
@@ -359,6 +371,10 @@ COMMENT ON COLUMN "RUBRIC_CRITERION"."weight" IS 'CHECK (weight >= 0 AND weight
 
 COMMENT ON COLUMN "DOCUMENT"."id" IS 'DEFAULT gen_random_uuid()';
 
+COMMENT ON COLUMN "USER_STATS"."user_id" IS 'ON DELETE CASCADE';
+
+COMMENT ON TABLE "USER_STATS" IS 'Maintained by triggers on DOCUMENT / WRITING_SESSION (030_triggers.sql)';
+
 COMMENT ON COLUMN "DOCUMENT"."user_id" IS 'ON DELETE CASCADE';
 
 COMMENT ON COLUMN "DOCUMENT"."goal_id" IS 'ON DELETE SET NULL';
@@ -381,6 +397,8 @@ COMMENT ON COLUMN "PARAGRAPH"."emb" IS 'pgvector extension; nullable for lazy co
 
 COMMENT ON COLUMN "PARAGRAPH"."last_analyzed_version" IS 'Enables incremental analysis';
 
+COMMENT ON COLUMN "PARAGRAPH"."changed_version" IS 'Document version when the paragraph content last changed; delta fetch';
+
 COMMENT ON COLUMN "SENTENCE"."id" IS 'DEFAULT gen_random_uuid()';
 
 COMMENT ON COLUMN "SENTENCE"."paragraph_id" IS 'ON DELETE CASCADE';
@@ -463,6 +481,8 @@ ALTER TABLE "GOAL" ADD FOREIGN KEY ("writing_type_id") REFERENCES "WRITING_TYPE"
 
 ALTER TABLE "RUBRIC_CRITERION" ADD FOREIGN KEY ("goal_id") REFERENCES "GOAL" ("id");
 
+ALTER TABLE "USER_STATS" ADD FOREIGN KEY ("user_id") REFERENCES "USER" ("id");
+
 ALTER TABLE "DOCUMENT" ADD FOREIGN KEY ("user_id") REFERENCES "USER" ("id");
 
 ALTER TABLE "DOCUMENT" ADD FOREIGN KEY ("goal_id") REFERENCES "GOAL" ("id");
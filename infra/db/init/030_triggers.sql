@@ -24,3 +24,83 @@ DROP TRIGGER IF EXISTS trg_claim_evidence_same_doc ON "CLAIM_EVIDENCE_LINK";
 CREATE TRIGGER trg_claim_evidence_same_doc
 BEFORE INSERT OR UPDATE ON "CLAIM_EVIDENCE_LINK"
 FOR EACH ROW EXECUTE FUNCTION ensure_claim_evidence_same_document();
+
+-- ============================================
+-- USER_STATS: rollup cho GET /api/users/me, cập nhật tăng dần theo DOCUMENT /
+-- WRITING_SESSION (cùng transaction với thay đổi gốc). Chỉ UPDATE dòng đã có:
+-- user cũ chưa có dòng được backfill bởi job reconcile
+-- (python -m app.services.user_stats) hoặc lần đầu gọi /api/users/me.
+-- Giữ đồng bộ với USER_STATS_DDL trong backend/app/services/user_stats.py.
+-- ============================================
+
+CREATE OR REPLACE FUNCTION user_stats_on_user_insert()
+RETURNS trigger AS $$
+BEGIN
+  INSERT INTO "USER_STATS" (user_id) VALUES (NEW.id) ON CONFLICT DO NOTHING;
+  RETURN NULL;
+END;
+$$ LANGUAGE plpgsql;
+
+CREATE OR REPLACE FUNCTION user_stats_on_document_change()
+RETURNS trigger AS $$
+BEGIN
+  IF TG_OP = 'UPDATE' AND OLD.user_id = NEW.user_id THEN
+    IF OLD.word_count IS DISTINCT FROM NEW.word_count THEN
+      UPDATE "USER_STATS"
+         SET total_words = total_words + NEW.word_count - OLD.word_count, updated_at = now()
+       WHERE user_id = NEW.user_id;
+    END IF;
+    RETURN NULL;
+  END IF;
+
+  IF TG_OP IN ('UPDATE', 'DELETE') THEN
+    UPDATE "USER_STATS"
+       SET total_documents = total_documents - 1, total_words = total_words - OLD.word_count, updated_at = now()
+     WHERE user_id = OLD.user_id;
+  END IF;
+  IF TG_OP IN ('INSERT', 'UPDATE') THEN
+    UPDATE "USER_STATS"
+       SET total_documents = total_documents + 1, total_words = total_words + NEW.word_count, updated_at = now()
+     WHERE user_id = NEW.user_id;
+  END IF;
+  RETURN NULL;
+END;
+$$ LANGUAGE plpgsql;
+
+CREATE OR REPLACE FUNCTION user_stats_on_session_change()
+RETURNS trigger AS $$
+BEGIN
+  IF TG_OP IN ('UPDATE', 'DELETE') THEN
+    UPDATE "USER_STATS"
+       SET total_errors_found = total_errors_found - OLD.errors_introduced,
+           total_errors_fixed = total_errors_fixed - OLD.errors_fixed,
+           active_time_seconds = active_time_seconds - OLD.active_time_seconds,
+           updated_at = now()
+     WHERE user_id = OLD.user_id;
+  END IF;
+  IF TG_OP IN ('INSERT', 'UPDATE') THEN
+    UPDATE "USER_STATS"
+       SET total_errors_found = total_errors_found + NEW.errors_introduced,
+           total_errors_fixed = total_errors_fixed + NEW.errors_fixed,
+           active_time_seconds = active_time_seconds + NEW.active_time_seconds,
+           updated_at = now()
+     WHERE user_id = NEW.user_id;
+  END IF;
+  RETURN NULL;
+END;
+$$ LANGUAGE plpgsql;
+
+DROP TRIGGER IF EXISTS trg_user_stats_user ON "USER";
+CREATE TRIGGER trg_user_stats_user
+AFTER INSERT ON "USER"
+FOR EACH ROW EXECUTE FUNCTION user_stats_on_user_insert();
+
+DROP TRIGGER IF EXISTS trg_user_stats_document ON "DOCUMENT";
+CREATE TRIGGER trg_user_stats_document
+AFTER INSERT OR DELETE OR UPDATE OF word_count, user_id ON "DOCUMENT"
+FOR EACH ROW EXECUTE FUNCTION user_stats_on_document_change();
+
+DROP TRIGGER IF EXISTS trg_user_stats_session ON "WRITING_SESSION";
+CREATE TRIGGER trg_user_stats_session
+AFTER INSERT OR DELETE OR UPDATE OF errors_introduced, errors_fixed, active_time_seconds, user_id ON "WRITING_SESSION"
+FOR EACH ROW EXECUTE FUNCTION user_stats_on_session_change();